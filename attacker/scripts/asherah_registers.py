@@ -0,0 +1,295 @@
+"""
+Asherah (MBANS) Modbus register layout, transcribed from
+docs/Registres_modbus.md.
+
+Analog values travel as uint16 scaled linearly over [minimum, maximum]:
+
+    raw = (value - minimum) / (maximum - minimum) * 65535
+
+Bits (coils and discrete inputs) have no unit and use minimum 0, maximum 1.
+
+Each table is also compiled into a RegisterMap: tag addresses, scales and
+offsets as NumPy arrays, so a whole block read (or every row of a
+recording) is decoded in one vectorized expression, and engineering values
+are encoded back to raw for writes:
+
+    INPUT_REGISTER_MAP.decode(result.registers)            # 95 values
+    INPUT_REGISTER_MAP.decode(rows['registers'][:, :95])   # (rows, 95)
+    HOLDING_REGISTER_MAP.encode_value("CTRL_RXPowerSetpoint", 100)
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+RAW_MAX = 65535
+
+Tag = namedtuple("Tag", "address name nominal minimum maximum unit", defaults=(0, 1, ""))
+
+COILS = [
+    Tag(0, "RC1_PumpOnOffCmd", 1),
+    Tag(1, "RC2_PumpOnOffCmd", 1),
+    Tag(2, "CR_SCRAMCmd", 0),
+    Tag(3, "PZ_BackupHeaterPowCmd", 0),
+    Tag(4, "AF_MakeupPumpCmd", 1),
+    Tag(5, "SD_SafetyValveCmd", 0),
+    Tag(6, "TB_IsoValveCmd", 1),
+    Tag(7, "CC_PumpOnOffCmd", 1),
+    Tag(8, "FW_Pump1OnOffCmd", 1),
+    Tag(9, "FW_Pump2OnOffCmd", 1),
+    Tag(10, "FW_Pump3OnOffCmd", 0),
+    Tag(11, "CE_Pump1OnOffCmd", 1),
+    Tag(12, "CE_Pump2OnOffCmd", 1),
+    Tag(13, "CE_Pump3OnOffCmd", 0),
+    Tag(14, "INT_SimulationStopCmd", 0),
+]
+
+DISCRETE_INPUTS = [
+    Tag(0, "CR_SCRAM", 0),
+    Tag(1, "AF_MakeupPumpOnOff", 1),
+    Tag(2, "SD_SafetyValvePos", 0),
+    Tag(3, "TB_IsoValvePos", 1),
+    Tag(4, "GN_GenBreak", 1),
+    Tag(5, "CC_PumpOnOff", 1),
+    Tag(6, "FW_Pump1OnOff", 1),
+    Tag(7, "FW_Pump2OnOff", 1),
+    Tag(8, "FW_Pump3OnOff", 0),
+    Tag(9, "CE_Pump1OnOff", 1),
+    Tag(10, "CE_Pump2OnOff", 1),
+    Tag(11, "CE_Pump3OnOff", 0),
+]
+
+HOLDING_REGISTERS = [
+    Tag(0, "RC1_PumpSpeedCmd", 100, 0, 100, "%"),
+    Tag(1, "RC2_PumpSpeedCmd", 100, 0, 100, "%"),
+    Tag(2, "CR_PosCmd", 833, 0, 1000, "step"),
+    Tag(3, "PZ_MainHeaterPowCmd", 0, 0, 100, "%"),
+    Tag(4, "PZ_CL1SprayValveCmd", 0, 0, 100, "%"),
+    Tag(5, "PZ_CL2SprayValveCmd", 0, 0, 100, "%"),
+    Tag(6, "AF_MakeupValveCmd", 0, 0, 100, "%"),
+    Tag(7, "AF_LetdownValveCmd", 0, 0, 100, "%"),
+    Tag(8, "SD_CtrlValveCmd", 0, 0, 100, "%"),
+    Tag(9, "TB_SpeedCtrlValveCmd", 100, 0, 100, "%"),
+    Tag(10, "CC_PumpSpeedCmd", 100, 0, 100, "%"),
+    Tag(11, "FW_Pump1SpeedCmd", 100, 0, 100, "%"),
+    Tag(12, "FW_Pump2SpeedCmd", 100, 0, 100, "%"),
+    Tag(13, "FW_Pump3SpeedCmd", 0, 0, 100, "%"),
+    Tag(14, "CE_Pump1SpeedCmd", 100, 0, 100, "%"),
+    Tag(15, "CE_Pump2SpeedCmd", 100, 0, 100, "%"),
+    Tag(16, "CE_Pump3SpeedCmd", 0, 0, 100, "%"),
+    Tag(17, "CTRL_RXPowerSetpoint", 100, 0, 110, "%"),
+    Tag(18, "CTRL_PZPressSetPoint", 15.106, 0, 18, "MPa"),
+]
+
+INPUT_REGISTERS = [
+    Tag(0, "RC1_PumpDiffPress", 1.051, 0, 5, "MPa"),
+    Tag(1, "RC1_PumpSpeed", 100, 0, 100, "%"),
+    Tag(2, "RC1_PumpFlow", 8206.6, 0, 10000, "kg/s"),
+    Tag(3, "RC1_PumpTemp", 338.15, 0, 1000, "K"),
+    Tag(4, "RC2_PumpDiffPress", 1.051, 0, 5, "MPa"),
+    Tag(5, "RC2_PumpSpeed", 100, 0, 100, "%"),
+    Tag(6, "RC2_PumpFlow", 8206.6, 0, 10000, "kg/s"),
+    Tag(7, "RC2_PumpTemp", 338.15, 0, 1000, "K"),
+    Tag(8, "RX_MeanCoolTemp", 576.75, 0, 1000, "K"),
+    Tag(9, "RX_InCoolTemp", 562.94, 0, 1000, "K"),
+    Tag(10, "RX_OutCoolTemp", 590.62, 0, 1000, "K"),
+    Tag(11, "RX_CladTemp", 948.28, 0, 1000, "K"),
+    Tag(12, "RX_FuelTemp", 948.28, 0, 1000, "K"),
+    Tag(13, "RX_TotalReac", 6.1835e-06, -1e-5, 1e-5, "$"),
+    Tag(14, "RX_ReactorPower", 100, 0, 120, "%"),
+    Tag(15, "RX_ReactorPress", 15.166, 0, 20, "MPa"),
+    Tag(16, "RX_CL1Press", 15.365, 0, 20, "MPa"),
+    Tag(17, "RX_CL2Press", 15.365, 0, 20, "MPa"),
+    Tag(18, "RX_CL1Flow", 8801.4, 0, 10000, "kg/s"),
+    Tag(19, "RX_CL2Flow", 8801.4, 0, 10000, "kg/s"),
+    Tag(20, "CR_Position", 833, 0, 1000, "step"),
+    Tag(21, "PZ_Press", 15.106, 0, 20, "MPa"),
+    Tag(22, "PZ_Temp", 586.95, 0, 1000, "K"),
+    Tag(23, "PZ_Level", 6, 0, 10, "m"),
+    Tag(24, "SG1_InletTemp", 590.48, 0, 1000, "K"),
+    Tag(25, "SG1_OutletTemp", 562.9, 0, 1000, "K"),
+    Tag(26, "SG2_InletTemp", 590.48, 0, 1000, "K"),
+    Tag(27, "SG2_OutletTemp", 562.9, 0, 1000, "K"),
+    Tag(28, "AF_MakeupValvePos", 0, 0, 100, "%"),
+    Tag(29, "AF_LetdownValvePos", 0, 0, 100, "%"),
+    Tag(30, "AF_MakeupFlow", 0, 0, 1000, "kg/s"),
+    Tag(31, "AF_LetdownFlow", 0, 0, 1000, "kg/s"),
+    Tag(32, "SG1_InletWaterTemp", 495.77, 0, 1000, "K"),
+    Tag(33, "SG1_OutletSteamTemp", 553.08, 0, 1000, "K"),
+    Tag(34, "SG1_InletWaterFlow", 745.14, 0, 1000, "kg/s"),
+    Tag(35, "SG1_OutletSteamFlow", 745.14, 0, 1000, "kg/s"),
+    Tag(36, "SG1_WaterTemp", 553.08, 0, 1000, "K"),
+    Tag(37, "SG1_SteamTemp", 553.08, 0, 1000, "K"),
+    Tag(38, "SG1_Press", 6.41, 0, 20, "MPa"),
+    Tag(39, "SG1_Level", 15, 0, 20, "m"),
+    Tag(40, "SG2_InletWaterTemp", 495.77, 0, 1000, "K"),
+    Tag(41, "SG2_OutletSteamTemp", 553.08, 0, 1000, "K"),
+    Tag(42, "SG2_InletWaterFlow", 745.14, 0, 1000, "kg/s"),
+    Tag(43, "SG2_OutletSteamFlow", 745.14, 0, 1000, "kg/s"),
+    Tag(44, "SG2_WaterTemp", 553.08, 0, 1000, "K"),
+    Tag(45, "SG2_SteamTemp", 553.08, 0, 1000, "K"),
+    Tag(46, "SG2_Press", 6.41, 0, 20, "MPa"),
+    Tag(47, "SG2_Level", 15, 0, 20, "m"),
+    Tag(48, "SD_CtrlValvePos", 0, 0, 100, "%"),
+    Tag(49, "TB_Speed", 157.08, 0, 250, "rad/s"),
+    Tag(50, "TB_InSteamPress", 6.41, 0, 20, "MPa"),
+    Tag(51, "TB_OutSteamPress", 5200, 0, 10000, "Pa"),
+    Tag(52, "TB_SpeedCtrlValvePos", 100, 0, 100, "%"),
+    Tag(53, "TB_InSteamFlow", 1490.28, 0, 2000, "kg/s"),
+    Tag(54, "GN_GenElecPow", 789, 0, 1000, "MW"),
+    Tag(55, "GN_GridFreq", 50, 0, 100, "Hz"),
+    Tag(56, "GN_GenFreq", 50, 0, 100, "Hz"),
+    Tag(57, "CD_Level", 1, 0, 2, "m"),
+    Tag(58, "CD_SteamTemp", 306.46, 0, 1000, "K"),
+    Tag(59, "CD_CondTemp", 306.46, 0, 1000, "K"),
+    Tag(60, "CD_Press", 5200, 0, 10000, "Pa"),
+    Tag(61, "CD_InSteamFlow", 1490.28, 0, 2000, "kg/s"),
+    Tag(62, "CD_OutCondFlow", 1490.28, 0, 2000, "kg/s"),
+    Tag(63, "CC_PumpInletTemp", 298.15, 0, 1000, "K"),
+    Tag(64, "CC_PumpOutletTemp", 302.48, 0, 1000, "K"),
+    Tag(65, "CC_PumpSpeed", 100, 0, 100, "%"),
+    Tag(66, "CC_PumpFlow", 1.73e5, 0, 2e5, "kg/s"),
+    Tag(67, "CC_PumpTemp", 338.15, 0, 1000, "K"),
+    Tag(68, "FW_TankPress", 1, 0, 2, "MPa"),
+    Tag(69, "FW_TankLevel", 4, 0, 10, "m"),
+    Tag(70, "FW_Pump1DiffPress", 5.41, 0, 20, "MPa"),
+    Tag(71, "FW_Pump1Flow", 745.14, 0, 1000, "kg/s"),
+    Tag(72, "FW_Pump1Speed", 100, 0, 120, "%"),
+    Tag(73, "FW_Pump1Temp", 343.15, 0, 1000, "K"),
+    Tag(74, "FW_Pump2DiffPress", 5.41, 0, 20, "MPa"),
+    Tag(75, "FW_Pump2Flow", 745.14, 0, 1000, "kg/s"),
+    Tag(76, "FW_Pump2Speed", 100, 0, 120, "%"),
+    Tag(77, "FW_Pump2Temp", 343.15, 0, 1000, "K"),
+    Tag(78, "FW_Pump3DiffPress", 5.41, 0, 20, "MPa"),
+    Tag(79, "FW_Pump3Flow", 0, 0, 1000, "kg/s"),
+    Tag(80, "FW_Pump3Speed", 0, 0, 120, "%"),
+    Tag(81, "FW_Pump3Temp", 343.15, 0, 1000, "K"),
+    Tag(82, "CE_Pump1DiffPress", 0.9948, 0, 20, "MPa"),
+    Tag(83, "CE_Pump1Speed", 100, 0, 120, "%"),
+    Tag(84, "CE_Pump1Flow", 745.14, 0, 1000, "kg/s"),
+    Tag(85, "CE_Pump1Temp", 343.15, 0, 1000, "K"),
+    Tag(86, "CE_Pump2DiffPress", 0.9948, 0, 20, "MPa"),
+    Tag(87, "CE_Pump2Speed", 100, 0, 120, "%"),
+    Tag(88, "CE_Pump2Flow", 745.14, 0, 1000, "kg/s"),
+    Tag(89, "CE_Pump2Temp", 343.15, 0, 1000, "K"),
+    Tag(90, "CE_Pump3DiffPress", 0.9948, 0, 20, "MPa"),
+    Tag(91, "CE_Pump3Speed", 0, 0, 120, "%"),
+    Tag(92, "CE_Pump3Flow", 0, 0, 1000, "kg/s"),
+    Tag(93, "CE_Pump3Temp", 343.15, 0, 1000, "K"),
+    Tag(94, "INT_SimulationTime", 0, 0, 65535, "s"),
+]
+
+
+TABLES = {
+    "coils": COILS,
+    "discrete_inputs": DISCRETE_INPUTS,
+    "holding_registers": HOLDING_REGISTERS,
+    "input_registers": INPUT_REGISTERS,
+}
+
+
+def to_raw(value, minimum, maximum):
+    """Engineering value -> uint16 register value."""
+    if maximum == minimum:
+        return 0
+    raw = round((value - minimum) / (maximum - minimum) * RAW_MAX)
+    return min(RAW_MAX, max(0, raw))
+
+
+def from_raw(raw, minimum, maximum):
+    """uint16 register value -> engineering value."""
+    return minimum + raw / RAW_MAX * (maximum - minimum)
+
+
+def nominal_values(table):
+    """Raw values of a table at nominal operation, indexed by address."""
+    values = [0] * (max(tag.address for tag in table) + 1)
+    for tag in table:
+        if not tag.unit:  # Coil / discrete input
+            values[tag.address] = int(tag.nominal)
+        else:
+            values[tag.address] = to_raw(tag.nominal, tag.minimum, tag.maximum)
+    return values
+
+
+class RegisterMap:
+    """Tags of one table compiled into index/scale/offset arrays.
+
+    decode() maps raw registers to engineering values for every tag at once:
+
+        value = raw[..., address - start] * scale + offset
+
+    `registers` may have any leading shape (one read, or a 2-D array of
+    recorded rows) and must cover every tag of the map from `start` on.
+    With celsius=True, kelvin tags are converted to degrees Celsius.
+    """
+
+    def __init__(self, tags, celsius=False):
+        self.tags = list(tags)
+        self.celsius = celsius
+        self.names = [tag.name for tag in self.tags]
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self.addresses = np.array([tag.address for tag in self.tags], np.intp)
+        bits = np.array([not tag.unit for tag in self.tags], bool)
+        minimum = np.array([tag.minimum for tag in self.tags], float)
+        maximum = np.array([tag.maximum for tag in self.tags], float)
+        self.scale = np.where(bits, 1.0, (maximum - minimum) / RAW_MAX)
+        self.offset = np.where(bits, 0.0, minimum)
+        self.units = [tag.unit for tag in self.tags]
+        if celsius:
+            kelvin = np.array([unit == "K" for unit in self.units], bool)
+            self.offset = self.offset - 273.15 * kelvin
+            self.units = ["°C" if unit == "K" else unit for unit in self.units]
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def tag(self, name):
+        return self.tags[self.positions[name]]
+
+    def unit(self, name):
+        return self.units[self.positions[name]]
+
+    def subset(self, names, celsius=None):
+        """Map restricted to `names`, in that order."""
+        return RegisterMap([self.tag(name) for name in names], self.celsius if celsius is None else celsius)
+
+    def span(self):
+        """(start, count) of the smallest block read covering every tag."""
+        start = int(self.addresses.min())
+        return start, int(self.addresses.max()) - start + 1
+
+    def decode(self, registers, start=0):
+        """Engineering values of every tag (last axis in tag order) from a raw block."""
+        raw = np.asarray(registers)
+        index = self.addresses - start
+        if len(index) and (index.min() < 0 or index.max() >= raw.shape[-1]):
+            raise ValueError(f"registers {start}-{start + raw.shape[-1] - 1} do not cover every tag")
+        return raw[..., index] * self.scale + self.offset
+
+    def decode_dict(self, registers, start=0):
+        """{tag name: value} of one block read."""
+        return dict(zip(self.names, self.decode(registers, start).tolist()))
+
+    def encode(self, values):
+        """Raw uint16 values for engineering `values` given in tag order (rounded, clipped)."""
+        raw = np.rint((np.asarray(values, float) - self.offset) / self.scale)
+        return np.clip(raw, 0, RAW_MAX).astype(np.uint16)
+
+    def decode_value(self, name, raw):
+        i = self.positions[name]
+        return float(raw * self.scale[i] + self.offset[i])
+
+    def encode_value(self, name, value):
+        """Raw register value for one tag, clipped to the register range."""
+        i = self.positions[name]
+        return int(min(RAW_MAX, max(0, round((value - self.offset[i]) / self.scale[i]))))
+
+
+COIL_MAP = RegisterMap(COILS)
+DISCRETE_INPUT_MAP = RegisterMap(DISCRETE_INPUTS)
+HOLDING_REGISTER_MAP = RegisterMap(HOLDING_REGISTERS)
+INPUT_REGISTER_MAP = RegisterMap(INPUT_REGISTERS)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Control plane of the Modbus MITM proxy.
+
+Commands are JSON objects sent one per line to a local Unix socket; each
+gets exactly one JSON line back:
+
+    {"cmd": "mode", "mode": "replay", "timing": "timed", "speed": 2}
+    -> {"ok": true, "mode": "REPLAY", "generation": 3}
+    {"cmd": "load", "file": "missing.rec"}
+    -> {"ok": false, "error": "cannot load missing.rec"}
+
+Commands: mode, stop, save, load, status, stats, quit.
+
+Every command runs on the proxy's event loop, the thread that also
+intercepts responses, so its effect is applied entirely between two
+responses. The slow parts (finishing a recording, loading or saving a
+file, compiling replay frames) run in an executor meanwhile, so the
+proxy keeps forwarding while they take; the previous mode stays in
+effect until then.
+The interactive REPL accepts the same commands in text form through
+parse_command(), and arp_mitm.sh drives its scenario with this client.
+
+Client usage:
+    python3 control_plane.py status
+    python3 control_plane.py record
+    python3 control_plane.py replay timed 2
+    python3 control_plane.py '{"cmd": "stats"}'
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+
+CONTROL_SOCKET = "/tmp/mitm_control.sock"
+MODES = ("passthrough", "record", "replay")
+COMMAND_TIMEOUT = 300.0  # Seconds a client waits for its reply (loading or compiling a long recording)
+
+
+class CommandError(Exception):
+    """Raised for a malformed or failed control command."""
+
+
+def parse_command(line):
+    """Turn a REPL line ("replay timed 2", "load x.rec", or raw JSON) into a command dict."""
+    line = line.strip()
+    if line.startswith("{"):
+        try:
+            command = json.loads(line)
+        except ValueError as e:
+            raise CommandError(f"invalid JSON: {e}")
+        if not isinstance(command, dict) or "cmd" not in command:
+            raise CommandError('a command needs a "cmd" field')
+        return command
+
+    words = line.lower().split()
+    if not words:
+        raise CommandError("empty command")
+    name, args = words[0], words[1:]
+    if name in MODES:
+        command = {"cmd": "mode", "mode": name}
+        if name == "replay" and args:
+            if args[0] not in ("timed", "sequential"):
+                raise CommandError("usage: replay [timed|sequential] [speed]")
+            command["timing"] = args[0]
+            if len(args) > 1:
+                try:
+                    command["speed"] = float(args[1])
+                except ValueError:
+                    raise CommandError(f"invalid speed {args[1]!r}")
+        return command
+    if name == "load":
+        return {"cmd": "load", "file": line.split()[1]} if args else {"cmd": "load"}
+    if name in ("stop", "save", "status", "stats", "quit"):
+        return {"cmd": name}
+    raise CommandError(f"unknown command {name!r}")
+
+
+async def cmd_mode(mitm, command):
+    mode = str(command.get("mode", "")).lower()
+    if mode not in MODES:
+        raise CommandError(f"mode must be one of {', '.join(MODES)}")
+    replay_attack = mitm.replay_attack
+    replay_options = {}
+    if mode == "replay":
+        timing = command.get("timing", replay_attack.replay_timing)
+        if timing not in ("timed", "sequential"):
+            raise CommandError("timing must be timed or sequential")
+        speed = float(command.get("speed", replay_attack.replay_speed))
+        if speed <= 0:
+            raise CommandError("speed must be positive")
+        loop = bool(command.get("loop", replay_attack.replay_loop))
+        replay_options = {"loop": loop, "timing": timing, "speed": speed}
+    if not await mitm.switch_mode(mode, **replay_options):
+        raise CommandError(f"cannot switch to {mode.upper()}")
+    return {"mode": mitm.state.mode, "generation": mitm.state.generation}
+
+
+async def cmd_stop(mitm, command):
+    """Stop recording or replaying and go back to passthrough."""
+    return await cmd_mode(mitm, {"mode": "passthrough"})
+
+
+async def cmd_save(mitm, command):
+    replay_attack = mitm.replay_attack
+    async with mitm.switching:
+        if replay_attack.writer is not None:
+            replay_attack.save_recording()  # Only reports where it is being streamed
+            return {"file": replay_attack.stream_file}
+        await asyncio.get_running_loop().run_in_executor(
+            None, replay_attack.write_recording, replay_attack.recorded_data, replay_attack.record_file)
+    return {"file": replay_attack.record_file}
+
+
+async def cmd_load(mitm, command):
+    replay_attack = mitm.replay_attack
+    async with mitm.switching:
+        if mitm.state.mode != "PASSTHROUGH":
+            raise CommandError("stop recording/replaying before loading a file")
+        path = command.get("file", replay_attack.record_file)
+        recording = await asyncio.get_running_loop().run_in_executor(None, replay_attack.read_recording, path)
+        if recording is None:
+            raise CommandError(f"cannot load {path}")
+        replay_attack.record_file = path
+        replay_attack.recorded_data = recording
+    return {"file": path, "samples": len(recording), "duration": recording.duration}
+
+
+async def cmd_status(mitm, command):
+    return mitm.status()
+
+
+async def cmd_stats(mitm, command):
+    return mitm.metrics_snapshot()
+
+
+async def cmd_quit(mitm, command):
+    mitm.stop()
+    return {}
+
+
+COMMANDS = {
+    "mode": cmd_mode,
+    "stop": cmd_stop,
+    "save": cmd_save,
+    "load": cmd_load,
+    "status": cmd_status,
+    "stats": cmd_stats,
+    "quit": cmd_quit,
+}
+
+
+async def execute(mitm, command):
+    """Run one command dict against `mitm` and return its reply dict.
+
+    Must be awaited on the proxy's event loop (or before it starts);
+    ModbusMITM.control() takes care of that from other threads.
+    """
+    handler = COMMANDS.get(command.get("cmd")) if isinstance(command, dict) else None
+    if handler is None:
+        return {"ok": False, "error": f"unknown command; expected one of {', '.join(COMMANDS)}"}
+    try:
+        reply = await handler(mitm, command)
+    except CommandError as e:
+        return {"ok": False, "error": str(e)}
+    except Exception as e:
+        print(f" Control command {command['cmd']} failed: {e}")
+        return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    return {"ok": True, **reply}
+
+
+async def serve_control(path, mitm):
+    """Accept JSON commands on a Unix socket at `path`. Returns the asyncio server."""
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = None
+                try:
+                    command = parse_command(line.decode(errors="replace"))
+                    reply = await execute(mitm, command)
+                except CommandError as e:
+                    reply = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+                if command is not None and command["cmd"] == "quit":
+                    break  # The proxy is shutting down
+        except (OSError, ValueError):
+            pass  # ValueError: line longer than the stream limit
+        finally:
+            writer.close()
+
+    if os.path.exists(path):
+        os.unlink(path)  # Left over by a proxy that did not shut down cleanly
+    server = await asyncio.start_unix_server(handle, path)
+    os.chmod(path, 0o600)
+    return server
+
+
+def send_command(command, path=CONTROL_SOCKET, timeout=COMMAND_TIMEOUT):
+    """Send one command dict to a running proxy and return its reply dict."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(json.dumps(command).encode() + b"\n")
+        reply = b""
+        while not reply.endswith(b"\n"):
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            reply += chunk
+    if not reply:
+        raise ConnectionError("proxy closed the control connection")
+    return json.loads(reply)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send a command to a running Modbus MITM proxy")
+    parser.add_argument("--socket", default=CONTROL_SOCKET, help="Proxy control socket")
+    parser.add_argument("--timeout", type=float, default=COMMAND_TIMEOUT, help="Seconds to wait for the reply")
+    parser.add_argument("command", nargs="+", help='e.g. "status", "replay timed 2" or a JSON object')
+    args = parser.parse_args()
+
+    try:
+        command = parse_command(" ".join(args.command))
+        reply = send_command(command, args.socket, args.timeout)
+    except CommandError as e:
+        parser.error(str(e))
+    except OSError as e:
+        print(f" Cannot reach the proxy on {args.socket}: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    print(json.dumps(reply, indent=2))
+    sys.exit(0 if reply.get("ok") else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+In-process historian for the live monitors.
+
+Every reading is kept at full resolution in a preallocated ring buffer,
+and folded into min/max/mean rollups at 1 s, 10 s and 1 min, each in its
+own ring. Rows hold one column per tag, so a tag's history is a strided
+view of its ring:
+
+    tier   period   capacity   default span
+    raw    -        36000      1 h at 10 Hz
+    1s     1 s      172800     2 days
+    10s    10 s     120960     14 days
+    1min   60 s     129600     90 days
+
+The rings are memory-mapped .npy files in one directory, along with their
+write positions, so a restarted monitor keeps its history and resumes
+the rollup buckets it had open (readings still in an open bucket are lost
+only if it is killed). The CLI maps the rings read-only. Timestamps
+are wall-clock seconds and only move forward, so a time range is found by
+binary search in at most two contiguous slices of a ring.
+
+    history = Historian("history", ["power", "fuel_temp"])
+    history.append([100.0, 675.1])
+    series = history.query(start=time.time() - 3600, resolution="auto")
+    series["mean"][:, 0]    # power over the last hour, coarsest tier needed
+
+Usage:
+    python3 historian.py info history
+    python3 historian.py query history --last 600 --resolution 10s --tags power
+    python3 historian.py export history trends.csv --last 86400 --resolution 1min
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+RAW_CAPACITY = 36000
+TIERS = (
+    ("1s", 1, 172800),
+    ("10s", 10, 120960),
+    ("1min", 60, 129600),
+)
+RESOLUTIONS = ("auto", "raw") + tuple(name for name, _, _ in TIERS)
+MAX_POINTS = 1000  # resolution="auto" picks the finest tier returning at most this many rows
+META_FILE = "historian.json"
+
+
+def raw_dtype(width):
+    return np.dtype([("time", "<f8"), ("value", "<f4", (width,))])
+
+
+def rollup_dtype(width):
+    return np.dtype([("time", "<f8"), ("count", "<u4"),
+                     ("min", "<f4", (width,)), ("max", "<f4", (width,)), ("mean", "<f4", (width,))])
+
+
+class RingBuffer:
+    """Fixed-capacity ring of structured rows in a memory-mapped .npy file.
+
+    The write position and row count live in a second small memmap
+    (<name>.state.npy), updated after each row. A read-only ring maps
+    existing files with mode "r" and never creates them.
+    """
+
+    def __init__(self, path, dtype, capacity, read_only=False):
+        self.path = path
+        state_path = path[:-len(".npy")] + ".state.npy"
+        if os.path.exists(path) or read_only:
+            mode = "r" if read_only else "r+"
+            self.rows = np.load(path, mmap_mode=mode)
+            self.state = np.load(state_path, mmap_mode=mode)
+            if self.rows.dtype != dtype or len(self.rows) != capacity:
+                raise ValueError(f"{path} has another layout ({self.rows.dtype}, {len(self.rows)} rows)")
+        else:
+            self.rows = np.lib.format.open_memmap(path, "w+", dtype, (capacity,))
+            self.state = np.lib.format.open_memmap(state_path, "w+", np.int64, (2,))
+        self.capacity = capacity
+
+    @property
+    def head(self):
+        """Index the next row is written to."""
+        return int(self.state[0])
+
+    def __len__(self):
+        return int(self.state[1])
+
+    def append(self, row):
+        head = self.head
+        self.rows[head] = row
+        self.state[0] = (head + 1) % self.capacity
+        self.state[1] = min(self.capacity, len(self) + 1)
+
+    def last(self):
+        """Copy of the newest row."""
+        return self.rows[(self.head - 1) % self.capacity].copy()
+
+    def replace_last(self, row):
+        """Overwrite the newest row in place."""
+        self.rows[(self.head - 1) % self.capacity] = row
+
+    def segments(self):
+        """Rows in chronological order, as at most two views of the ring."""
+        head, count = self.head, len(self)
+        if count < self.capacity:
+            return [self.rows[:count]]
+        return [self.rows[head:], self.rows[:head]]
+
+    def first_time(self):
+        return float(self.segments()[0]["time"][0]) if len(self) else None
+
+    def last_time(self):
+        return float(self.rows["time"][self.head - 1]) if len(self) else None
+
+    def _slices(self, start, end):
+        """Views of the rows with start <= time < end, oldest first."""
+        parts = []
+        for segment in self.segments():
+            times = segment["time"]
+            lo = 0 if start is None else int(np.searchsorted(times, start, "left"))
+            hi = len(times) if end is None else int(np.searchsorted(times, end, "left"))
+            if hi > lo:
+                parts.append(segment[lo:hi])
+        return parts
+
+    def count(self, start=None, end=None):
+        """Number of rows with start <= time < end."""
+        return sum(len(part) for part in self._slices(start, end))
+
+    def range(self, start=None, end=None):
+        """Copy of the rows with start <= time < end, oldest first."""
+        parts = self._slices(start, end)
+        if not parts:
+            return np.empty(0, self.rows.dtype)
+        return np.concatenate(parts)
+
+    def flush(self):
+        self.rows.flush()
+        self.state.flush()
+
+
+class Rollup:
+    """Open bucket of one tier: running count, min, max and sum per tag."""
+
+    def __init__(self, period, width):
+        self.period = period
+        self.start = None
+        self.count = 0
+        self.min = np.empty(width, np.float64)
+        self.max = np.empty(width, np.float64)
+        self.sum = np.zeros(width, np.float64)
+        self.stored = False  # The open bucket is already the ring's newest row (reopened)
+
+    def add(self, t, minimum, maximum, total, count):
+        """Fold readings in; returns the previous bucket as a row tuple if `t` starts a new one."""
+        bucket = t - t % self.period
+        closed = None
+        if self.start is not None and bucket > self.start:
+            closed = self.close()
+        if self.count == 0:
+            self.start = bucket
+            self.min[:] = minimum
+            self.max[:] = maximum
+            self.sum[:] = total
+        else:
+            np.minimum(self.min, minimum, out=self.min)
+            np.maximum(self.max, maximum, out=self.max)
+            self.sum += total
+        self.count += count
+        return closed
+
+    def reopen(self, row):
+        """Continue the bucket stored as `row` (a ring row written by close()).
+
+        The row stays in the ring: the bucket replaces it when it closes.
+        """
+        self.stored = True
+        self.start = float(row["time"])
+        self.count = int(row["count"])
+        self.min[:] = row["min"]
+        self.max[:] = row["max"]
+        self.sum[:] = row["mean"].astype(np.float64) * self.count
+
+    def close(self):
+        """Row tuple of the open bucket (None if empty), and reset it."""
+        if self.count == 0:
+            return None
+        row = (self.start, self.count, self.min.copy(), self.max.copy(), self.sum / self.count)
+        self.start = None
+        self.count = 0
+        return row
+
+
+class Historian:
+    """Full-resolution ring plus 1s/10s/1min rollup rings for a fixed set of tags."""
+
+    def __init__(self, directory, tags, raw_capacity=RAW_CAPACITY, tiers=TIERS, read_only=False):
+        self.directory = directory
+        self.tags = list(tags)
+        self.index = {tag: i for i, tag in enumerate(self.tags)}
+        self.read_only = read_only
+        width = len(self.tags)
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+
+        meta = {"tags": self.tags, "raw_capacity": raw_capacity, "tiers": [list(tier) for tier in tiers]}
+        meta_path = os.path.join(directory, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                existing = json.load(f)
+            if existing != meta:
+                raise ValueError(f"history in {directory} was created for other tags or capacities")
+        elif read_only:
+            raise FileNotFoundError(f"no {META_FILE} in {directory}")
+        else:
+            with open(meta_path, "w") as f:
+                json.dump(meta, f, indent=2)
+
+        self.raw = RingBuffer(os.path.join(directory, "raw.npy"), raw_dtype(width), raw_capacity, read_only)
+        self.tiers = {}
+        self.rollups = []
+        for name, period, capacity in tiers:
+            self.tiers[name] = RingBuffer(os.path.join(directory, f"{name}.npy"), rollup_dtype(width), capacity,
+                                          read_only)
+            self.rollups.append((name, Rollup(period, width)))
+        self.periods = {name: period for name, period, _ in tiers}
+        self.last_time = self.raw.last_time() or 0.0
+        if read_only:
+            return
+        # close() stored each tier's open bucket as its newest row: continue
+        # it, so readings after a restart land in the same bucket. The row is
+        # only overwritten when that bucket closes again, so a writer killed
+        # before then leaves it as it was.
+        for name, rollup in self.rollups:
+            if len(self.tiers[name]):
+                rollup.reopen(self.tiers[name].last())
+
+    def _store(self, name, rollup, row):
+        """Write a closed bucket: over its old row if it was reopened, else as a new row."""
+        if rollup.stored:
+            self.tiers[name].replace_last(row)
+            rollup.stored = False
+        else:
+            self.tiers[name].append(row)
+
+    def append(self, values, t=None):
+        """Record one reading: `values` in tag order (or a {tag: value} dict), at `t` (default now)."""
+        if isinstance(values, dict):
+            values = [values[tag] for tag in self.tags]
+        values = np.asarray(values, np.float64)
+        t = time.time() if t is None else t
+        t = max(t, self.last_time)  # Keep every ring sorted if the clock steps back
+        self.last_time = t
+        self.raw.append((t, values))
+
+        # The 1 s tier takes the reading; each coarser tier takes the buckets
+        # the tier below closes, so the cascade stops at the first one still open
+        minimum = maximum = total = values
+        count = 1
+        for name, rollup in self.rollups:
+            closed = rollup.add(t, minimum, maximum, total, count)
+            if closed is None:
+                break
+            self._store(name, rollup, closed)
+            t, count, minimum, maximum, mean = closed
+            total = mean * count
+
+    def flush(self):
+        self.raw.flush()
+        for ring in self.tiers.values():
+            ring.flush()
+
+    def close(self):
+        """Write the open rollup buckets and flush every ring to disk.
+
+        Each open bucket is stored as is, without folding it into the next
+        tier, so the next Historian on this directory can reopen it.
+        """
+        for name, rollup in self.rollups:
+            closed = rollup.close()
+            if closed is not None:
+                self._store(name, rollup, closed)
+        self.flush()
+
+    def coverage(self, name):
+        """(first, last) timestamps held by a tier ("raw" or a rollup name)."""
+        ring = self.raw if name == "raw" else self.tiers[name]
+        return ring.first_time(), ring.last_time()
+
+    def pick_resolution(self, start, end, max_points=MAX_POINTS):
+        """Finest tier that still holds `start` and returns at most `max_points` rows."""
+        names = ("raw",) + tuple(self.tiers)
+        if start is None:  # Everything recorded: as far back as the longest tier goes
+            start = min((self.coverage(name)[0] for name in names if self.coverage(name)[0] is not None),
+                        default=None)
+        end = self.last_time if end is None else end
+        for name in names:
+            first, _ = self.coverage(name)
+            if first is None or start is None or first > start:
+                continue
+            period = self.periods.get(name)
+            rows = self.raw.count(start, end) if period is None else (end - start) / period
+            if rows <= max_points:
+                return name
+        return tuple(self.tiers)[-1] if self.tiers else "raw"
+
+    def query(self, start=None, end=None, tags=None, resolution="auto", max_points=MAX_POINTS):
+        """Readings with start <= time < end.
+
+        Returns {"resolution", "tags", "time", "min", "max", "mean", "count"};
+        the value arrays are (rows, len(tags)). At raw resolution min, max
+        and mean are the readings themselves and count is 1.
+        """
+        if resolution == "auto":
+            resolution = self.pick_resolution(start, end, max_points)
+        columns = list(range(len(self.tags))) if tags is None else [self.index[tag] for tag in tags]
+        if resolution == "raw":
+            rows = self.raw.range(start, end)
+            values = rows["value"][:, columns]
+            return {"resolution": "raw", "tags": [self.tags[i] for i in columns], "time": rows["time"],
+                    "min": values, "max": values, "mean": values, "count": np.ones(len(rows), np.uint32)}
+        rows = self.tiers[resolution].range(start, end)
+        return {"resolution": resolution, "tags": [self.tags[i] for i in columns], "time": rows["time"],
+                "min": rows["min"][:, columns], "max": rows["max"][:, columns],
+                "mean": rows["mean"][:, columns], "count": rows["count"]}
+
+    def export_csv(self, path, start=None, end=None, tags=None, resolution="auto"):
+        """Write a query to CSV (one row per time, tag_min/tag_max/tag_mean columns). Returns the row count."""
+        series = self.query(start, end, tags, resolution, max_points=float("inf"))
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            if series["resolution"] == "raw":
+                writer.writerow(["time"] + series["tags"])
+                for t, values in zip(series["time"], series["mean"]):
+                    writer.writerow([f"{t:.3f}"] + [f"{v:.6g}" for v in values])
+            else:
+                writer.writerow(["time", "count"] + [f"{tag}_{stat}" for tag in series["tags"]
+                                                     for stat in ("min", "max", "mean")])
+                stacked = np.stack([series["min"], series["max"], series["mean"]], axis=2)
+                for t, count, values in zip(series["time"], series["count"], stacked):
+                    writer.writerow([f"{t:.0f}", int(count)] + [f"{v:.6g}" for v in values.ravel()])
+        return len(series["time"])
+
+
+def open_existing(directory, read_only=True):
+    """Historian of an existing history directory, with its own tags and capacities (read-only by default)."""
+    with open(os.path.join(directory, META_FILE)) as f:
+        meta = json.load(f)
+    return Historian(directory, meta["tags"], meta["raw_capacity"], [tuple(tier) for tier in meta["tiers"]],
+                     read_only)
+
+
+def time_range(args):
+    end = time.time()
+    return (end - args.last if args.last else None), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or export a monitor history directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("info", help="Show the tiers and the time span each one covers")
+    p.add_argument("directory")
+    for name in ("query", "export"):
+        p = sub.add_parser(name)
+        p.add_argument("directory")
+        if name == "export":
+            p.add_argument("dest", help="CSV file")
+        p.add_argument("--last", type=float, help="Only the last N seconds")
+        p.add_argument("--tags", help="Comma-separated tags (default: all)")
+        p.add_argument("--resolution", choices=RESOLUTIONS, default="auto")
+    args = parser.parse_args()
+
+    try:
+        history = open_existing(args.directory)
+    except (OSError, ValueError) as e:
+        print(f" Cannot open history {args.directory}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.command == "info":
+        print(f"Tags: {', '.join(history.tags)}")
+        for name in ("raw",) + tuple(history.tiers):
+            ring = history.raw if name == "raw" else history.tiers[name]
+            first, last = history.coverage(name)
+            span = f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first))} -> " \
+                   f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last))}" if first else "empty"
+            print(f"  {name:<5} {len(ring):>7}/{ring.capacity:<7} rows  {span}")
+        return
+
+    start, end = time_range(args)
+    tags = args.tags.split(",") if args.tags else None
+    if tags and not all(tag in history.index for tag in tags):
+        parser.error(f"tags must be among {', '.join(history.tags)}")
+    if args.command == "export":
+        rows = history.export_csv(args.dest, start, end, tags, args.resolution)
+        print(f"{rows} rows written to {args.dest}")
+        return
+
+    series = history.query(start, end, tags, args.resolution)
+    print(f"{len(series['time'])} rows at {series['resolution']} resolution")
+    for i, tag in enumerate(series["tags"]):
+        if len(series["time"]):
+            print(f"  {tag:<12} min {series['min'][:, i].min():10.4g}  max {series['max'][:, i].max():10.4g}  "
+                  f"mean {np.average(series['mean'][:, i], weights=series['count']):10.4g}")
+
+
+if __name__ == "__main__":
+    main()
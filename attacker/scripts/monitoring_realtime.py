@@ -3,97 +3,329 @@
 Real-time monitor for the Asherah reactor
 Displays values that update continuously in a terminal dashboard.
 
+By default the dashboard is drawn with terminal_screen.DiffScreen, which
+rewrites only the characters that changed, so refresh rates of 10-20 Hz
+work without flicker. --renderer clear keeps the original clear-and-reprint
+output (also used when stdout is not a terminal).
+
+Values are polled in the background by register_poller.ModbusPoller and
+each frame draws the latest ones, with their age. --fast gives power and
+flows their own, faster polling period; --poll sync reads synchronously
+once per frame instead.
+
+With --history, every reading of the first endpoint is also kept by
+historian.Historian (memory-mapped, so it survives restarts; default
+directory HISTORY_DIR) and the dashboard draws the last 8 minutes of
+power and fuel temperature from its 10 s rollups.
+
+The whole input register table is read (one request) and fed to
+anomaly_detector.AnomalyDetector each frame; its alarms (implausible
+spikes, broken physics relations) are listed with the fixed thresholds,
+along with those of replay_detector.ReplayDetector, which notices the
+same register sequence being played back in a loop.
+
+With several --endpoint options the monitor polls each of them (e.g. the
+PLC directly, through the firewall and through the MITM proxy) on one
+background event loop and adds a box comparing them: age of each
+endpoint's data, a few key values, and whether they disagree with the
+first endpoint, which drives the main dashboard, history and detectors.
+Endpoints can also be listed one per line in a file passed as @file.
+
+Every poll is timed (monotonic clock, request to response) into an
+rtt_profiler.RttProfiler per endpoint: p50/p99 and jitter per Modbus
+function code are drawn for the first endpoint, and a latency
+distribution shifting from its learned baseline (e.g. an ARP MITM and
+proxy joining the path) raises a LATENCY warning.
+
+--ndjson FILE writes every new poll (all input register tags) and every
+alarm raised or cleared to FILE as NDJSON (ndjson_log.NdjsonWriter:
+batched writes, size rotation, stable schema) for Filebeat; --headless
+does that without drawing anything, e.g. as a background service.
+
+Usage:
+    python3 monitoring_realtime.py
+    python3 monitoring_realtime.py --refresh 0.05
+    python3 monitoring_realtime.py --refresh 1 --fast 0.1
+    python3 monitoring_realtime.py --renderer clear
+    python3 monitoring_realtime.py --history
+    python3 monitoring_realtime.py --history /root/logs/history-proxy --endpoint proxy=10.100.2.100:5502
+    python3 monitoring_realtime.py --endpoint plc=10.100.1.10 --endpoint proxy=10.100.2.100:5502
+    python3 monitoring_realtime.py @endpoints.txt
+    python3 monitoring_realtime.py --headless --refresh 0.1 --ndjson /root/logs/process/monitor.ndjson
+
 Compatible with pymodbus 3.8.6
 """
 
 from pymodbus.client import ModbusTcpClient  # pymodbus 3.8.6
+import argparse
+import signal
 import time
 import sys
 import os
+from terminal_screen import DiffScreen
+from asherah_registers import INPUT_REGISTER_MAP
+from anomaly_detector import AnomalyDetector, describe
+import replay_detector
+from historian import Historian
+from ndjson_log import NdjsonWriter, alarm_event, sample_event
+import rtt_profiler
+from register_poller import FAST_TAGS, BackgroundPoller, ModbusPoller, map_blocks
 
 # Configuration
 ASHERAH_IP = "10.100.1.10"
 ASHERAH_PORT = 502
 REFRESH_RATE = 2  # seconds
+STALE_LIMIT = 5  # seconds; older polled values are shown as a read failure
+HISTORY_DIR = "/root/logs/history"  # --history without a directory (./attacker/logs/history on the host)
+TREND_SPAN = 480  # seconds of history drawn as sparklines (48 points at 10 s)
+TREND_RESOLUTION = "10s"
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+ENDPOINT_TIMEOUT = 1.0  # seconds per request when polling several endpoints
+DIVERGENCE_FRACTION = 0.01  # Difference from the first endpoint, as a fraction of a tag's range, shown as DIFF
+NDJSON_FILE = "/root/logs/process/monitor.ndjson"  # Read by Filebeat (./attacker/logs/process on the host)
+# Dashboard label of each alarm source (thresholds are drawn by dashboard_lines itself)
+ALARM_LABELS = {"anomaly": "ANOMALY", "replay": "ANOMALY", "endpoint": "ENDPOINT", "latency": "LATENCY"}
+
+# Dashboard field -> Asherah input register tag (docs/Registres_modbus.md)
+DASHBOARD_TAGS = {
+    # Core
+    'power': "RX_ReactorPower",
+    'fuel_temp': "RX_FuelTemp",
+    'clad_temp': "RX_CladTemp",
+    'mean_temp': "RX_MeanCoolTemp",
+    'in_temp': "RX_InCoolTemp",
+    'out_temp': "RX_OutCoolTemp",
+    'rx_press': "RX_ReactorPress",
+    'rod_pos': "CR_Position",
+    # Pressurizer
+    'pz_press': "PZ_Press",
+    'pz_temp': "PZ_Temp",
+    'pz_level': "PZ_Level",
+    # Primary loops
+    'rc1_speed': "RC1_PumpSpeed",
+    'rc2_speed': "RC2_PumpSpeed",
+    'rc1_flow': "RC1_PumpFlow",
+    'rc2_flow': "RC2_PumpFlow",
+}
+DASHBOARD_MAP = INPUT_REGISTER_MAP.subset(DASHBOARD_TAGS.values(), celsius=True)
+# Every input register, read in one request for the anomaly detector
+MEASUREMENT_MAP = INPUT_REGISTER_MAP.subset(INPUT_REGISTER_MAP.names, celsius=True)
+DASHBOARD_INDEX = [MEASUREMENT_MAP.positions[tag] for tag in DASHBOARD_TAGS.values()]
+DASHBOARD_SPAN = [DASHBOARD_MAP.tags[i].maximum - DASHBOARD_MAP.tags[i].minimum for i in range(len(DASHBOARD_MAP))]
 
 def clear_screen():
     """Clear the console screen."""
     os.system('clear' if os.name != 'nt' else 'cls')
 
-def read_reactor_values(client):
-    """Read reactor values from the Modbus server and convert registers.
+def read_measurements(client, profiler=None):
+    """Read every input register and convert it (MEASUREMENT_MAP order).
 
-    Returns a dict of values on success, or None on failure/exception.
+    Returns a NumPy array on success, or None on failure/exception. The
+    response time of successful reads is recorded in `profiler` (an
+    RttProfiler) when one is given.
     """
+    start, count = MEASUREMENT_MAP.span()
     try:
-        result = client.read_input_registers(address=0, count=60, slave=1)
+        sent_at = time.monotonic()
+        result = client.read_input_registers(address=start, count=count, slave=1)
+        if profiler is not None and not result.isError():
+            profiler.record(0x04, time.monotonic() - sent_at)
 
         if not result.isError():
-            regs = result.registers
-            return {
-                # Core
-                'power': regs[14] * 0.00183105469,
-                'fuel_temp': regs[12] * 0.00152590219 - 273.15,
-                'clad_temp': regs[11] * 0.00152590219 - 273.15,
-                'mean_temp': regs[8] * 0.00152590219 - 273.15,
-                'in_temp': regs[9] * 0.00152590219 - 273.15,
-                'out_temp': regs[10] * 0.00152590219 - 273.15,
-                'rx_press': regs[15] * 0.00030518509,
-                'rod_pos': regs[20] * 0.01525878906,
-                # Pressurizer
-                'pz_press': regs[21] * 0.00030518509,
-                'pz_temp': regs[22] * 0.00152590219 - 273.15,
-                'pz_level': regs[23] * 0.00015259022,
-                # Primary loops
-                'rc1_speed': regs[1] * 0.00152590219,
-                'rc2_speed': regs[5] * 0.00152590219,
-                'rc1_flow': regs[2] * 0.00015259022,
-                'rc2_flow': regs[6] * 0.00015259022,
-            }
+            return MEASUREMENT_MAP.decode(result.registers, start)
     except Exception:
         # Any read error returns None so the UI can show an error message.
         return None
     return None
 
-def display_dashboard(values, iteration):
-    """Display a neatly aligned terminal dashboard using a fixed inner width.
+def dashboard_values(measurements):
+    """Dashboard fields of a measurement array, as a dict (None stays None)."""
+    if measurements is None:
+        return None
+    return dict(zip(DASHBOARD_TAGS, measurements[DASHBOARD_INDEX].tolist()))
+
+def read_reactor_values(client):
+    """Read reactor values from the Modbus server and convert registers.
 
-    The function builds each box using a constant inner width so borders
-    and columns are aligned regardless of content length.
+    Returns a dict of values on success, or None on failure/exception.
     """
-    if not values:
-        print("Cannot read values from Asherah")
-        return
+    return dashboard_values(read_measurements(client))
 
-    clear_screen()
+def read_polled_measurements(poller):
+    """Latest polled measurements and their age in seconds ((None, age) if too old)."""
+    measurements, age = poller.read(MEASUREMENT_MAP, "input_registers")
+    if age > STALE_LIMIT:
+        return None, age
+    return measurements, age
+
+def parse_endpoint(spec, default_port=ASHERAH_PORT):
+    """(name, host, port) of an endpoint given as [NAME=]HOST[:PORT]."""
+    name, _, address = spec.rpartition("=")
+    host, _, port = address.partition(":")
+    if not host:
+        raise ValueError(f"no host in endpoint {spec!r}")
+    port = int(port) if port else default_port
+    return name or f"{host}:{port}", host, port
+
+def endpoint_rows(pollers, reference=None):
+    """Per-endpoint dashboard fields, age, last error and divergence from `reference` (a values dict).
+
+    `pollers` maps endpoint name -> ModbusPoller.
+    """
+    rows = []
+    for name, poller in pollers.items():
+        measurements, age = read_polled_measurements(poller)
+        values = dashboard_values(measurements)
+        errors = [block.last_error for block in poller.blocks if block.last_error and block.staleness() > STALE_LIMIT]
+        diverging = []
+        if values and reference:
+            diverging = [tag for tag, span in zip(DASHBOARD_TAGS, DASHBOARD_SPAN)
+                         if abs(values[tag] - reference[tag]) > DIVERGENCE_FRACTION * span]
+        rows.append({"name": name, "address": f"{poller.host}:{poller.port}", "measurements": measurements,
+                     "values": values, "age": age, "error": errors[0] if errors else None,
+                     "diverging": diverging})
+    return rows
+
+def threshold_alarms(values):
+    """Fixed-threshold warnings of the dashboard values."""
+    alarms = []
+    if values['power'] > 105:
+        alarms.append("HIGH POWER")
+    if values['fuel_temp'] > 700:
+        alarms.append("HIGH FUEL TEMP")
+    if values['rx_press'] > 16:
+        alarms.append("HIGH PRESSURE")
+    return alarms
+
+def active_alarms(first, values, detector=None, replay=None, rows=None, profilers=None):
+    """Every alarm now present, as {(endpoint, source, name): text}.
+
+    Thresholds and detectors judge the `first` endpoint; divergence and
+    latency alarms belong to their own endpoint (`profilers` maps endpoint
+    name -> RttProfiler).
+    """
+    alarms = {}
+    if values:
+        for label in threshold_alarms(values):
+            alarms[(first, "threshold", label)] = label
+    if detector is not None:
+        for name, anomaly in detector.active.items():
+            alarms[(first, "anomaly", name)] = describe(anomaly)
+    if replay is not None:
+        for kind, alarm in replay.active.items():
+            alarms[(first, "replay", kind)] = replay_detector.describe(alarm)
+    for row in rows or ():
+        if row["diverging"]:
+            alarms[(row["name"], "endpoint", row["name"])] = f"{row['name']} disagrees on {', '.join(row['diverging'])}"
+    profilers = profilers or {}
+    for endpoint, profiler in profilers.items():
+        prefix = f"{endpoint} " if len(profilers) > 1 else ""
+        for function, shift in profiler.active.items():
+            alarms[(endpoint, "latency", f"FC{function:02d}")] = prefix + rtt_profiler.describe(shift)
+    return alarms
+
+def monitor_blocks(refresh_rate, fast=None):
+    """Polling plan: all input registers every frame, power and flows every `fast` seconds."""
+    blocks = map_blocks("measurements", "input_registers", MEASUREMENT_MAP, refresh_rate)
+    if fast:
+        blocks += map_blocks("fast", "input_registers", INPUT_REGISTER_MAP.subset(FAST_TAGS), fast)
+    return blocks
+
+def sparkline(series):
+    """One block character per value, scaled between the series' min and max."""
+    if len(series) == 0:
+        return ""
+    low, high = float(series.min()), float(series.max())
+    if high - low < 1e-9:
+        return SPARK_CHARS[0] * len(series)
+    levels = ((series - low) / (high - low) * (len(SPARK_CHARS) - 1)).round().astype(int)
+    return "".join(SPARK_CHARS[level] for level in levels)
+
+def history_trends(history, now=None):
+    """{field: 10 s means over the last TREND_SPAN seconds} for the trend box."""
+    now = time.time() if now is None else now
+    series = history.query(now - TREND_SPAN, None, tags=["power", "fuel_temp"], resolution=TREND_RESOLUTION)
+    return {tag: series["mean"][:, i] for i, tag in enumerate(series["tags"])}
+
+def endpoint_lines(rows, box_width=76):
+    """Box with one line per endpoint row (see endpoint_rows)."""
+    def line(text):
+        return "│" + text[:box_width].ljust(box_width) + "│"
+
+    lines = ["┌" + "─" * box_width + "┐",
+             line(f"{'Endpoint':<12}{'Address':<21}{'Age':>7}{'Power':>7}{'Fuel':>7}{'Press':>6}  Status")]
+    for row in rows:
+        if row["values"] is None:
+            age = "-" if row["age"] == float("inf") else f"{row['age']:.0f}s"
+            lines.append(line(f"{row['name'][:11]:<12}{row['address'][:20]:<21}{age:>7}  "
+                              f"DOWN {row['error'] or 'stale'}"))
+        else:
+            v = row["values"]
+            status = "DIFF " + ",".join(row["diverging"]) if row["diverging"] else "OK"
+            lines.append(line(f"{row['name'][:11]:<12}{row['address'][:20]:<21}{row['age'] * 1e3:>5.0f}ms"
+                              f"{v['power']:>7.1f}{v['fuel_temp']:>7.1f}{v['rx_press']:>6.2f}  {status}"))
+    lines.append("└" + "─" * box_width + "┘")
+    return lines
+
+def rtt_lines(rows, window, box_width=76):
+    """Box with the RTT profile of each function code (see RttProfiler.rows)."""
+    def line(text):
+        return "│" + text[:box_width].ljust(box_width) + "│"
+
+    lines = ["┌" + "─" * box_width + "┐",
+             line(f"{f'Modbus RTT ({window:g}s windows)':<26}{'count':>8}{'p50 ms':>8}{'p99 ms':>8}{'jitter':>8}"
+                  f"{'base p50/99':>12}")]
+    for row in rows:
+        base = (f"{row['baseline_p50'] * 1e3:.2f}/{row['baseline_p99'] * 1e3:.2f}"
+                if row["baseline_p50"] is not None else "-")
+        state = " SHIFT" if row["shift"] else " learn" if row["learning"] else ""
+        lines.append(line(f"FC{row['function']:02d} {row['name'][:21]:<21}{row['count']:>8}{row['p50'] * 1e3:>8.2f}"
+                          f"{row['p99'] * 1e3:>8.2f}{row['jitter'] * 1e3:>8.3f}{base:>12}{state}"))
+    lines.append("└" + "─" * box_width + "┘")
+    return lines
+
+def dashboard_lines(values, iteration, refresh_rate=REFRESH_RATE, age=None, trends=None, alarms=(), endpoints=None,
+                    rtt=None):
+    """Build the terminal dashboard as a list of lines using a fixed inner width.
+
+    Each box uses a constant inner width so borders and columns are
+    aligned regardless of content length. `alarms` are warning lines,
+    `endpoints` endpoint rows and `rtt` an RttProfiler, all optional.
+    """
+    if not values:
+        if endpoints:
+            return ["Cannot read values from the first endpoint", ""] + endpoint_lines(endpoints)
+        return ["Cannot read values from Asherah"]
 
     BOX_WIDTH = 76
     LEFT_COL = 38
     RIGHT_COL = BOX_WIDTH - LEFT_COL
+    lines = []
 
     def header(title):
-        print("╔" + "=" * BOX_WIDTH + "╗")
-        print("║" + title.center(BOX_WIDTH) + "║")
-        print("╚" + "=" * BOX_WIDTH + "╝")
+        lines.append("╔" + "=" * BOX_WIDTH + "╗")
+        lines.append("║" + title.center(BOX_WIDTH) + "║")
+        lines.append("╚" + "=" * BOX_WIDTH + "╝")
 
     def box_top():
-        print("┌" + "─" * BOX_WIDTH + "┐")
+        lines.append("┌" + "─" * BOX_WIDTH + "┐")
 
     def box_bottom():
-        print("└" + "─" * BOX_WIDTH + "┘")
+        lines.append("└" + "─" * BOX_WIDTH + "┘")
 
     def two_col(left, right):
         # left aligned in left column, right aligned in right column
         inner = str(left).ljust(LEFT_COL) + str(right).rjust(RIGHT_COL)
-        print("│" + inner + "│")
+        lines.append("│" + inner + "│")
 
     def one_col(text):
         inner = str(text).center(BOX_WIDTH)
-        print("│" + inner + "│")
+        lines.append("│" + inner + "│")
 
     header("ASHERAH NUCLEAR REACTOR - LIVE MONITOR")
-    print(f"  Update #{iteration}  |  Refresh rate: {REFRESH_RATE}s  |  Press Ctrl+C to exit")
-    print()
+    data_age = f"  |  Data age: {age * 1e3:4.0f}ms" if age is not None else ""
+    lines.append(f"  Update #{iteration}  |  Refresh rate: {refresh_rate:g}s{data_age}  |  Press Ctrl+C to exit")
+    lines.append("")
 
     # Reactor Core
     box_top()
@@ -102,50 +334,222 @@ def display_dashboard(values, iteration):
     two_col(f"Mean Cool Temp: {values['mean_temp']:>6.1f} °C", f"Reactor Press: {values['rx_press']:>6.2f} MPa")
     two_col(f"Inlet Temp: {values['in_temp']:>6.1f} °C", f"Outlet Temp: {values['out_temp']:>6.1f} °C")
     box_bottom()
-    print()
+    lines.append("")
 
     # Pressurizer
     box_top()
     two_col(f"Pressure: {values['pz_press']:>6.2f} MPa", f"Temperature: {values['pz_temp']:>6.1f} °C")
     two_col(f"Level: {values['pz_level']:>6.2f} m", "")
     box_bottom()
-    print()
+    lines.append("")
 
     # Primary Loops
     box_top()
     two_col(f"Loop 1 Speed: {values['rc1_speed']:>6.1f} %", f"Loop 1 Flow: {values['rc1_flow']:>6.0f} kg/s")
     two_col(f"Loop 2 Speed: {values['rc2_speed']:>6.1f} %", f"Loop 2 Flow: {values['rc2_flow']:>6.0f} kg/s")
     box_bottom()
-    print()
+    lines.append("")
+
+    # Trends from the historian
+    if trends is not None:
+        box_top()
+        one_col(f"Last {TREND_SPAN // 60} min ({TREND_RESOLUTION} means)")
+        for label, field, unit in (("Power", "power", "%"), ("Fuel", "fuel_temp", "°C")):
+            series = trends.get(field)
+            if series is None or len(series) == 0:
+                two_col(f"{label}: no history yet", "")
+                continue
+            span = f"{series.min():.1f}-{series.max():.1f} {unit}"
+            lines.append("│" + f"{label:<6}{sparkline(series)}".ljust(BOX_WIDTH - len(span)) + span + "│")
+        box_bottom()
+        lines.append("")
+
+    # Poll response times
+    rtt_rows = rtt.rows() if rtt is not None else None
+    if rtt_rows:
+        lines.extend(rtt_lines(rtt_rows, rtt.window, BOX_WIDTH))
+        lines.append("")
+
+    # Endpoints side by side
+    if endpoints:
+        lines.extend(endpoint_lines(endpoints, BOX_WIDTH))
+        lines.append("")
 
     # Status indicators (no emojis)
-    status = []
-    if values['power'] > 105:
-        status.append("HIGH POWER")
-    if values['fuel_temp'] > 700:
-        status.append("HIGH FUEL TEMP")
-    if values['rx_press'] > 16:
-        status.append("HIGH PRESSURE")
+    status = threshold_alarms(values)
+    for alarm in alarms:
+        status.append(alarm[:BOX_WIDTH])
 
     if status:
         box_top()
         one_col("WARNINGS")
         for s in status:
-            two_col(s, "")
+            lines.append("│" + s.ljust(BOX_WIDTH) + "│")
         box_bottom()
     else:
         box_top()
         one_col("All parameters within normal limits")
         box_bottom()
 
-    print()
-    print(f"  Next update in {REFRESH_RATE}s...")
+    lines.append("")
+    lines.append(f"  Next update in {refresh_rate:g}s...")
+    return lines
+
+def display_dashboard(values, iteration, refresh_rate=REFRESH_RATE, age=None, trends=None, alarms=(), endpoints=None,
+                      rtt=None):
+    """Clear the screen and print the whole dashboard (plain renderer)."""
+    if not values and not endpoints:
+        print("Cannot read values from Asherah")
+        return
+    clear_screen()
+    print("\n".join(dashboard_lines(values, iteration, refresh_rate, age, trends, alarms, endpoints, rtt)))
+
+def replay_monitor():
+    """ReplayDetector over the raw measurement vector, ignoring the simulation clock."""
+    clock = MEASUREMENT_MAP.positions["INT_SimulationTime"]
+    return replay_detector.ReplayDetector(len(MEASUREMENT_MAP), [clock], names=MEASUREMENT_MAP.names)
+
+def log_events(events, name, measurements, age, alarms, raised, last_poll):
+    """Write a sample event if the reading is a new poll, and the alarm transitions.
+
+    `alarms` and `raised` map (endpoint, source, name) -> text; `raised`
+    is updated in place. Returns the time of the newest poll written.
+    """
+    now = time.time()
+    polled_at = now - (age or 0.0)
+    if measurements is not None and polled_at > last_poll + 1e-3:
+        events.write(sample_event(name, polled_at, MEASUREMENT_MAP.names, measurements.tolist(), age))
+        last_poll = polled_at
+    for key in [key for key in raised if key not in alarms]:
+        events.write(alarm_event(name, now, "cleared", key[1], key[2], raised.pop(key)))
+    for key, text in alarms.items():
+        if key not in raised:
+            events.write(alarm_event(name, now, "raised", key[1], key[2], text))
+            raised[key] = text
+    events.flush_if_due()
+    return last_poll
+
+def run_monitor(read_measurements, refresh_rate, renderer, history=None, detector=None, replay=None,
+                endpoints=None, events=None, name=None, profilers=None):
+    """Redraw every `refresh_rate` seconds until interrupted.
+
+    read_measurements() returns (MEASUREMENT_MAP array or None, age in
+    seconds or None). Readings are appended to `history` (a Historian) and
+    fed to `detector` (an AnomalyDetector) and `replay` (a ReplayDetector)
+    when they are given. These only see new polls, not the same poll drawn
+    again by a faster frame. `endpoints` ({name:
+    ModbusPoller}) adds the endpoint comparison box.
+
+    `events` (an NdjsonWriter) receives the new polls and alarm
+    transitions, of every endpoint if there are several, else under
+    `name`. `profilers` ({endpoint name: RttProfiler}) are checked for
+    latency shifts; the first one is drawn. renderer "none" draws nothing.
+    """
+    screen = DiffScreen() if renderer == "diff" else None
+    if screen is not None:
+        screen.start()
+        if hasattr(signal, "SIGWINCH"):
+            signal.signal(signal.SIGWINCH, lambda *_: screen.invalidate())
+
+    iteration = 0
+    last_poll = 0.0
+    logged = {}  # endpoint -> [time of the last poll written, {alarm key: text} raised]
+    next_frame = time.monotonic()
+    try:
+        while True:
+            iteration += 1
+            measurements, age = read_measurements()
+            values = dashboard_values(measurements)
+            # A faster frame than the poll draws the same poll again
+            polled_at = time.time() - (age or 0.0)
+            new_poll = measurements is not None and polled_at > last_poll + 1e-3
+            if new_poll:
+                last_poll = polled_at
+                if detector is not None:
+                    detector.update(measurements)
+                if replay is not None:
+                    replay.update(MEASUREMENT_MAP.encode(measurements), polled_at)
+            rows = endpoint_rows(endpoints, values) if endpoints else None
+            for profiler in (profilers or {}).values():
+                profiler.tick()
+            first = rows[0]["name"] if rows else name
+            active = active_alarms(first, values, detector, replay, rows, profilers)
+            alarms = [f"{ALARM_LABELS[source]} {text}" for (_, source, _), text in active.items()
+                      if source in ALARM_LABELS]
+            if events is not None:
+                for row in rows or [{"name": name, "measurements": measurements, "age": age}]:
+                    own = {key: text for key, text in active.items() if key[0] == row["name"]}
+                    state = logged.setdefault(row["name"], [0.0, {}])
+                    state[0] = log_events(events, row["name"], row["measurements"], row["age"], own, state[1], state[0])
+            trends = None
+            if history is not None:
+                if values and new_poll:
+                    history.append(values, polled_at)
+                trends = history_trends(history)
+            rtt = next(iter(profilers.values())) if profilers else None
+            if screen is not None:
+                screen.render(dashboard_lines(values, iteration, refresh_rate, age, trends, alarms, rows, rtt))
+            elif renderer != "none":
+                display_dashboard(values, iteration, refresh_rate, age, trends, alarms, rows, rtt)
+            # Fixed cadence: the time spent reading and drawing is not added to the period
+            next_frame += refresh_rate
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_frame = time.monotonic()
+    finally:
+        if screen is not None:
+            screen.stop()
+        if history is not None:
+            history.close()
+        if events is not None:
+            events.close()
 
 def main():
-    print("""
+    parser = argparse.ArgumentParser(description="Real-time monitor for the Asherah reactor",
+                                     fromfile_prefix_chars="@")
+    parser.add_argument("--host", default=ASHERAH_IP, help="Asherah Modbus server IP")
+    parser.add_argument("--port", type=int, default=ASHERAH_PORT)
+    parser.add_argument("--endpoint", action="append", default=[], metavar="[NAME=]HOST[:PORT]",
+                        help="Endpoint to poll; repeat to compare several (the first drives the dashboard)")
+    parser.add_argument("--refresh", type=float, default=REFRESH_RATE, help="Seconds between updates")
+    parser.add_argument("--poll", choices=["async", "sync"], default="async",
+                        help="async: poll in the background and draw the latest values; sync: read once per frame")
+    parser.add_argument("--fast", type=float, help="Separate polling period for power and flows (s, async only)")
+    parser.add_argument("--history", nargs="?", const=HISTORY_DIR, metavar="DIR",
+                        help=f"Keep a persistent history of the first endpoint (default directory {HISTORY_DIR})")
+    parser.add_argument("--no-detect", action="store_true",
+                        help="Disable the anomaly (statistical/physics) and replay detectors")
+    parser.add_argument("--renderer", choices=["auto", "diff", "clear"], default="auto",
+                        help="diff: redraw changed characters only; clear: clear and reprint (auto: diff on a terminal)")
+    parser.add_argument("--ndjson", nargs="?", const=NDJSON_FILE, metavar="FILE",
+                        help=f"Write polls and alarm transitions as NDJSON for Filebeat (default file {NDJSON_FILE})")
+    parser.add_argument("--headless", action="store_true", help="Draw nothing, only write the NDJSON events")
+    args = parser.parse_args()
+    renderer = args.renderer
+    if args.headless:
+        renderer = "none"
+        args.ndjson = args.ndjson or NDJSON_FILE
+        # Stopped as a service: unwind normally so buffered events are written
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    elif renderer == "auto":
+        renderer = "diff" if sys.stdout.isatty() else "clear"
+    try:
+        endpoints = [parse_endpoint(spec, args.port) for spec in args.endpoint]
+    except ValueError as e:
+        parser.error(str(e))
+    if len(endpoints) > 1 and args.poll == "sync":
+        parser.error("several endpoints need --poll async")
+    if len(set(name for name, _, _ in endpoints)) != len(endpoints):
+        parser.error("endpoint names must be unique")
+    if len(endpoints) == 1:
+        _, args.host, args.port = endpoints[0]
+
+    print(f"""
 ╔══════════════════════════════════════════════════════════════════════╗
 ║         ASHERAH REACTOR - REAL-TIME MONITORING                       ║
-║         Live dashboard updating every 2 seconds                      ║
+║         {f"Live dashboard updating every {args.refresh:g} seconds":<61}║
 ╚══════════════════════════════════════════════════════════════════════╝
 
 This monitor displays real-time values from Asherah.
@@ -154,36 +558,86 @@ Compare with ScadaLTS to verify data accuracy.
 Connecting to Asherah...
 """)
     
-    client = ModbusTcpClient(ASHERAH_IP, port=ASHERAH_PORT, timeout=5)
+    if len(endpoints) > 1:
+        run_endpoints(args, endpoints, renderer)
+        return
+    
+    client = ModbusTcpClient(args.host, port=args.port, timeout=5)
     client.connect()
     
     if not client.connected:
-        print(f"Cannot connect to Asherah ({ASHERAH_IP}:{ASHERAH_PORT})")
+        print(f"Cannot connect to Asherah ({args.host}:{args.port})")
         print("   Make sure Asherah simulator is running")
         sys.exit(1)
     
-    print(f"Connected to {ASHERAH_IP}:{ASHERAH_PORT}")
+    print(f"Connected to {args.host}:{args.port}")
     print("\nStarting monitor in 2 seconds...")
     time.sleep(2)
     
-    iteration = 0
+    background = None
+    name = f"{args.host}:{args.port}"
+    profiler = rtt_profiler.RttProfiler()
+    if args.poll == "async":
+        client.close()
+        background = BackgroundPoller(ModbusPoller(args.host, args.port, monitor_blocks(args.refresh, args.fast),
+                                                   on_update=profile_block(profiler)))
+        background.start()
+        background.wait_fresh()
+        read = lambda: read_polled_measurements(background.poller)
+    else:
+        read = lambda: (read_measurements(client, profiler), None)
+    
     try:
-        while True:
-            iteration += 1
-            values = read_reactor_values(client)
-            display_dashboard(values, iteration)
-            time.sleep(REFRESH_RATE)
+        monitor(args, read, renderer, name=name, profilers={name: profiler})
+    finally:
+        if background is not None:
+            background.stop()
+        client.close()
+
+def run_endpoints(args, endpoints, renderer):
+    """Poll every endpoint on one background event loop and monitor them side by side."""
+    profilers = {name: rtt_profiler.RttProfiler() for name, _, _ in endpoints}
+    pollers = {name: ModbusPoller(host, port, monitor_blocks(args.refresh, args.fast), timeout=ENDPOINT_TIMEOUT,
+                                  on_update=profile_block(profilers[name]), log=None)
+               for name, host, port in endpoints}
+    background = BackgroundPoller(*pollers.values())
+    background.start()
+    try:
+        background.wait_fresh()
+        for name, poller in pollers.items():
+            _, age = poller.read(MEASUREMENT_MAP, "input_registers")
+            state = "answering" if age <= STALE_LIMIT else "NOT answering"
+            print(f"  {name:<12} {poller.host}:{poller.port:<6} {state}")
+        print("\nStarting monitor in 2 seconds...")
+        time.sleep(2)
+        monitor(args, lambda: read_polled_measurements(background.poller), renderer, pollers, profilers=profilers)
+    finally:
+        background.stop()
+
+def profile_block(profiler):
+    """ModbusPoller on_update callback timing each response into `profiler`."""
+    return lambda block: profiler.record(block.function, block.last_latency)
+
+def monitor(args, read, renderer, endpoints=None, name=None, profilers=None):
+    """run_monitor() with the history, detectors and event log selected by the arguments, until Ctrl+C."""
+    history = Historian(args.history, DASHBOARD_TAGS) if args.history else None
+    detector = None if args.no_detect else AnomalyDetector(MEASUREMENT_MAP)
+    replay = None if args.no_detect else replay_monitor()
+    events = NdjsonWriter(args.ndjson) if args.ndjson else None
+    if events is not None:
+        print(f"Writing NDJSON events to {args.ndjson}")
+    
+    try:
+        run_monitor(read, args.refresh, renderer, history, detector, replay, endpoints, events, name, profilers)
     
     except KeyboardInterrupt:
-        clear_screen()
+        if renderer == "clear":
+            clear_screen()
         print("\n" + "="*78)
         print("  Monitor stopped by user")
         print("="*78)
         print("\n✓ Connection closed\n")
-    
-    finally:
-        client.close()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,149 @@
+"""
+Batched, size-rotated NDJSON event log for Filebeat.
+
+NdjsonWriter encodes each event as one JSON line into a memory buffer and
+appends the buffer to the file in one write() once BATCH_BYTES have
+accumulated or FLUSH_INTERVAL seconds have passed, with no fsync: at
+10 Hz that is about one write per second instead of ten. When the next
+batch would take the file over `max_bytes`, it is rotated like
+logging.handlers.RotatingFileHandler (monitor.ndjson -> monitor.ndjson.1
+-> ... -> .BACKUPS, the oldest dropped). Only complete lines are ever
+written, so Filebeat never reads half an event.
+
+Event schema (SCHEMA_VERSION 1), one object per line:
+
+    {"@timestamp": "2026-01-05T10:00:00.100Z", "schema": 1,
+     "event": "sample", "endpoint": "plc", "age_ms": 12.0,
+     "values": {"RX_ReactorPower": 100.0, ...}}
+
+    {"@timestamp": "...", "schema": 1, "event": "alarm",
+     "endpoint": "plc", "state": "raised" | "cleared",
+     "source": "threshold" | "anomaly" | "replay" | "endpoint",
+     "name": "RC1 flow vs pump speed", "text": "..."}
+
+"sample" carries every tag of the monitor (engineering units, °C), with
+@timestamp the time of the poll; "alarm" marks the start or end of one
+alarm. Fields are only ever added, never renamed, within a schema version.
+"""
+
+import json
+import os
+import time
+
+SCHEMA_VERSION = 1
+MAX_BYTES = 50 * 1024 * 1024  # Size at which the file is rotated
+BACKUPS = 5                   # Rotated files kept
+BATCH_BYTES = 64 * 1024       # Buffered bytes that trigger a write
+FLUSH_INTERVAL = 1.0          # Seconds an event may wait in the buffer
+DECIMALS = 4                  # Decimals kept for tag values
+
+
+def iso_timestamp(t):
+    """UTC ISO 8601 text of a time.time() value, to the millisecond."""
+    seconds = int(t)
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)) + f".{int((t - seconds) * 1000):03d}Z"
+
+
+def sample_event(endpoint, timestamp, names, values, age=None):
+    """'sample' event of one reading (`values` in the order of `names`)."""
+    return {
+        "@timestamp": iso_timestamp(timestamp),
+        "schema": SCHEMA_VERSION,
+        "event": "sample",
+        "endpoint": endpoint,
+        "age_ms": None if age is None else round(age * 1e3, 1),
+        "values": dict(zip(names, (round(value, DECIMALS) for value in values))),
+    }
+
+
+def alarm_event(endpoint, timestamp, state, source, name, text):
+    """'alarm' event: `state` is "raised" or "cleared"."""
+    return {
+        "@timestamp": iso_timestamp(timestamp),
+        "schema": SCHEMA_VERSION,
+        "event": "alarm",
+        "endpoint": endpoint,
+        "state": state,
+        "source": source,
+        "name": name,
+        "text": text,
+    }
+
+
+class NdjsonWriter:
+    """Append events (dicts) to a size-rotated NDJSON file in batches."""
+
+    def __init__(self, path, max_bytes=MAX_BYTES, backups=BACKUPS, batch_bytes=BATCH_BYTES,
+                 flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.batch_bytes = batch_bytes
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(path, "ab")
+        self.size = self.file.tell()
+        self.buffer = []
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        self.events = 0
+        self.batches = 0
+        self.rotations = 0
+
+    def write(self, event):
+        """Buffer one event; the batch is written when it is large or old enough."""
+        line = (json.dumps(event, separators=(",", ":"), ensure_ascii=False) + "\n").encode()
+        self.buffer.append(line)
+        self.buffered += len(line)
+        self.events += 1
+        if self.buffered >= self.batch_bytes:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """Write the buffer if its oldest event has waited flush_interval seconds."""
+        if self.buffer and time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered event now (one write per file)."""
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        batch = b"".join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        if self.size and self.size + len(batch) > self.max_bytes:
+            self.rotate()
+        self.file.write(batch)
+        self.file.flush()
+        self.size += len(batch)
+        self.batches += 1
+
+    def rotate(self):
+        """Shift path -> path.1 -> ... -> path.<backups> and start an empty file."""
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{i}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "ab")
+        self.size = 0
+        self.rotations += 1
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,176 @@
+"""
+Runtime metrics for the Modbus MITM proxy.
+
+ProxyMetrics is updated inline by ModbusMITM (plain integer increments and
+histogram records, all on the proxy's event loop) and exported two ways:
+
+    GET http://127.0.0.1:9102/metrics   Prometheus text format
+    --metrics-file metrics.ndjson       one JSON snapshot per interval
+
+Per response, the time spent talking to the target (upstream RTT: request
+written upstream -> response read back) is separated from the time the
+proxy itself added (framing, queueing for a pool slot, interception and
+the write back to the client).
+"""
+
+import asyncio
+import json
+import time
+
+from latency_histogram import LatencyHistogram
+
+METRICS_PREFIX = "modbus_mitm"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+FUNCTION_NAMES = {
+    0x01: "read_coils",
+    0x02: "read_discrete_inputs",
+    0x03: "read_holding_registers",
+    0x04: "read_input_registers",
+    0x05: "write_single_coil",
+    0x06: "write_single_register",
+    0x0F: "write_multiple_coils",
+    0x10: "write_multiple_registers",
+    0x17: "read_write_multiple_registers",
+}
+
+
+class ProxyMetrics:
+    """Counters and latency histograms for one proxy instance."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.requests = [0] * 128     # by function code
+        self.exceptions = [0] * 128   # exception responses, by function code
+        self.responses_by_mode = {}   # mode -> responses sent to clients
+        self.modified_by_mode = {}    # mode -> responses altered before sending
+        self.client_bytes_in = 0
+        self.client_bytes_out = 0
+        self.connections_active = 0
+        self.connections_total = 0
+        self.upstream_rtt = LatencyHistogram()
+        self.proxy_overhead = LatencyHistogram()
+
+    def connection_opened(self):
+        self.connections_active += 1
+        self.connections_total += 1
+
+    def connection_closed(self):
+        self.connections_active -= 1
+
+    def request(self, frame):
+        """Count one request ADU received from a client."""
+        self.client_bytes_in += len(frame)
+        if len(frame) > 7:
+            self.requests[frame[7] & 0x7F] += 1
+
+    def response(self, mode, frame, modified, queued_at, sent_at, received_at, delivered_at):
+        """Count one response ADU sent to a client (perf_counter() timestamps)."""
+        self.client_bytes_out += len(frame)
+        self.responses_by_mode[mode] = self.responses_by_mode.get(mode, 0) + 1
+        if modified:
+            self.modified_by_mode[mode] = self.modified_by_mode.get(mode, 0) + 1
+        if len(frame) > 7 and frame[7] & 0x80:
+            self.exceptions[frame[7] & 0x7F] += 1
+        rtt = received_at - sent_at
+        self.upstream_rtt.record(rtt)
+        self.proxy_overhead.record(max(delivered_at - queued_at - rtt, 0.0))
+
+    def snapshot(self, gauges=None):
+        """Plain dict of every metric, for NDJSON output. Latencies in ms."""
+        return {
+            "time": time.time(),
+            "uptime_s": time.time() - self.started_at,
+            "requests": {FUNCTION_NAMES.get(fc, f"fc{fc}"): n for fc, n in enumerate(self.requests) if n},
+            "exceptions": {FUNCTION_NAMES.get(fc, f"fc{fc}"): n for fc, n in enumerate(self.exceptions) if n},
+            "responses_by_mode": dict(self.responses_by_mode),
+            "modified_by_mode": dict(self.modified_by_mode),
+            "client_bytes_in": self.client_bytes_in,
+            "client_bytes_out": self.client_bytes_out,
+            "connections_active": self.connections_active,
+            "connections_total": self.connections_total,
+            "upstream_rtt_ms": self.upstream_rtt.summary(),
+            "proxy_overhead_ms": self.proxy_overhead.summary(),
+            "gauges": {name: dict(value) if isinstance(value, list) else value
+                       for name, (value, _) in (gauges or {}).items()},
+        }
+
+    def prometheus(self, gauges=None):
+        """Render every metric in the Prometheus text exposition format.
+
+        `gauges` maps extra gauge names to (value, help) pairs sampled by
+        the caller at scrape time (queue depths, current mode...). A value
+        may also be a list of (labels, value) pairs.
+        """
+        p = METRICS_PREFIX
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {p}_{name} {help_text}")
+            lines.append(f"# TYPE {p}_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"{p}_{name}{labels} {value}")
+
+        def fc_samples(counts):
+            return [(f'{{function_code="{fc}",function="{FUNCTION_NAMES.get(fc, "other")}"}}', n)
+                    for fc, n in enumerate(counts) if n]
+
+        metric("requests_total", "counter", "Client requests by Modbus function code",
+               fc_samples(self.requests))
+        metric("exception_responses_total", "counter", "Modbus exception responses by function code",
+               fc_samples(self.exceptions))
+        metric("responses_total", "counter", "Responses sent to clients by proxy mode",
+               [(f'{{mode="{m}"}}', n) for m, n in sorted(self.responses_by_mode.items())])
+        metric("modified_responses_total", "counter", "Responses altered by the proxy, by mode",
+               [(f'{{mode="{m}"}}', n) for m, n in sorted(self.modified_by_mode.items())])
+        metric("client_bytes_total", "counter", "Modbus bytes exchanged with clients",
+               [('{direction="in"}', self.client_bytes_in), ('{direction="out"}', self.client_bytes_out)])
+        metric("connections_active", "gauge", "Client connections currently open",
+               [("", self.connections_active)])
+        metric("connections_total", "counter", "Client connections accepted",
+               [("", self.connections_total)])
+        for name, histogram, help_text in (
+                ("upstream_rtt_seconds", self.upstream_rtt, "Time from forwarding a request to reading its response"),
+                ("proxy_overhead_seconds", self.proxy_overhead, "Latency added by the proxy on top of upstream RTT")):
+            samples = [(f'_bucket{{le="{le:g}"}}', n) for le, n in histogram.cumulative()]
+            samples += [('_bucket{le="+Inf"}', histogram.count),
+                        ("_sum", f"{histogram.total:.9f}"), ("_count", histogram.count)]
+            metric(name, "histogram", help_text, samples)
+        for name, (value, help_text) in (gauges or {}).items():
+            metric(name, "gauge", help_text, value if isinstance(value, list) else [("", value)])
+        return "\n".join(lines) + "\n"
+
+
+async def serve_http(host, port, render):
+    """Serve render() as text at GET /metrics. Returns the asyncio server."""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # Headers are not needed
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] in (b"/", b"/metrics"):
+                status, body = "200 OK", render().encode()
+            else:
+                status, body = "404 Not Found", b"try /metrics\n"
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port, reuse_address=True)
+
+
+async def write_snapshots(path, interval, snapshot):
+    """Append snapshot() to `path` as one JSON line every `interval` seconds, until cancelled."""
+    with open(path, "a", buffering=1) as f:
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                f.write(json.dumps(snapshot(), separators=(",", ":")) + "\n")
+        finally:
+            f.write(json.dumps(snapshot(), separators=(",", ":")) + "\n")
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Concurrent Modbus poller with per-block rates.
+
+The four Asherah tables are read as blocks of at most 125 registers (2000
+bits for coils and discrete inputs), each with its own period: fast for
+power and flows, slower for setpoints and states. Each table is read on
+its own TCP connection, so the four tables are polled concurrently, a
+slow table never delays a fast one and the PLC sees exactly the
+configured request rates.
+
+    poller = ModbusPoller(host, port, asherah_blocks())
+    BackgroundPoller(poller).start()
+    values, staleness = poller.read(INPUT_REGISTER_MAP, "input_registers")
+
+Each block tracks its achieved rate, latency and staleness (time since
+its last good response), printed by the CLI and available from stats().
+The CLI also prints the response-time profile (p50/p99/jitter) of each
+function code, from rtt_profiler.RttProfiler.
+
+Several pollers (one per Modbus endpoint) can share one BackgroundPoller:
+they all run as tasks of the same event loop, in one thread, so watching
+dozens of endpoints costs a few sockets each, not a thread each.
+
+    background = BackgroundPoller(ModbusPoller(plc, 502, blocks()),
+                                  ModbusPoller(proxy, 5502, blocks()))
+
+Usage:
+    python3 register_poller.py --host 10.100.1.10 --duration 10
+    python3 register_poller.py --fast 0.05 --slow 5
+"""
+
+import argparse
+import asyncio
+import socket
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from asherah_registers import (COIL_MAP, DISCRETE_INPUT_MAP, HOLDING_REGISTER_MAP,
+                               INPUT_REGISTER_MAP)
+from modbus_framing import FrameProtocol
+from rtt_profiler import RttProfiler, format_rows
+
+ASHERAH_IP = "10.100.1.10"
+ASHERAH_PORT = 502
+
+# Modbus table -> read function code, and the per-request limit of that function
+FUNCTION_CODES = {
+    "coils": 0x01,
+    "discrete_inputs": 0x02,
+    "holding_registers": 0x03,
+    "input_registers": 0x04,
+}
+MAX_REGISTERS = 125
+MAX_BITS = 2000
+RATE_WINDOW = 50  # Responses over which the achieved rate is measured
+
+# Tags refreshed at the fast period (the rest of each table at its own period)
+FAST_TAGS = ("RX_ReactorPower", "RC1_PumpFlow", "RC2_PumpFlow", "RC1_PumpSpeed", "RC2_PumpSpeed")
+
+
+class PollError(Exception):
+    """Raised for an exception response, a timeout or a lost connection."""
+
+
+class PollBlock:
+    """One contiguous read repeated every `period` seconds, with its statistics."""
+
+    def __init__(self, name, table, start, count, period):
+        if table not in FUNCTION_CODES:
+            raise ValueError(f"unknown table {table!r}")
+        limit = MAX_REGISTERS if FUNCTION_CODES[table] >= 0x03 else MAX_BITS
+        if not 1 <= count <= limit:
+            raise ValueError(f"{name}: {count} items per read (1-{limit} allowed)")
+        self.name = name
+        self.table = table
+        self.start = start
+        self.count = count
+        self.period = period
+        self.function = FUNCTION_CODES[table]
+
+        self.polls = 0
+        self.responses = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.late = 0         # Periods skipped because a read took longer than the period
+        self.last_ok = None   # monotonic() of the last good response
+        self.last_latency = None  # Seconds from request to parsed response, of the last good read
+        self.last_error = None  # Text of the most recent failure
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.arrivals = deque(maxlen=RATE_WINDOW)
+
+    def request(self, tid, unit):
+        """Read request ADU for this block."""
+        return bytes((tid >> 8, tid & 0xFF, 0, 0, 0, 6, unit, self.function,
+                      self.start >> 8, self.start & 0xFF, self.count >> 8, self.count & 0xFF))
+
+    def parse(self, response):
+        """Values of a response ADU (uint16 registers, or 0/1 bits)."""
+        function = response[7]
+        if function == self.function | 0x80:
+            raise PollError(f"exception code {response[8]}")
+        if function != self.function:
+            raise PollError(f"unexpected function code {function}")
+        data = response[9:9 + response[8]]
+        if self.function >= 0x03:
+            if len(data) != 2 * self.count:
+                raise PollError(f"{len(data)} data bytes for {self.count} registers")
+            return np.frombuffer(data, ">u2").astype(np.uint16)
+        if len(data) != (self.count + 7) // 8:
+            raise PollError(f"{len(data)} data bytes for {self.count} bits")
+        return np.unpackbits(np.frombuffer(data, np.uint8), bitorder="little")[:self.count].astype(np.uint16)
+
+    def record(self, latency, now):
+        self.responses += 1
+        self.last_ok = now
+        self.last_latency = latency
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        self.arrivals.append(now)
+
+    def rate(self):
+        """Achieved responses per second over the last RATE_WINDOW responses."""
+        if len(self.arrivals) < 2:
+            return 0.0
+        return (len(self.arrivals) - 1) / max(self.arrivals[-1] - self.arrivals[0], 1e-9)
+
+    def staleness(self, now=None):
+        """Seconds since the last good response (inf before the first one)."""
+        if self.last_ok is None:
+            return float("inf")
+        return (now or time.monotonic()) - self.last_ok
+
+    def stats(self, now=None):
+        return {
+            "block": self.name,
+            "table": self.table,
+            "start": self.start,
+            "count": self.count,
+            "period": self.period,
+            "target_rate": 1.0 / self.period,
+            "rate": self.rate(),
+            "staleness": self.staleness(now),
+            "polls": self.polls,
+            "responses": self.responses,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "late": self.late,
+            "latency_mean_ms": self.latency_total / self.responses * 1e3 if self.responses else 0.0,
+            "latency_max_ms": self.latency_max * 1e3,
+        }
+
+
+def split_blocks(name, table, start, count, period):
+    """PollBlocks covering [start, start+count) within the per-request limit of `table`."""
+    limit = MAX_REGISTERS if FUNCTION_CODES[table] >= 0x03 else MAX_BITS
+    blocks = []
+    for offset in range(0, count, limit):
+        suffix = f"#{offset // limit}" if count > limit else ""
+        blocks.append(PollBlock(name + suffix, table, start + offset, min(limit, count - offset), period))
+    return blocks
+
+
+def map_blocks(name, table, register_map, period):
+    """PollBlocks covering every tag of `register_map`."""
+    start, count = register_map.span()
+    return split_blocks(name, table, start, count, period)
+
+
+def asherah_blocks(fast=0.1, normal=0.5, slow=2.0):
+    """Default polling plan: power and flows fast, measurements normal, commands and states slow."""
+    return (map_blocks("fast", "input_registers", INPUT_REGISTER_MAP.subset(FAST_TAGS), fast)
+            + map_blocks("measurements", "input_registers", INPUT_REGISTER_MAP, normal)
+            + map_blocks("discrete_inputs", "discrete_inputs", DISCRETE_INPUT_MAP, normal)
+            + map_blocks("setpoints", "holding_registers", HOLDING_REGISTER_MAP, slow)
+            + map_blocks("coils", "coils", COIL_MAP, slow))
+
+
+class PollConnection:
+    """One Modbus/TCP connection and the reads in flight on it."""
+
+    def __init__(self, name, pipeline):
+        self.name = name
+        self.transport = None
+        self.protocol = None
+        self.pending = {}  # transaction ID -> (block, future)
+        self.next_tid = 0
+        self.connects = 0
+        self.lock = asyncio.Lock()
+        self.slots = asyncio.Semaphore(pipeline)
+
+    @property
+    def connected(self):
+        return self.transport is not None and not self.transport.is_closing()
+
+    def allocate_tid(self):
+        while True:
+            tid = self.next_tid
+            self.next_tid = (self.next_tid + 1) & 0xFFFF
+            if tid not in self.pending:
+                return tid
+
+    def response(self, response):
+        entry = self.pending.pop((response[0] << 8) | response[1], None)
+        if entry is None:
+            return False  # Late reply to a read that already timed out
+        block, future = entry
+        if not future.done():
+            try:
+                future.set_result(block.parse(response))
+            except PollError as e:
+                future.set_exception(e)
+        return False  # The response was parsed (copied) during the call
+
+    def lost(self, protocol, exc):
+        if self.protocol is not protocol:
+            return  # An older connection, already replaced
+        for block, future in self.pending.values():
+            if not future.done():
+                future.set_exception(PollError(f"connection lost ({exc})" if exc else "connection lost"))
+        self.pending.clear()
+        self.transport = self.protocol = None
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+class ModbusPoller:
+    """Poll a set of blocks concurrently, one Modbus/TCP connection per table.
+
+    The tables are read in parallel on their own connections. By default
+    each connection carries one request at a time, since many Modbus
+    servers (pymodbus among them) drop requests pipelined behind an
+    unanswered one; pipeline > 1 lets blocks of the same table overlap on
+    servers that queue them.
+
+    The latest values of each table live in one uint16 array per table,
+    updated in place as responses arrive; read() decodes them through a
+    RegisterMap together with the staleness of the oldest block involved.
+    read() and stats() may be called from another thread.
+
+    Failed reads are reported through log(text) (print by default; None
+    keeps them silent, for dashboards that show block.last_error instead).
+    """
+
+    def __init__(self, host, port, blocks, unit=1, timeout=1.0, pipeline=1, on_update=None, log=print):
+        self.host = host
+        self.port = port
+        self.log = log
+        self.blocks = list(blocks)
+        self.unit = unit
+        self.timeout = timeout
+        self.pipeline = pipeline
+        self.on_update = on_update  # on_update(block), called on the event loop after each good response
+        self.values = {}
+        for block in self.blocks:
+            size = max(len(self.values.get(block.table, ())), block.start + block.count)
+            values = np.zeros(size, np.uint16)
+            if block.table in self.values:
+                values[:len(self.values[block.table])] = self.values[block.table]
+            self.values[block.table] = values
+        self.lock = threading.Lock()  # Guards self.values against readers in other threads
+        self.connections = {}  # table -> PollConnection, created in run()
+        self.started_at = None
+        self._stopping = None
+
+    async def _connect(self, conn):
+        async with conn.lock:
+            if conn.connected:
+                return
+            protocol = FrameProtocol(conn.response)
+            protocol.on_lost = lambda exc: conn.lost(protocol, exc)
+            conn.transport, _ = await asyncio.wait_for(
+                asyncio.get_running_loop().create_connection(lambda: protocol, self.host, self.port),
+                self.timeout)
+            conn.protocol = protocol
+            conn.connects += 1
+            sock = conn.transport.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    async def poll(self, block):
+        """Read one block once and store its values. Raises PollError or OSError."""
+        conn = self.connections[block.table]
+        async with conn.slots:
+            if not conn.connected:
+                await self._connect(conn)
+            tid = conn.allocate_tid()
+            future = asyncio.get_running_loop().create_future()
+            conn.pending[tid] = (block, future)
+            block.polls += 1
+            sent_at = time.monotonic()
+            conn.transport.write(block.request(tid, self.unit))
+            try:
+                values = await asyncio.wait_for(future, self.timeout)
+            except asyncio.TimeoutError:
+                conn.pending.pop(tid, None)
+                block.timeouts += 1
+                raise PollError(f"no response within {self.timeout:g}s")
+        now = time.monotonic()
+        with self.lock:
+            self.values[block.table][block.start:block.start + block.count] = values
+        block.record(now - sent_at, now)
+        if self.on_update is not None:
+            self.on_update(block)
+
+    async def _poll_loop(self, block):
+        next_poll = time.monotonic()
+        while True:
+            try:
+                await self.poll(block)
+            except (PollError, OSError, asyncio.TimeoutError) as e:
+                block.errors += 1
+                block.last_error = str(e) or type(e).__name__
+                if self.log is not None and (block.errors == 1 or block.errors % 100 == 0):
+                    self.log(f" Poll {self.host}:{self.port} {block.name} failed ({block.errors} errors): {e}")
+            # Fixed cadence; a read longer than the period skips the missed slots
+            next_poll += block.period
+            delay = next_poll - time.monotonic()
+            if delay < 0:
+                block.late += int(-delay // block.period) + 1
+                next_poll = time.monotonic()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def run(self, duration=None):
+        """Poll every block until stop() is called (or for `duration` seconds)."""
+        loop = asyncio.get_running_loop()
+        self.connections = {table: PollConnection(table, self.pipeline) for table in self.values}
+        self._stopping = loop.create_future()
+        self.started_at = time.monotonic()
+        tasks = [loop.create_task(self._poll_loop(block)) for block in self.blocks]
+        try:
+            await asyncio.wait_for(asyncio.shield(self._stopping), duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for conn in self.connections.values():
+                conn.close()
+            await asyncio.sleep(0)  # Let the transports run connection_lost()
+
+    def stop(self):
+        """Make run() return. Must be called on the poller's event loop."""
+        if self._stopping is not None and not self._stopping.done():
+            self._stopping.set_result(None)
+
+    def read(self, register_map, table):
+        """(engineering values in tag order, staleness in seconds) of `register_map`'s tags.
+
+        Staleness is that of the least recently refreshed block covering
+        any of the tags (inf until each of them has been read once).
+        """
+        start, count = register_map.span()
+        now = time.monotonic()
+        freshest = np.full(count, np.inf)  # Per address of the span, staleness of its freshest block
+        for b in self.blocks:
+            if b.table == table and b.start < start + count and b.start + b.count > start:
+                window = freshest[max(b.start - start, 0):b.start + b.count - start]
+                np.minimum(window, b.staleness(now), out=window)
+        staleness = float(freshest[np.asarray(register_map.addresses) - start].max())
+        with self.lock:
+            raw = self.values[table][start:start + count].copy()
+        return register_map.decode(raw, start), staleness
+
+    def stats(self):
+        """Per-block statistics, in block order."""
+        now = time.monotonic()
+        return [block.stats(now) for block in self.blocks]
+
+
+class BackgroundPoller:
+    """Run one or more ModbusPollers on a single event loop in a daemon thread.
+
+    `poller` is the first of them.
+    """
+
+    def __init__(self, *pollers):
+        if not pollers:
+            raise ValueError("at least one ModbusPoller is needed")
+        self.pollers = pollers
+        self.poller = pollers[0]
+        self.loop = None
+        self.thread = None
+
+    async def _run(self):
+        await asyncio.gather(*(poller.run() for poller in self.pollers))
+
+    def start(self):
+        ready = threading.Event()
+
+        def main():
+            self.loop = asyncio.new_event_loop()
+            ready.set()
+            try:
+                self.loop.run_until_complete(self._run())
+            finally:
+                self.loop.close()
+
+        self.thread = threading.Thread(target=main, name="modbus-poller", daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self
+
+    def wait_fresh(self, timeout=5.0):
+        """Wait until every block of every poller has been read once. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        while any(block.last_ok is None for poller in self.pollers for block in poller.blocks):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.02)
+        return True
+
+    def stop(self):
+        if self.thread is not None and self.loop is not None and self.loop.is_running():
+            for poller in self.pollers:
+                self.loop.call_soon_threadsafe(poller.stop)
+            self.thread.join(timeout=5)
+
+
+def format_stats(stats):
+    """Per-block statistics as printable lines."""
+    lines = [f"{'block':<18} {'table':<18} {'range':>9} {'target/s':>9} {'rate/s':>8} "
+             f"{'stale ms':>9} {'lat ms':>7} {'errors':>6} {'late':>5}"]
+    for s in stats:
+        stale = f"{s['staleness'] * 1e3:.0f}" if s['staleness'] != float("inf") else "-"
+        lines.append(f"{s['block']:<18} {s['table']:<18} {s['start']:>4}+{s['count']:<4} "
+                     f"{s['target_rate']:>9.1f} {s['rate']:>8.1f} {stale:>9} "
+                     f"{s['latency_mean_ms']:>7.1f} {s['errors']:>6} {s['late']:>5}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll the Asherah tables concurrently with per-block rates")
+    parser.add_argument("--host", default=ASHERAH_IP)
+    parser.add_argument("--port", type=int, default=ASHERAH_PORT)
+    parser.add_argument("--unit", type=int, default=1)
+    parser.add_argument("--fast", type=float, default=0.1, help="Period of the power/flow block (s)")
+    parser.add_argument("--normal", type=float, default=0.5, help="Period of the measurement blocks (s)")
+    parser.add_argument("--slow", type=float, default=2.0, help="Period of the setpoint/coil blocks (s)")
+    parser.add_argument("--timeout", type=float, default=1.0, help="Per-request timeout (s)")
+    parser.add_argument("--pipeline", type=int, default=1,
+                        help="Requests in flight per connection (>1 only if the server queues pipelined requests)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to poll before printing the stats")
+    args = parser.parse_args()
+
+    profiler = RttProfiler()
+    poller = ModbusPoller(args.host, args.port, asherah_blocks(args.fast, args.normal, args.slow),
+                          unit=args.unit, timeout=args.timeout, pipeline=args.pipeline,
+                          on_update=lambda block: profiler.record(block.function, block.last_latency))
+    print(f"Polling {args.host}:{args.port} for {args.duration:g}s "
+          f"({len(poller.blocks)} blocks, {sum(1 / b.period for b in poller.blocks):.1f} requests/s)...")
+    try:
+        asyncio.run(poller.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    print("\n".join(format_stats(poller.stats())))
+    print()
+    print("\n".join(format_rows(profiler.rows())))
+    sys.exit(0 if any(b.responses for b in poller.blocks) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Loop/replay detector for polled register vectors.
+
+A replay attack in loop mode (ReplayAttack.replay_loop) feeds the SCADA
+the same recorded sequence of register vectors over and over. A live
+plant never does: even in steady state its sensor noise does not repeat.
+Two streaming checks look for that, each costing O(1) amortized per
+sample:
+
+- repeated sequences: every vector is hashed, exactly and with its low
+  NEAR_BITS dropped (so small edits to replayed values still match), and a
+  polynomial rolling hash of the last SEQUENCE_LENGTH vector hashes is
+  looked up in a hash -> position index over the last HORIZON samples. A
+  sequence that reappears at the same lag CONFIRM_SAMPLES times in a row,
+  and is not just a constant vector, is a replay.
+- periodic noise: per tag, a rolling hash of the last SEQUENCE_LENGTH
+  sample-to-sample deltas is indexed the same way. Noise is removed from
+  levels by the deltas, so the check still fires when a replay is
+  shifted or scaled slightly. Short delta sequences of a quiet tag (+-1
+  LSB) do recur by chance, a few tags at a time, so it needs most noisy
+  tags (PERIODIC_SHARE, at least MIN_PERIODIC_TAGS) repeating at the
+  same lag, as a replay of the whole vector does.
+
+Expired index entries are dropped as the window slides (each position is
+inserted and evicted once). A noise-free process that is exactly periodic
+(a limit cycle quantized to the same registers) repeats for real and is
+reported too.
+
+    detector = ReplayDetector(width=95, exclude=[94])
+    for alarm in detector.update(registers, timestamp):
+        print(describe(alarm))
+
+Usage (inspector on captured traffic, one detector per read signature):
+    python3 replay_detector.py capture.pcap
+    python3 replay_detector.py recorded_values.rec --horizon 100000
+"""
+
+import argparse
+import os
+import sys
+from collections import Counter, deque, namedtuple
+
+import numpy as np
+
+SEQUENCE_LENGTH = 8     # Vectors per hashed subsequence
+HORIZON = 36000         # Samples kept in the index (1 h at 10 Hz)
+CONFIRM_SAMPLES = 3     # Consecutive matches at the same lag before alarming
+HOLD_SAMPLES = 100      # Samples without a confirmed match before an alarm clears
+MIN_DISTINCT = 4        # Distinct vectors a subsequence needs (constant signals repeat legitimately)
+NEAR_BITS = 4           # Low bits ignored by the near-exact hash (16 raw steps, 0.02% of range)
+MIN_PERIODIC_TAGS = 3   # Noisy tags repeating at the same lag for a periodic-noise alarm
+PERIODIC_SHARE = 0.5    # ... and as a fraction of the noisy tags
+NOISY_FRACTION = 0.5    # Nonzero deltas a tag needs in a subsequence to count as noisy
+
+MODULUS = (1 << 61) - 1
+BASE = 1_000_003
+TAG_BASE = np.uint64(0x9E3779B97F4A7C15)  # Odd multiplier for the per-tag hashes (mod 2**64)
+
+ReplayAlarm = namedtuple("ReplayAlarm", "kind lag seconds tags run")
+
+
+def describe(alarm):
+    """One-line text of a ReplayAlarm."""
+    what = {"exact": "replayed sequence", "near": "near-identical sequence",
+            "noise": "periodic sensor noise"}[alarm.kind]
+    tags = f" on {', '.join(alarm.tags[:4])}{'...' if len(alarm.tags) > 4 else ''}" if alarm.tags else ""
+    return f"{what}{tags}: repeats every {alarm.lag} samples ({alarm.seconds:.1f}s)"
+
+
+class SequenceIndex:
+    """Rolling hash of the last `length` item hashes, indexed over a sliding window.
+
+    push(h, position) returns the lag to the previous occurrence of the
+    current subsequence inside the window, or None.
+    """
+
+    def __init__(self, length=SEQUENCE_LENGTH, horizon=HORIZON):
+        self.length = length
+        self.horizon = horizon
+        self.drop = pow(BASE, length - 1, MODULUS)  # Weight of the item leaving the subsequence
+        self.items = deque()
+        self.rolling = 0
+        self.index = {}        # subsequence hash -> last position
+        self.inserted = deque()  # (position, subsequence hash), oldest first
+        self.counts = Counter()  # item hash -> occurrences in the current subsequence
+
+    def distinct(self):
+        return len(self.counts)
+
+    def push(self, h, position):
+        if len(self.items) == self.length:
+            old = self.items.popleft()
+            self.rolling = (self.rolling - old * self.drop) % MODULUS
+            self.counts[old] -= 1
+            if not self.counts[old]:
+                del self.counts[old]
+        self.items.append(h)
+        self.counts[h] += 1
+        self.rolling = (self.rolling * BASE + h) % MODULUS
+
+        while self.inserted and self.inserted[0][0] <= position - self.horizon:
+            expired, key = self.inserted.popleft()
+            if self.index.get(key) == expired:
+                del self.index[key]
+        if len(self.items) < self.length:
+            return None
+        previous = self.index.get(self.rolling)
+        self.index[self.rolling] = position
+        self.inserted.append((position, self.rolling))
+        return None if previous is None else position - previous
+
+
+class ReplayDetector:
+    """Repeated-subsequence and periodic-noise detector for one stream of register vectors.
+
+    update(registers, timestamp) takes the raw values of one poll and
+    returns the alarms that started with it; `active` holds the alarms
+    still present, by kind. Columns in `exclude` (clocks, counters) are
+    ignored.
+    """
+
+    def __init__(self, width, exclude=(), length=SEQUENCE_LENGTH, horizon=HORIZON, names=None):
+        self.keep = np.ones(width, bool)
+        self.keep[list(exclude)] = False
+        self.names = names
+        self.length = length
+        self.horizon = horizon
+        self.position = 0
+        self.timestamps = np.zeros(horizon)
+        self.sequences = {"exact": SequenceIndex(length, horizon), "near": SequenceIndex(length, horizon)}
+        self.runs = {kind: (None, 0) for kind in self.sequences}  # kind -> (lag, consecutive matches)
+        self.active = {}
+        self.confirmed_at = {}  # kind -> position of the last confirmed match
+
+        # Per-tag delta hashes (uint64 arithmetic wraps, i.e. works mod 2**64)
+        tags = int(self.keep.sum())
+        self.columns = np.flatnonzero(self.keep)
+        self.previous = None
+        self.deltas = deque()
+        self.tag_hash = np.zeros(tags, np.uint64)
+        self.tag_drop = np.uint64(pow(int(TAG_BASE), length - 1, 1 << 64))
+        self.nonzero = np.zeros(tags, np.int64)
+        self.salt = (np.arange(tags, dtype=np.uint64) + np.uint64(1)) * np.uint64(0xBF58476D1CE4E5B9)
+        self.tag_index = {}
+        self.tag_inserted = deque()
+        self.tag_lag = np.zeros(tags, np.int64)
+        self.tag_run = np.zeros(tags, np.int64)
+
+    def _seconds(self, lag):
+        return float(self.timestamps[self.position % self.horizon]
+                     - self.timestamps[(self.position - lag) % self.horizon])
+
+    def _alarm(self, kind, lag, run, tags=()):
+        alarm = ReplayAlarm(kind, lag, self._seconds(lag), list(tags), run)
+        new = kind not in self.active
+        self.active[kind] = alarm
+        self.confirmed_at[kind] = self.position
+        return alarm if new else None
+
+    def _quiet(self, kind):
+        """No confirmed match this sample: clear the alarm once HOLD_SAMPLES have passed."""
+        if kind in self.active and self.position - self.confirmed_at[kind] >= HOLD_SAMPLES:
+            del self.active[kind]
+
+    def update(self, registers, timestamp):
+        """Feed one poll; returns the list of new ReplayAlarm."""
+        values = np.asarray(registers, np.uint16)[self.keep]
+        self.timestamps[self.position % self.horizon] = timestamp
+        new = []
+
+        # --- Whole-vector subsequences, exact and near-exact ---
+        for kind, vector in (("exact", values), ("near", values >> NEAR_BITS)):
+            sequence = self.sequences[kind]
+            lag = sequence.push(hash(vector.tobytes()), self.position)
+            last_lag, run = self.runs[kind]
+            if lag is not None and sequence.distinct() >= MIN_DISTINCT:
+                run = run + 1 if lag == last_lag else 1
+                self.runs[kind] = (lag, run)
+                if run >= CONFIRM_SAMPLES:
+                    alarm = self._alarm(kind, lag, run)
+                    if alarm:
+                        new.append(alarm)
+                    continue
+            else:
+                self.runs[kind] = (None, 0)
+            self._quiet(kind)
+
+        # --- Per-tag delta subsequences (periodic noise) ---
+        if self.previous is not None:
+            delta = values.astype(np.int64) - self.previous
+            self.deltas.append(delta)
+            if len(self.deltas) > self.length:
+                old = self.deltas.popleft()
+                self.tag_hash -= old.astype(np.uint64) * self.tag_drop
+                self.nonzero -= old != 0
+            self.tag_hash = self.tag_hash * TAG_BASE + delta.astype(np.uint64)
+            self.nonzero += delta != 0
+            new += self._periodic_noise()
+        self.previous = values.astype(np.int64)
+
+        self.position += 1
+        return new
+
+    def _periodic_noise(self):
+        while self.tag_inserted and self.tag_inserted[0][0] <= self.position - self.horizon:
+            expired, keys = self.tag_inserted.popleft()
+            for key in keys:
+                if self.tag_index.get(key) == expired:
+                    del self.tag_index[key]
+        if len(self.deltas) < self.length:
+            return []
+
+        noisy = np.flatnonzero(self.nonzero >= NOISY_FRACTION * self.length)
+        keys = (self.tag_hash[noisy] ^ self.salt[noisy]).tolist()
+        lags = np.zeros(len(self.tag_lag), np.int64)
+        index = self.tag_index
+        for column, key in zip(noisy.tolist(), keys):
+            previous = index.get(key)
+            if previous is not None:
+                lags[column] = self.position - previous
+            index[key] = self.position
+        self.tag_inserted.append((self.position, keys))
+
+        self.tag_run = np.where((lags > 0) & (lags == self.tag_lag), self.tag_run + 1, (lags > 0).astype(np.int64))
+        self.tag_lag = lags
+        confirmed = np.flatnonzero(self.tag_run >= CONFIRM_SAMPLES)
+        needed = max(MIN_PERIODIC_TAGS, PERIODIC_SHARE * len(noisy))
+        if len(confirmed) >= needed:
+            lag, count = Counter(self.tag_lag[confirmed].tolist()).most_common(1)[0]
+            if count >= needed:
+                columns = confirmed[self.tag_lag[confirmed] == lag]
+                tags = [self.names[i] if self.names else str(i) for i in self.columns[columns]]
+                alarm = self._alarm("noise", lag, int(self.tag_run[columns].min()), tags)
+                return [alarm] if alarm else []
+        self._quiet("noise")
+        return []
+
+
+def load_samples(path, port, server):
+    """(timestamp, unit_id, function, address, registers) of every read in a capture or recording."""
+    if os.path.splitext(path)[1].lower() in (".pcap", ".pcapng", ".cap"):
+        from modbus_pcap import extract_reads
+        yield from extract_reads([path], port, server)
+        return
+    from recording_format import Recording
+    recording = Recording.load(path)
+    recording.timestamps()  # Materializes samples parsed from JSON
+    for row in recording.records:
+        yield (float(row['timestamp']), int(row['unit_id']), int(row['function']), int(row['address']),
+               row['registers'][:row['count']])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look for looped/replayed register sequences in captured traffic")
+    parser.add_argument("source", help="pcap/pcapng capture or .rec/.recz/.json recording")
+    parser.add_argument("--port", type=int, default=502, help="Modbus TCP port (captures)")
+    parser.add_argument("--server", help="Only this server IP (captures)")
+    parser.add_argument("--horizon", type=int, default=HORIZON, help="Samples kept in the index per read signature")
+    parser.add_argument("--length", type=int, default=SEQUENCE_LENGTH, help="Vectors per hashed subsequence")
+    args = parser.parse_args()
+
+    from asherah_registers import INPUT_REGISTER_MAP
+    clock = INPUT_REGISTER_MAP.tag("INT_SimulationTime").address
+
+    detectors = {}
+    samples = alarms = 0
+    for timestamp, unit_id, function, address, registers in load_samples(args.source, args.port, args.server):
+        samples += 1
+        signature = (unit_id, function, address, len(registers))
+        detector = detectors.get(signature)
+        if detector is None:
+            exclude = [clock - address] if function == 0x04 and address <= clock < address + len(registers) else []
+            names = None
+            if function == 0x04 and address == 0:
+                names = INPUT_REGISTER_MAP.names[:len(registers)] + [str(i) for i in range(95, len(registers))]
+            detector = detectors[signature] = ReplayDetector(len(registers), exclude, args.length,
+                                                             args.horizon, names)
+        for alarm in detector.update(registers, timestamp):
+            alarms += 1
+            print(f"{timestamp:.3f}  unit {unit_id} FC{function:02d} @{address}+{len(registers)}  {describe(alarm)}")
+
+    if not samples:
+        print(f" No register reads found in {args.source}")
+        sys.exit(1)
+    print(f"\n{samples} reads over {len(detectors)} read signature(s), {alarms} alarm(s)")
+    sys.exit(2 if alarms else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Per-function-code round-trip time profile of Modbus polls, with shift alarms.
+
+Every response time (request written -> response parsed, monotonic clock)
+is counted in a LatencyHistogram for its function code, in tumbling
+windows of WINDOW seconds. For each function code the profile keeps:
+
+- p50/p99 of the last complete window;
+- jitter, the RFC 3550 estimator: J += (|rtt - previous rtt| - J) / 16;
+- a baseline: the merged histograms of the last BASELINE_WINDOWS windows
+  that were not flagged (compared once MIN_BASELINE_WINDOWS are learned).
+
+When a window closes it is compared with the baseline. The distance is the
+two-sample Kolmogorov-Smirnov statistic, computed on the shared bucket
+layout. The window is flagged when that distance is significant
+(KS_COEFFICIENT, alpha ~0.001) and p50 or p99 also moved by more than
+max(MIN_SHIFT, MIN_RELATIVE x baseline). CONFIRM_WINDOWS flagged windows
+in a row raise a LatencyShift. A MITM on the path (arp_mitm.sh + the
+proxy) adds a fraction of a millisecond to every poll, which is enough.
+Flagged windows are kept out of the baseline, so a lasting shift stays
+reported rather than being learned.
+
+    profiler = RttProfiler()
+    poller = ModbusPoller(host, port, blocks,
+                          on_update=lambda block: profiler.record(block.function, block.last_latency))
+    for row in profiler.rows(): ...
+    profiler.active  # {function code: LatencyShift}
+
+record() runs on the poller's event loop; rows() and `active` may be
+read from another thread.
+"""
+
+import math
+import threading
+import time
+from collections import deque, namedtuple
+
+from latency_histogram import LatencyHistogram
+from proxy_metrics import FUNCTION_NAMES
+
+WINDOW = 5.0              # Seconds per histogram window
+BASELINE_WINDOWS = 12     # Clean windows merged into the baseline (1 min)
+MIN_BASELINE_WINDOWS = 3  # Clean windows learned before comparing
+MIN_WINDOW_SAMPLES = 20   # Smaller windows (and baselines) are not compared
+KS_COEFFICIENT = 1.95     # c(alpha) of the two-sample KS test, alpha ~0.001
+MIN_SHIFT = 0.0002        # Smallest p50/p99 change reported (s)
+MIN_RELATIVE = 0.25       # ... and as a fraction of the baseline value
+CONFIRM_WINDOWS = 2       # Flagged windows in a row before a shift is raised
+JITTER_GAIN = 1.0 / 16    # RFC 3550 interarrival jitter gain
+
+LatencyShift = namedtuple("LatencyShift", "function p50 p99 baseline_p50 baseline_p99 distance")
+
+
+def describe(shift):
+    """One-line text of a LatencyShift."""
+    return (f"FC{shift.function:02d} RTT p50 {shift.p50 * 1e3:.2f} ms / p99 {shift.p99 * 1e3:.2f} ms "
+            f"vs baseline {shift.baseline_p50 * 1e3:.2f} / {shift.baseline_p99 * 1e3:.2f} ms")
+
+
+def ks_distance(a, b):
+    """Largest gap between the cumulative distributions of two histograms with the same layout."""
+    seen_a = seen_b = 0
+    distance = 0.0
+    for count_a, count_b in zip(a.counts, b.counts):
+        seen_a += count_a
+        seen_b += count_b
+        distance = max(distance, abs(seen_a / a.count - seen_b / b.count))
+    return distance
+
+
+class FunctionProfile:
+    """Windows, baseline and jitter of one function code."""
+
+    def __init__(self, function, started_at):
+        self.function = function
+        self.window = LatencyHistogram()
+        self.window_start = started_at
+        self.last = None          # Last complete window
+        self.clean = deque(maxlen=BASELINE_WINDOWS)
+        self.baseline = None      # Merged `clean` windows
+        self.previous = None
+        self.jitter = 0.0
+        self.count = 0
+        self.flagged = 0          # Flagged windows in a row
+        self.shift = None
+
+    def record(self, rtt):
+        if self.previous is not None:
+            self.jitter += (abs(rtt - self.previous) - self.jitter) * JITTER_GAIN
+        self.previous = rtt
+        self.window.record(rtt)
+        self.count += 1
+
+    def close_window(self, now):
+        """Compare the window with the baseline and start a new one."""
+        window = self.window
+        self.window = LatencyHistogram()
+        self.window_start = now
+        if window.count < MIN_WINDOW_SAMPLES:
+            return
+        self.last = window
+        baseline = self.baseline
+        if len(self.clean) < MIN_BASELINE_WINDOWS:
+            self._learn(window)
+            return
+
+        distance = ks_distance(window, baseline)
+        critical = KS_COEFFICIENT * math.sqrt((window.count + baseline.count) / (window.count * baseline.count))
+        moved = False
+        for p in (50, 99):
+            before, after = baseline.percentile(p), window.percentile(p)
+            if abs(after - before) > max(MIN_SHIFT, MIN_RELATIVE * before):
+                moved = True
+        if distance > critical and moved:
+            self.flagged += 1
+            if self.flagged >= CONFIRM_WINDOWS:
+                self.shift = LatencyShift(self.function, window.percentile(50), window.percentile(99),
+                                          baseline.percentile(50), baseline.percentile(99), distance)
+            return
+        self.flagged = 0
+        self.shift = None
+        self._learn(window)
+
+    def _learn(self, window):
+        self.clean.append(window)
+        baseline = LatencyHistogram()
+        for clean in self.clean:
+            baseline.merge(clean)
+        self.baseline = baseline
+
+
+class RttProfiler:
+    """RTT histograms, jitter and baseline-shift detection per Modbus function code."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.profiles = {}  # function code -> FunctionProfile
+        self.lock = threading.Lock()
+
+    def record(self, function, rtt, now=None):
+        """Count one response time (seconds) of `function`."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            profile = self.profiles.get(function)
+            if profile is None:
+                profile = self.profiles[function] = FunctionProfile(function, now)
+            elif now - profile.window_start >= self.window:
+                profile.close_window(now)
+            profile.record(rtt)
+
+    def tick(self, now=None):
+        """Close the windows that have run out (for function codes no longer answered)."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            for profile in self.profiles.values():
+                if now - profile.window_start >= self.window:
+                    profile.close_window(now)
+
+    @property
+    def active(self):
+        """{function code: LatencyShift} of the shifts now reported."""
+        with self.lock:
+            return {function: profile.shift for function, profile in self.profiles.items() if profile.shift}
+
+    def rows(self):
+        """Per function code: name, count, p50/p99/jitter (s) of the last window, baseline p50/p99, shift."""
+        rows = []
+        with self.lock:
+            for function in sorted(self.profiles):
+                profile = self.profiles[function]
+                histogram = profile.last or profile.window
+                baseline = profile.baseline
+                rows.append({
+                    "function": function,
+                    "name": FUNCTION_NAMES.get(function, f"function_{function}"),
+                    "count": profile.count,
+                    "p50": histogram.percentile(50),
+                    "p99": histogram.percentile(99),
+                    "jitter": profile.jitter,
+                    "baseline_p50": baseline.percentile(50) if baseline else None,
+                    "baseline_p99": baseline.percentile(99) if baseline else None,
+                    "learning": len(profile.clean) < MIN_BASELINE_WINDOWS,
+                    "shift": profile.shift,
+                })
+        return rows
+
+
+def format_rows(rows):
+    """Profile rows as printable lines (milliseconds)."""
+    lines = [f"{'function':<28} {'count':>7} {'p50 ms':>7} {'p99 ms':>7} {'jitter':>7} {'base p50':>8} {'base p99':>8}"]
+    for row in rows:
+        base_p50 = f"{row['baseline_p50'] * 1e3:.2f}" if row["baseline_p50"] is not None else "-"
+        base_p99 = f"{row['baseline_p99'] * 1e3:.2f}" if row["baseline_p99"] is not None else "-"
+        state = " SHIFT" if row["shift"] else " learning" if row["learning"] else ""
+        lines.append(f"FC{row['function']:02d} {row['name']:<23} {row['count']:>7} {row['p50'] * 1e3:>7.2f} "
+                     f"{row['p99'] * 1e3:>7.2f} {row['jitter'] * 1e3:>7.3f} {base_p50:>8} {base_p99:>8}{state}")
+    return lines
@@ -10,15 +10,49 @@ from pymodbus.client import ModbusTcpClient
 import time
 import sys
 import threading
+from asherah_registers import COIL_MAP, HOLDING_REGISTER_MAP, INPUT_REGISTER_MAP
+from register_poller import BackgroundPoller, ModbusPoller, map_blocks
 
 ASHERAH_IP = "172.20.0.10"
 ASHERAH_PORT = 502
+MEASUREMENT_PERIOD = 1.0  # s, background polling of the values shown during an attack
+COMMAND_PERIOD = 2.0
+STALE_LIMIT = 5.0  # s, older readings are reported as a read failure
+
+# Status field -> Asherah tag (docs/Registres_modbus.md)
+MEASUREMENT_TAGS = {
+    'power': "RX_ReactorPower",
+    'fuel_temp': "RX_FuelTemp",
+    'mean_temp': "RX_MeanCoolTemp",
+    'flow1': "RC1_PumpFlow",
+    'flow2': "RC2_PumpFlow",
+    'pump1_speed': "RC1_PumpSpeed",
+    'pump2_speed': "RC2_PumpSpeed",
+}
+COMMAND_TAGS = {
+    'cmd_pump1_speed': "RC1_PumpSpeedCmd",
+    'cmd_pump2_speed': "RC2_PumpSpeedCmd",
+}
+STATE_TAGS = {
+    'pump1_on': "RC1_PumpOnOffCmd",
+    'pump2_on': "RC2_PumpOnOffCmd",
+}
+MEASUREMENT_MAP = INPUT_REGISTER_MAP.subset(MEASUREMENT_TAGS.values(), celsius=True)
+COMMAND_MAP = HOLDING_REGISTER_MAP.subset(COMMAND_TAGS.values())
+STATE_MAP = COIL_MAP.subset(STATE_TAGS.values())
 
 class SpamAttack:
     def __init__(self):
         self.client = ModbusTcpClient(ASHERAH_IP, port=ASHERAH_PORT, timeout=5)
         self.spamming = False
         self.spam_thread = None
+        # Status is polled in the background on separate connections, so
+        # reads never wait behind (or share the client with) the spam threads
+        self.poller = ModbusPoller(ASHERAH_IP, ASHERAH_PORT,
+                                   map_blocks("measurements", "input_registers", MEASUREMENT_MAP, MEASUREMENT_PERIOD)
+                                   + map_blocks("commands", "holding_registers", COMMAND_MAP, COMMAND_PERIOD)
+                                   + map_blocks("states", "coils", STATE_MAP, COMMAND_PERIOD))
+        self.background = BackgroundPoller(self.poller)
         
     def connect(self):
         print(f"Connecting to Asherah ({ASHERAH_IP}:{ASHERAH_PORT})...")
@@ -26,36 +60,28 @@ class SpamAttack:
         if not self.client.connected:
             print("Cannot connect")
             sys.exit(1)
+        self.background.start()
+        self.background.wait_fresh()
         print("Connected\n")
     
     def read_values(self):
-        """Read key values from the device (input/holding registers, discrete inputs)."""
+        """Latest key values polled from the device (input/holding registers, pump coils)."""
         try:
-            ir = self.client.read_input_registers(address=0, count=25, slave=1)
-            hr = self.client.read_holding_registers(address=0, count=20, slave=1)
-            coils = self.client.read_discrete_inputs(address=0, count=12, slave=1)
+            measurements, measurements_age = self.poller.read(MEASUREMENT_MAP, "input_registers")
+            commands, commands_age = self.poller.read(COMMAND_MAP, "holding_registers")
+            states, states_age = self.poller.read(STATE_MAP, "coils")
             
-            if ir.isError() or hr.isError() or coils.isError():
+            if max(measurements_age, commands_age, states_age) > STALE_LIMIT:
                 return None
             
-            return {
-                # Measurements
-                'power': ir.registers[14] * 0.00183105469,
-                'fuel_temp': ir.registers[12] * 0.00152590219 - 273.15,
-                'mean_temp': ir.registers[8] * 0.00152590219 - 273.15,
-                'flow1': ir.registers[2] * 0.00015259022,
-                'flow2': ir.registers[6] * 0.00015259022,
-                'pump1_speed': ir.registers[1] * 0.00152590219,
-                'pump2_speed': ir.registers[5] * 0.00152590219,
-                
-                # Current commands (written by the controller)
-                'cmd_pump1_speed': hr.registers[0] * 0.00152590219,
-                'cmd_pump2_speed': hr.registers[1] * 0.00152590219,
-                
-                # States
-                'pump1_on': coils.bits[0] if len(coils.bits) > 0 else None,
-                'pump2_on': coils.bits[1] if len(coils.bits) > 1 else None,
-            }
+            values = {}
+            # Measurements
+            values.update(zip(MEASUREMENT_TAGS, measurements.tolist()))
+            # Current commands (written by the controller)
+            values.update(zip(COMMAND_TAGS, commands.tolist()))
+            # States
+            values.update(zip(STATE_TAGS, states.astype(bool).tolist()))
+            return values
         except Exception as e:
             print(f"Read error: {e}")
             return None
@@ -478,6 +504,7 @@ If successful, this creates a Zero Dynamics attack scenario:
             self.spamming = False
         finally:
             self.spamming = False
+            self.background.stop()
             self.client.close()
             print("\nConnection closed\n")
 
@@ -0,0 +1,95 @@
+"""
+Flicker-free terminal output for the live dashboards.
+
+DiffScreen keeps a model of what is on the terminal (one string per row)
+and, for each new frame, writes only the characters that changed, using
+ANSI cursor moves, in a single write(). A dashboard whose numbers change
+every frame then costs a few hundred bytes per refresh instead of a full
+clear and repaint, so 10-20 Hz refreshes stay smooth even over SSH.
+
+Rows are assumed to use one terminal cell per character (ASCII, box
+drawing, accented letters), which holds for the dashboards here.
+"""
+
+import sys
+
+CSI = "\x1b["
+MAX_GAP = 8  # Unchanged characters rewritten rather than skipped with a cursor move
+
+
+class DiffScreen:
+    """Terminal screen model updated with minimal ANSI writes."""
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.rows = []       # What the terminal currently shows
+        self.active = False
+        self.bytes_written = 0
+
+    def start(self):
+        """Switch to the alternate screen, hide the cursor and clear it."""
+        self._write(f"{CSI}?1049h{CSI}?25l{CSI}2J{CSI}H")
+        self.rows = []
+        self.active = True
+
+    def stop(self):
+        """Restore the cursor and the normal screen."""
+        if self.active:
+            self._write(f"{CSI}?25h{CSI}?1049l")
+            self.active = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def invalidate(self):
+        """Forget the screen model so the next frame is fully repainted (e.g. after a resize)."""
+        self.rows = None
+
+    def render(self, lines):
+        """Bring the terminal from the previous frame to `lines` (a list of strings)."""
+        parts = []
+        if self.rows is None:
+            parts.append(f"{CSI}2J")
+            self.rows = []
+        old_rows = self.rows
+        for row, line in enumerate(lines):
+            old = old_rows[row] if row < len(old_rows) else ""
+            if line != old:
+                self._diff_row(parts, row, old, line)
+        for row in range(len(lines), len(old_rows)):
+            if old_rows[row]:
+                parts.append(f"{CSI}{row + 1};1H{CSI}K")
+        self.rows = list(lines)
+        if parts:
+            parts.append(f"{CSI}{len(lines) + 1};1H")  # Park the cursor below the frame
+            self._write("".join(parts))
+
+    def _diff_row(self, parts, row, old, new):
+        common = min(len(old), len(new))
+        column = 0
+        while column < common:
+            if old[column] == new[column]:
+                column += 1
+                continue
+            # Extend the changed span until MAX_GAP unchanged characters in a row
+            start = end = column
+            while column < common:
+                if old[column] != new[column]:
+                    end = column + 1
+                elif column - end >= MAX_GAP:
+                    break
+                column += 1
+            parts.append(f"{CSI}{row + 1};{start + 1}H{new[start:end]}")
+        if len(new) > common:
+            parts.append(f"{CSI}{row + 1};{common + 1}H{new[common:]}")
+        elif len(old) > common:
+            parts.append(f"{CSI}{row + 1};{common + 1}H{CSI}K")
+
+    def _write(self, text):
+        self.out.write(text)
+        self.out.flush()
+        self.bytes_written += len(text.encode())
@@ -0,0 +1,261 @@
+r"""
+Shared upstream connection pool for the Modbus MITM proxy.
+
+Instead of one socket to Asherah per downstream client, every client is
+multiplexed over a small number of persistent upstream connections. Each
+forwarded request gets a fresh transaction ID unique on its upstream
+connection; the response is matched by that ID and the client's original
+transaction ID is restored before it is handed back.
+
+    client A (tid 1) --\                      /-- upstream #0 (tid 17)
+    client B (tid 1) ----> UpstreamPool -----<
+    client C (tid 9) --/                      \-- upstream #1 (tid 4)
+
+Responses are received with recv_into() into a reusable buffer per
+upstream connection (modbus_framing.FrameProtocol): the client's
+transaction ID is patched in place and the frame is handed to on_response
+as a view of that buffer, so forwarding a response copies nothing in
+user space.
+
+A request left unanswered for `timeout` seconds is given up: its slot is
+released and the client gets a Modbus exception 0x0B (gateway target
+device failed to respond), so a lost upstream response never stalls the
+pool. Requests in flight on an upstream connection that drops get the
+same answer.
+"""
+
+import asyncio
+import socket
+import time
+from collections import deque
+
+from modbus_framing import FrameProtocol
+
+QUEUE_DELAY_SAMPLES = 10000
+REQUEST_TIMEOUT = 3.0  # Seconds an upstream response is awaited
+GATEWAY_TARGET_FAILED = 0x0B  # Modbus exception code sent to the client on timeout
+
+
+class UpstreamConnection:
+    """One persistent connection to the Modbus server and its in-flight requests."""
+
+    def __init__(self, index):
+        self.index = index
+        self.transport = None
+        self.protocol = None
+        self.lock = asyncio.Lock()
+        # upstream transaction ID -> (client writer, client tid, request, queued_at, sent_at, timeout handle)
+        self.in_flight = {}
+        self.pending = 0  # Requests assigned here but not yet in in_flight (waiting for the connection)
+        self.next_tid = 0
+        self.requests = 0
+
+    @property
+    def connected(self):
+        return self.transport is not None and not self.transport.is_closing()
+
+    @property
+    def load(self):
+        """Requests in flight or about to be, used to pick the least busy connection."""
+        return len(self.in_flight) + self.pending
+
+    def allocate_tid(self):
+        """Next transaction ID not currently in flight on this connection."""
+        while True:
+            tid = self.next_tid
+            self.next_tid = (self.next_tid + 1) & 0xFFFF
+            if tid not in self.in_flight:
+                return tid
+
+
+class UpstreamPool:
+    """Multiplex downstream Modbus clients over a few upstream connections."""
+
+    def __init__(self, host, port, size=2, max_in_flight=1, on_response=None, timeout=REQUEST_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.on_response = on_response
+        self.connections = [UpstreamConnection(i) for i in range(size)]
+        self.slots = asyncio.Semaphore(size * max_in_flight)
+
+        # Statistics
+        self.queued = 0
+        self.timeouts = 0
+        self.queue_delays = deque(maxlen=QUEUE_DELAY_SAMPLES)
+        self.started_at = time.monotonic()
+        self._busy_integral = 0.0
+        self._last_change = self.started_at
+        self._in_flight_total = 0
+
+    @property
+    def capacity(self):
+        return self.size * self.max_in_flight
+
+    def _account(self, delta):
+        """Update the time-weighted in-flight integral before changing it."""
+        now = time.monotonic()
+        self._busy_integral += self._in_flight_total * (now - self._last_change)
+        self._last_change = now
+        self._in_flight_total += delta
+
+    async def _connect(self, conn):
+        async with conn.lock:
+            if conn.connected:
+                return
+            protocol = FrameProtocol(lambda response: self._response(conn, response))
+            protocol.on_lost = lambda exc: self._lost(conn, protocol, exc)
+            conn.transport, _ = await asyncio.get_running_loop().create_connection(
+                lambda: protocol, self.host, self.port)
+            conn.protocol = protocol
+            sock = conn.transport.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    async def submit(self, client_writer, request):
+        """Forward one client request upstream; its response is delivered via on_response.
+
+        on_response(client_writer, response, request, queued_at, sent_at)
+        gets the perf_counter() times at which the request was submitted
+        and actually written upstream. `response` is a memoryview into the
+        pool's receive buffer and is only valid during the call.
+        """
+        self.queued += 1
+        queued_at = time.perf_counter()
+        try:
+            await self.slots.acquire()
+        finally:
+            self.queued -= 1
+        self.queue_delays.append(time.perf_counter() - queued_at)
+
+        # Reserve the connection before awaiting its setup, so requests
+        # submitted meanwhile go to another one
+        conn = min(self.connections, key=lambda c: c.load)
+        conn.pending += 1
+        try:
+            if not conn.connected:
+                await self._connect(conn)
+        except OSError:
+            self.slots.release()
+            raise
+        finally:
+            conn.pending -= 1
+
+        tid = conn.allocate_tid()
+        frame = bytearray(request)
+        frame[0] = tid >> 8
+        frame[1] = tid & 0xFF
+        expiry = asyncio.get_running_loop().call_later(self.timeout, self._expire, conn, tid)
+        conn.in_flight[tid] = (client_writer, bytes(request[0:2]), request, queued_at, time.perf_counter(), expiry)
+        conn.requests += 1
+        self._account(1)
+        conn.transport.write(frame)
+        if conn.protocol.paused:
+            await conn.protocol.drain()
+
+    def _response(self, conn, response):
+        """Match one upstream response to its client and restore its transaction ID.
+
+        Returns True if the client transport kept the frame queued, so the
+        receive buffer it points into must not be reused.
+        """
+        entry = conn.in_flight.pop((response[0] << 8) | response[1], None)
+        if entry is None:
+            return False  # Late reply to a transaction we already gave up on
+        self._account(-1)
+        self.slots.release()
+
+        client_writer, client_tid, request, queued_at, sent_at, expiry = entry
+        expiry.cancel()
+        if client_writer.is_closing():
+            return False
+        response[0:2] = client_tid
+        try:
+            self.on_response(client_writer, response, request, queued_at, sent_at)
+        except Exception as e:  # Keep the shared connection up for the other clients
+            print(f" Upstream #{conn.index}: response handler failed: {e!r}")
+            self._gateway_failed(entry)
+            return True
+        # Usually the write went straight to the socket; otherwise (or if the
+        # proxy answered with a frame of its own) be conservative.
+        return client_writer.transport.get_write_buffer_size() > 0
+
+    def _expire(self, conn, tid):
+        """Give up on a request unanswered for `timeout` seconds and tell its client."""
+        entry = conn.in_flight.pop(tid, None)
+        if entry is None:
+            return
+        self._account(-1)
+        self.slots.release()
+        self.timeouts += 1
+        if self.timeouts == 1 or self.timeouts % 100 == 0:
+            print(f" Upstream #{conn.index}: no response within {self.timeout:g}s ({self.timeouts} timeouts)")
+        self._gateway_failed(entry)
+
+    @staticmethod
+    def _gateway_failed(entry):
+        """Answer a given-up request with exception 0x0B (gateway target failed to respond)."""
+        client_writer, client_tid, request = entry[:3]
+        if not client_writer.is_closing() and len(request) >= 8:
+            # MBAP (length 3) + unit, function | 0x80, exception code
+            client_writer.write(client_tid + b"\x00\x00\x00\x03" +
+                                bytes((request[6], request[7] | 0x80, GATEWAY_TARGET_FAILED)))
+
+    def _lost(self, conn, protocol, exc):
+        if conn.protocol is not protocol:
+            return  # An older connection, already replaced
+        if exc is not None:
+            print(f" Upstream #{conn.index} error: {exc}")
+        self._drop(conn)
+
+    def _drop(self, conn):
+        """Forget a dead upstream connection; it is reopened on next use.
+
+        Its in-flight requests are answered with exception 0x0B.
+        """
+        lost = len(conn.in_flight)
+        for entry in conn.in_flight.values():
+            entry[-1].cancel()
+            self.slots.release()
+            self._gateway_failed(entry)
+        if lost:
+            self._account(-lost)
+            print(f" Upstream #{conn.index} closed with {lost} request(s) in flight")
+        conn.in_flight.clear()
+        if conn.transport is not None:
+            conn.transport.close()
+        conn.transport = conn.protocol = None
+
+    async def close(self):
+        """Close every upstream connection."""
+        for conn in self.connections:
+            if conn.transport is not None:
+                self._drop(conn)
+        await asyncio.sleep(0)  # Let the transports run connection_lost()
+
+    def stats(self):
+        """Pool utilisation and queueing delay since start."""
+        now = time.monotonic()
+        busy = self._busy_integral + self._in_flight_total * (now - self._last_change)
+        elapsed = max(now - self.started_at, 1e-9)
+        delays = sorted(self.queue_delays)
+
+        def pct(p):
+            return delays[min(len(delays) - 1, int(p / 100.0 * len(delays)))] * 1e3 if delays else 0.0
+
+        return {
+            "connections": self.size,
+            "connected": sum(1 for c in self.connections if c.connected),
+            "capacity": self.capacity,
+            "in_flight": self._in_flight_total,
+            "queued": self.queued,
+            "timeouts": self.timeouts,
+            "utilisation": self._in_flight_total / self.capacity,
+            "mean_utilisation": busy / elapsed / self.capacity,
+            "requests_per_connection": [c.requests for c in self.connections],
+            "queue_delay_p50_ms": pct(50),
+            "queue_delay_p99_ms": pct(99),
+            "queue_delay_max_ms": delays[-1] * 1e3 if delays else 0.0,
+        }
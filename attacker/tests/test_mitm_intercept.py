@@ -0,0 +1,26 @@
+from mitm_replay_attack import ModbusMITM
+
+
+REQUEST = bytes((0, 1, 0, 0, 0, 6, 1, 4, 0, 0, 0, 2))  # FC04 read of 2 registers at address 0, unit 1
+
+
+def recording_mitm():
+    mitm = ModbusMITM("127.0.0.1", 502, 0)
+    mitm.set_mode("RECORD")
+    return mitm
+
+
+def test_record_keeps_valid_response():
+    mitm = recording_mitm()
+    response = bytes((0, 1, 0, 0, 0, 7, 1, 4, 4, 0, 1, 0, 2))
+    assert mitm.intercept_response(response, REQUEST) == response
+    assert mitm.replay_attack.samples_recorded == 1
+
+
+def test_record_forwards_inconsistent_responses():
+    mitm = recording_mitm()
+    short = bytes((0, 1, 0, 0, 0, 7, 1, 4, 4, 0, 1))         # byte count larger than the data
+    odd = bytes((0, 1, 0, 0, 0, 6, 1, 4, 3, 0, 1, 0))         # odd byte count
+    for response in (short, odd):
+        assert mitm.intercept_response(response, REQUEST) == response
+    assert mitm.replay_attack.samples_recorded == 0
@@ -0,0 +1,42 @@
+from modbus_controller import ModbusController
+
+
+class Result:
+    def __init__(self, registers=None):
+        self.registers = registers
+
+    def isError(self):
+        return self.registers is None
+
+
+class FakeClient:
+    """Input registers equal to their address; address 5 is illegal."""
+
+    def __init__(self):
+        self.requests = []
+
+    def read_input_registers(self, address, count, slave):
+        self.requests.append((address, count))
+        if address <= 5 < address + count:
+            return Result()
+        return Result(list(range(address, address + count)))
+
+    read_coils = read_discrete_inputs = read_holding_registers = read_input_registers
+
+
+def controller():
+    ctl = ModbusController.__new__(ModbusController)
+    ctl.client = FakeClient()
+    return ctl
+
+
+def test_read_many_retries_bridged_range_without_gaps():
+    ctl = controller()
+    assert ctl.read_many("input_registers", [0, 1, 10]) == {0: 0, 1: 1, 10: 10}
+    assert ctl.client.requests == [(0, 11), (0, 2), (10, 1)]
+
+
+def test_read_many_reports_requested_illegal_address():
+    ctl = controller()
+    assert ctl.read_many("input_registers", [4, 5, 6]) == {4: None, 5: None, 6: None}
+    assert ctl.client.requests == [(4, 3)]
@@ -0,0 +1,37 @@
+import numpy as np
+
+from replay_detector import ReplayDetector
+
+WIDTH = 95
+
+
+def noisy_vectors(rng, base, count):
+    """Live readings: i.i.d. +-1 LSB quantisation noise on every tag."""
+    return [base + rng.integers(-1, 2, WIDTH) for _ in range(count)]
+
+
+def test_no_periodic_noise_alarm_on_iid_quantisation_noise():
+    rng = np.random.default_rng(0)
+    base = rng.integers(20000, 40000, WIDTH)
+    detector = ReplayDetector(WIDTH)
+    alarms = []
+    for i, values in enumerate(noisy_vectors(rng, base, 20000)):
+        alarms += detector.update(values, i * 0.1)
+    assert alarms == []
+
+
+def test_periodic_noise_alarm_on_shifted_replay():
+    rng = np.random.default_rng(1)
+    base = rng.integers(20000, 40000, WIDTH)
+    recorded = noisy_vectors(rng, base, 500)
+    detector = ReplayDetector(WIDTH)
+    position = 0
+    for values in noisy_vectors(rng, base, 1000):
+        detector.update(values, position * 0.1)
+        position += 1
+    alarms = []
+    for loop in range(2):  # Shifted by another offset on each pass, so no vector repeats exactly
+        for values in recorded:
+            alarms += detector.update(values + 37 * (loop + 1), position * 0.1)
+            position += 1
+    assert [(alarm.kind, alarm.lag) for alarm in alarms] == [("noise", 500)]
@@ -0,0 +1,99 @@
+import asyncio
+
+from upstream_pool import UpstreamPool
+
+
+class FakeWriter:
+    def __init__(self):
+        self.frames = []
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.frames.append(bytes(data))
+
+
+def read_request(tid):
+    """FC04 read of 1 register at address 0, unit 1."""
+    return bytes((tid >> 8, tid & 0xFF, 0, 0, 0, 6, 1, 4, 0, 0, 0, 1))
+
+
+async def silent_server():
+    """Modbus server that accepts connections and never answers."""
+    async def handle(reader, writer):
+        await reader.read()
+        writer.close()
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def test_concurrent_submits_during_connect_use_separate_connections():
+    async def run():
+        server, port = await silent_server()
+        pool = UpstreamPool("127.0.0.1", port, size=2, max_in_flight=1, on_response=lambda *a: None)
+        writer = FakeWriter()
+        await asyncio.gather(pool.submit(writer, read_request(1)), pool.submit(writer, read_request(2)))
+        in_flight = [len(conn.in_flight) for conn in pool.connections]
+        connected = [conn.connected for conn in pool.connections]
+        await pool.close()
+        server.close()
+        return in_flight, connected
+
+    in_flight, connected = asyncio.run(run())
+    assert in_flight == [1, 1]
+    assert connected == [True, True]
+
+
+async def answering_server():
+    """Modbus server answering every FC04 read with one register of value 0."""
+    async def handle(reader, writer):
+        while True:
+            try:
+                request = await reader.readexactly(12)
+            except asyncio.IncompleteReadError:
+                break
+            writer.write(request[0:2] + bytes((0, 0, 0, 5, request[6], 4, 2, 0, 0)))
+        writer.close()
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+def gateway_failed(tid):
+    return bytes((tid >> 8, tid & 0xFF, 0, 0, 0, 3, 1, 0x84, 0x0B))
+
+
+def test_dropped_connection_answers_requests_in_flight():
+    async def run():
+        server, port = await silent_server()
+        pool = UpstreamPool("127.0.0.1", port, size=1, max_in_flight=1, on_response=lambda *a: None)
+        writer = FakeWriter()
+        await pool.submit(writer, read_request(7))
+        pool._drop(pool.connections[0])
+        server.close()
+        return writer.frames, pool.slots.locked()
+
+    frames, locked = asyncio.run(run())
+    assert frames == [gateway_failed(7)]
+    assert not locked
+
+
+def test_failing_response_handler_keeps_connection():
+    def on_response(writer, response, *rest):
+        raise ValueError("interceptor bug")
+
+    async def run():
+        server, port = await answering_server()
+        pool = UpstreamPool("127.0.0.1", port, size=1, max_in_flight=1, on_response=on_response)
+        writer = FakeWriter()
+        for tid in (1, 2):
+            await pool.submit(writer, read_request(tid))
+            await asyncio.sleep(0.05)
+        connected = pool.connections[0].connected
+        await pool.close()
+        server.close()
+        return writer.frames, connected
+
+    frames, connected = asyncio.run(run())
+    assert frames == [gateway_failed(1), gateway_failed(2)]
+    assert connected